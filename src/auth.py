@@ -1,27 +1,22 @@
 """ File contains functions for auth. """
 
-import hashlib
-import jwt
 import error
 import database
 import input_checkers
+import passwords
+import tokens
 
 DEFAULT_USER_IMG = "http://127.0.0.1:8080/static/bean.jpg"
 
 def create_handle_str(handle_str):
-    """ Given a handle_str, look through database to see if it is already taken.
-    Modify appropriately if taken. """
+    """ Given a handle_str, check the database to see if it is already taken.
+    If taken, add the next number counted for that handle_str, cutting the handle_str
+    so that it stays within 20 characters. """
 
-    number = 0
     handle_str_cpy = handle_str
-    for user in database.get_users():
-        if handle_str_cpy == user['handle_str']:
-            if len(handle_str) < 20:
-                handle_str_cpy = handle_str + str(number)
-            else:
-                handle_str = handle_str[:19]
-                handle_str_cpy = handle_str + str(number)
-            number += 1
+    while database.get_user_by_handle(handle_str_cpy) is not None:
+        number = str(database.next_handle_suffix(handle_str))
+        handle_str_cpy = handle_str[:20 - len(number)] + number
 
     return handle_str_cpy
 
@@ -35,26 +30,26 @@ def auth_login(email, password):
     if password_data is None:
         raise error.InputError(description="The email you entered is incorrect")
 
-    # Hash the password and see if it matches the hashed passowrd in the database
-    passcode = hashlib.sha256(password.encode()).hexdigest()
-
     # Check if password matches email
-    if password_data['password'] != passcode:
+    if not passwords.check_password(password, password_data['password']):
         raise error.InputError(description="The password you entered is incorrect")
 
+    # Passwords hashed by older versions are hashed again now the password is known
+    if passwords.needs_rehash(password_data['password']):
+        database.set_password(email, passwords.hash_password(password))
+
     # find user's u_id from email given
-    u_id = 0
-    for user in database.get_users():
-        if user['email'] == email:
-            u_id = user['u_id']
+    return create_session(database.get_user_by_email(email)['u_id'])
+
+def create_session(u_id):
+    """ Log in the user u_id, whose password has been checked. """
 
     # Check if already logged in.
     if database.get_token_from_user(u_id) is not None:
         raise error.AccessError(description="Cannot login when already logged in!")
 
     # Generate a token
-    payload = {'u_id': u_id}
-    token = str(jwt.encode(payload, 'jwt_secret', algorithm='HS256'))
+    token = tokens.create_token(u_id)
 
     dictionary = {'u_id': u_id, 'token': token}
     database.set_current_user(u_id, token)
@@ -67,16 +62,16 @@ def auth_logout(token):
     Returns True is user could be logged out, False otherwise.
     Implemented in database.py for direct access to database. """
 
+    # Signed tokens are checked without their session, so are revoked as well.
+    tokens.revoke_token(token)
     return {'is_success': database.remove_current_user(token)}
 
-@input_checkers.validate_email_format
-def auth_register(email, password, name_first, name_last):
-    """ Register a user into the database given details in parameters. """
+def check_register_details(email, password, name_first, name_last):
+    """ Raise InputError if the details given to auth_register aren't valid. """
 
     # Check if email is already being used by another user
-    for user in database.get_users():
-        if user['email'] == email:
-            raise error.InputError(description="The email you entered is already being used")
+    if database.get_user_by_email(email) is not None:
+        raise error.InputError(description="The email you entered is already being used")
 
     # Check if password is less than 6 characters long
     if len(password) < 6:
@@ -93,42 +88,57 @@ def auth_register(email, password, name_first, name_last):
         raise error.InputError(description="""The last name you entered is not between 1 and 50
                                            characters in length inclusive""")
 
-    # First we need to create a handle_str
-    handle_str = name_first.lower() + name_last.lower()
+@input_checkers.validate_email_format
+def auth_register(email, password, name_first, name_last):
+    """ Register a user into the database given details in parameters. """
+
+    # Check the details before hashing the password, as hashing is slow
+    check_register_details(email, password, name_first, name_last)
+
+    # Encode the password, before taking the users table for the same reason
+    passcode = passwords.hash_password(password)
+
+    # Hold the users table while checking the email is still free, so that
+    # two registrations can't both take it.
+    with database.table_lock("users"):
+        if database.get_user_by_email(email) is not None:
+            raise error.InputError(description="The email you entered is already being used")
 
-    # If len(handle_str) > 20 then we need to cut the handle_str to an appropriate length
-    if len(handle_str) > 20:
-        handle_str = handle_str[:20]
+        # First we need to create a handle_str
+        handle_str = name_first.lower() + name_last.lower()
 
-    # Check if handle_str is already taken and modify appropriately
-    handle_str = create_handle_str(handle_str)
+        # If len(handle_str) > 20 then we need to cut the handle_str to an appropriate length
+        if len(handle_str) > 20:
+            handle_str = handle_str[:20]
 
-    # Now we need to assign a u_id
-    # u_id generated in order of registration
-    # Add 1 to u_id of most recent user
-    u_id = database.generate_u_id()
+        # Check if handle_str is already taken and modify appropriately
+        handle_str = create_handle_str(handle_str)
 
-    # Now we add user to the list of dictionaries
-    user = {'u_id': u_id,
-            'email': email,
-            'name_first': name_first,
-            'name_last': name_last,
-            'handle_str': handle_str,
-            'profile_img_url': DEFAULT_USER_IMG}
+        # Now we need to assign a u_id
+        # u_id generated in order of registration
+        # Add 1 to u_id of most recent user
+        u_id = database.generate_u_id()
 
-    # Now check if this is the first person to join the slackr
-    if database.get_users() == []:
-        database.set_permissions(u_id, 1)
-    else:
-        database.set_permissions(u_id, 2)
+        # Now we add user to the list of dictionaries
+        user = {'u_id': u_id,
+                'email': email,
+                'name_first': name_first,
+                'name_last': name_last,
+                'handle_str': handle_str,
+                'profile_img_url': DEFAULT_USER_IMG}
 
-    database.set_user_data(user)
+        # Now check if this is the first person to join the slackr
+        # u_ids are counted from 1 and users are never deleted, so only the
+        # first user is given u_id 1, without reading every user
+        if u_id == 1:
+            database.set_permissions(u_id, 1)
+        else:
+            database.set_permissions(u_id, 2)
 
-    # Encode the password
-    passcode = hashlib.sha256(password.encode()).hexdigest()
+        database.set_user_data(user)
 
-    # Associate email to password in PASSWORD_DATA
-    database.set_password(email, passcode)
+        # Associate email to password in PASSWORD_DATA
+        database.set_password(email, passcode)
 
-    # We now login the user using auth_login
-    return auth_login(email, password)
+    # We now login the user, without checking the password just hashed
+    return create_session(u_id)
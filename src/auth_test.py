@@ -2,9 +2,11 @@
 
 import pytest
 
-from user import user_profile
+from user import user_profile, user_profile_sethandle
 import auth
+import database
 import error
+from input_checkers_test import count_calls
 
 ####################################################################
 #
@@ -178,3 +180,29 @@ def test_register_handle_taken_long():
 
     assert user_p1.get('user').get('handle_str') == "a"*20
     assert user_p2.get('user').get('handle_str') == "a"*19 + "0"
+
+def test_register_handle_taken_many():
+    """ Test that each registration with the same name takes the next number. """
+    users = [auth.auth_register(f"valid_email{i}@email.com", "pa55w0rd", "Kate", "Young")
+             for i in range(12)]
+
+    handles = [user_profile(user['token'], user['u_id'])['user']['handle_str'] for user in users]
+    assert handles == ["kateyoung"] + [f"kateyoung{i}" for i in range(11)]
+
+def test_register_handle_after_sethandle():
+    """ Test that a handle given up with sethandle can be taken again. """
+    user1 = auth.auth_register("valid_email@email.com", "pa55w0rd", "Kate", "Young")
+    user_profile_sethandle(user1['token'], "kate")
+    user2 = auth.auth_register("valid_email2@email.com", "pa55w0rd", "Kate", "Young")
+
+    assert user_profile(user2['token'], user2['u_id'])['user']['handle_str'] == "kateyoung"
+
+def test_register_first_user_owner(monkeypatch):
+    """ Test that only the first user is an owner, without reading every user. """
+    users_read = count_calls(monkeypatch, "get_users")
+    owner = auth.auth_register("valid_email@email.com", "pa55w0rd", "Kate", "Young")
+    member = auth.auth_register("valid_email2@email.com", "pa55w0rd", "Kate", "Young")
+
+    assert database.get_permission_dict(owner['u_id'])['permission_id'] == 1
+    assert database.get_permission_dict(member['u_id'])['permission_id'] == 2
+    assert users_read == []
@@ -0,0 +1,262 @@
+"""
+Benchmarks for the hot paths of the backend.
+
+Run from the src directory with:
+    python3 benchmark.py
+"""
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import timeit
+from itertools import islice
+
+import database
+import input_checkers
+import passwords
+import search_index
+import sqlite_storage
+
+@input_checkers.validate_token
+def validated_route(token):
+    """ Stand-in for a route function that only needs a valid token. """
+    # pylint: disable=unused-argument
+    return {}
+
+def benchmark_validate_token(session_counts=(10, 1000, 100000, 1000000), repeats=5,
+                             number=100000):
+    """
+    Time validate_token against an increasing number of logged in sessions.
+    Returns a list of {num_sessions, usec_per_call} dictionaries.
+    """
+    results = []
+    for num_sessions in session_counts:
+        database.clear_database()
+        for u_id in range(num_sessions):
+            database.set_current_user(u_id, f"token{u_id}")
+
+        # Check the most recently logged in user, which was the worst case
+        # when sessions were stored in a list.
+        token = f"token{num_sessions - 1}"
+        timer = timeit.Timer(lambda token=token: validated_route(token))
+        best = min(timer.repeat(repeat=repeats, number=number))
+        results.append({'num_sessions': num_sessions,
+                        'usec_per_call': best / number * 1e6})
+
+    database.clear_database()
+    return results
+
+def benchmark_snapshot_load(message_counts=(10000, 100000, 1000000)):
+    """
+    Time loading a snapshot of a channel holding an increasing number of
+    messages, in each snapshot format.
+    Returns a list of {num_messages, format, seconds} dictionaries.
+    """
+    results = []
+    old_paths = (database.DATABASE_PATH, database.WAL_PATH, database.WAL_COMPACTING_PATH)
+    old_format = database.SNAPSHOT_FORMAT
+    with tempfile.TemporaryDirectory() as tmp_path:
+        database.DATABASE_PATH = tmp_path
+        database.WAL_PATH = os.path.join(tmp_path, "wal.log")
+        database.WAL_COMPACTING_PATH = os.path.join(tmp_path, "wal.log.compacting")
+        for num_messages in message_counts:
+            database.clear_database()
+            database.set_channel({'channel_id': 1, 'name': "benchmark"})
+            for message_id in range(num_messages):
+                database.set_message(1, {'message_id': message_id, 'u_id': 1,
+                                         'message': f"message number {message_id}",
+                                         'time_created': 0,
+                                         'reacts': [{'react_id': 1, 'u_ids': [],
+                                                     'is_this_user_reacted': False}],
+                                         'is_pinned': False})
+            snapshot = database.capture_snapshot()
+
+            for snapshot_format in database.SNAPSHOT_EXTENSIONS:
+                for name, data in snapshot.items():
+                    database.write_snapshot_file(name, data, snapshot_format)
+
+                database.SNAPSHOT_FORMAT = snapshot_format
+                start = time.perf_counter()
+                database.retrieve_data_from_files()
+                results.append({'num_messages': num_messages, 'format': snapshot_format,
+                                'seconds': time.perf_counter() - start})
+
+    database.DATABASE_PATH, database.WAL_PATH, database.WAL_COMPACTING_PATH = old_paths
+    database.SNAPSHOT_FORMAT = old_format
+    database.clear_database()
+    return results
+
+def benchmark_search(message_counts=(10000, 100000, 1000000), repeats=5, number=100):
+    """
+    Time searching for a word found in one message in a hundred, against an
+    increasing number of messages spread over ten channels.
+    Returns a list of {num_messages, usec_per_call, usec_per_page_of_50}
+    dictionaries.
+    """
+    results = []
+    channel_ids = list(range(1, 11))
+    for num_messages in message_counts:
+        database.clear_database()
+        texts = {}
+        for channel_id in channel_ids:
+            search_index.index_channel(channel_id, [])
+        for message_id in range(num_messages):
+            word = "needle" if message_id % 100 == 0 else "hay"
+            texts[message_id] = f"message {message_id} {word}"
+            search_index.index_message(channel_ids[message_id % 10],
+                                       {'message_id': message_id, 'time_created': message_id,
+                                        'message': texts[message_id]})
+
+        timer = timeit.Timer(lambda: list(search_index.search(channel_ids, "needle", texts.get)))
+        best = min(timer.repeat(repeat=repeats, number=number))
+        page_timer = timeit.Timer(
+            lambda: list(islice(search_index.search(channel_ids, "needle", texts.get), 50)))
+        best_page = min(page_timer.repeat(repeat=repeats, number=number))
+        results.append({'num_messages': num_messages,
+                        'usec_per_call': best / number * 1e6,
+                        'usec_per_page_of_50': best_page / number * 1e6})
+
+    database.clear_database()
+    return results
+
+def benchmark_channel_messages(message_counts=(10000, 100000), repeats=5, number=1000):
+    """
+    Time reading the newest page of a channel holding an increasing number
+    of messages, with each storage engine.
+    Returns a list of {num_messages, engine, usec_per_page} dictionaries.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_path:
+        for num_messages in message_counts:
+            for engine in database.STORAGE_ENGINES:
+                if engine == "sqlite":
+                    sqlite_storage.open_database(os.path.join(tmp_path, f"{num_messages}.sqlite3"))
+                database.select_storage_engine(engine)
+                database.clear_database()
+                database.set_channel({'channel_id': 1, 'name': "benchmark"})
+                with database.channel_lock(1):
+                    for message_id in range(num_messages):
+                        database.set_message(1, {'message_id': message_id, 'u_id': 1,
+                                                 'message': f"message number {message_id}",
+                                                 'reacts': [], 'is_pinned': False})
+
+                def read_page():
+                    database.get_num_messages(1)
+                    database.get_channel_messages(1, 0, 50)
+                timer = timeit.Timer(read_page)
+                best = min(timer.repeat(repeat=repeats, number=number))
+                results.append({'num_messages': num_messages, 'engine': engine,
+                                'usec_per_page': best / number * 1e6})
+
+    database.select_storage_engine("memory")
+    database.clear_database()
+    return results
+
+def hold_channel_lock(path, channel_id, held, release):
+    """ Hold a channel's lock in the SQLite database at path, until release is set. """
+    sqlite_storage.open_database(path)
+    database.use_storage_engine(sqlite_storage)
+    with database.channel_lock(channel_id):
+        held.set()
+        release.wait()
+
+def benchmark_channel_lock_contention(number=200):
+    """
+    Time a route's locked read and locked write of one channel of an SQLite
+    database, while another process holds a different channel's lock, as a
+    slow route on that channel would.
+    Returns a list of {operation, usec_per_call} dictionaries.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_path:
+        path = os.path.join(tmp_path, "contention.sqlite3")
+        sqlite_storage.open_database(path)
+        database.use_storage_engine(sqlite_storage)
+        for channel_id in (1, 2):
+            database.set_channel({'channel_id': channel_id, 'name': "benchmark"})
+
+        context = multiprocessing.get_context("fork")
+        held, release = context.Event(), context.Event()
+        holder = context.Process(target=hold_channel_lock, args=(path, 1, held, release))
+        holder.start()
+        held.wait()
+        # Stop waiting on the write lock after a second, rather than SQLite's 30.
+        sqlite_storage.execute("PRAGMA busy_timeout = 1000")
+        message_ids = iter(range(number))
+        try:
+            def locked_read():
+                with database.channel_lock(2):
+                    database.get_channel_data(2)
+            def locked_write():
+                with database.channel_lock(2):
+                    database.set_message(2, {'message_id': next(message_ids), 'u_id': 1,
+                                             'message': "contention", 'time_created': 0,
+                                             'reacts': [], 'is_pinned': False})
+            for operation, function in (("locked_read", locked_read),
+                                        ("locked_write", locked_write)):
+                start = time.perf_counter()
+                try:
+                    for _ in range(number):
+                        function()
+                    usec_per_call = (time.perf_counter() - start) / number * 1e6
+                except sqlite3.OperationalError:
+                    # Waited a second for the other process's write lock.
+                    usec_per_call = float("inf")
+                results.append({'operation': operation, 'usec_per_call': usec_per_call})
+        finally:
+            sqlite_storage.execute("PRAGMA busy_timeout = 30000")
+            release.set()
+            holder.join()
+
+    database.use_storage_engine(None)
+    database.clear_database()
+    return results
+
+def benchmark_password_hashing(thread_counts=(1, 4, 16), hashes_per_thread=8):
+    """
+    Time hashing passwords with each KDF, from an increasing number of
+    request threads at once.
+    Returns a list of {kdf, threads, count, p50, p90, p99} dictionaries, in
+    milliseconds per hash.
+    """
+    results = []
+    old_kdf = passwords.PASSWORD_KDF
+    for kdf in passwords.KDF_PARAMS:
+        passwords.PASSWORD_KDF = kdf
+        for num_threads in thread_counts:
+            passwords.HASH_LATENCIES.clear()
+            threads = [threading.Thread(target=lambda: [passwords.hash_password("password")
+                                                        for _ in range(hashes_per_thread)])
+                       for _ in range(num_threads)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            results.append({'kdf': kdf, 'threads': num_threads,
+                            **passwords.get_hash_latencies()})
+
+    passwords.PASSWORD_KDF = old_kdf
+    return results
+
+BENCHMARKS = {
+    'validate_token': benchmark_validate_token,
+    'snapshot_load': benchmark_snapshot_load,
+    'search': benchmark_search,
+    'channel_messages': benchmark_channel_messages,
+    'channel_lock_contention': benchmark_channel_lock_contention,
+    'password_hashing': benchmark_password_hashing,
+}
+
+def main(names):
+    """ Run the benchmarks given by name, or all of them if none given. """
+    for name in names or BENCHMARKS:
+        print(f"{name}:")
+        for result in BENCHMARKS[name]():
+            print("    " + ", ".join(f"{key}={value:.3f}" if isinstance(value, float)
+                                    else f"{key}={value}" for key, value in result.items()))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -9,6 +9,8 @@ import channels
 import message
 import error
 import auth
+import user
+import database
 
 
 ############################################################################################
@@ -40,6 +42,43 @@ def test_details_valid():
     # ensure the name of the channel is "test rum ham"
     assert details["name"] == "test rum ham"
 
+def test_details_pages():
+    """
+    Tests that channel_details returns all_members a page at a time when given a limit
+    """
+    test_dict = auth.auth_register("test@email.com", "password", "Bob", "Ross")
+    c_id_dict = channels.channels_create(test_dict["token"], "test rum ham", True)
+    members = [test_dict] + [auth.auth_register(f"test{i}@email.com", "password", "James", "May")
+                             for i in range(4)]
+    for member in members[1:]:
+        channel.channel_join(member["token"], c_id_dict["channel_id"])
+
+    first_page = channel.channel_details(test_dict["token"], c_id_dict["channel_id"], 0, 3)
+    assert [user["u_id"] for user in first_page["all_members"]] == \
+        [member["u_id"] for member in members[:3]]
+    assert first_page["end"] == 3
+    last_page = channel.channel_details(test_dict["token"], c_id_dict["channel_id"], 3, 3)
+    assert [user["u_id"] for user in last_page["all_members"]] == \
+        [member["u_id"] for member in members[3:]]
+    assert last_page["end"] == -1
+    assert last_page["owner_members"] == first_page["owner_members"]
+
+    with pytest.raises(error.InputError):
+        channel.channel_details(test_dict["token"], c_id_dict["channel_id"], 0, 0)
+
+def test_details_after_setname():
+    """
+    Tests that channel_details shows a member's new name once they change it
+    """
+    test_dict = auth.auth_register("test@email.com", "password", "Bob", "Ross")
+    c_id_dict = channels.channels_create(test_dict["token"], "test rum ham", True)
+    channel.channel_details(test_dict["token"], c_id_dict["channel_id"])
+
+    user.user_profile_setname(test_dict["token"], "Robert", "Ross")
+    details = channel.channel_details(test_dict["token"], c_id_dict["channel_id"])
+    assert details["owner_members"][0]["name_first"] == "Robert"
+    assert details["all_members"][0]["name_first"] == "Robert"
+
 def test_details_nvid():
     """
     Tests if channel_details raises an InputError when channel ID is not valid
@@ -145,6 +184,24 @@ def test_mesages_pagination():
     # check that messages returns correct end number
     assert sent_messages["end"] == 60 + 50
 
+def test_messages_react_per_user():
+    """
+    tests that each user sees whether they reacted, without changing the stored message
+    """
+    owner = auth.auth_register("test@email.com", "password", "Bob", "Ross")
+    other_user = auth.auth_register("test2@email.com", "password", "Bill", "Ross")
+    c_id_dict = channels.channels_create(owner["token"], "test channel", True)
+    channel.channel_join(other_user["token"], c_id_dict["channel_id"])
+    message_file = message.message_send(owner["token"], c_id_dict["channel_id"], "Test mess!")
+    message.message_react(owner["token"], message_file["message_id"], 1)
+
+    owner_view = channel.channel_messages(owner["token"], c_id_dict["channel_id"], 0)
+    other_view = channel.channel_messages(other_user["token"], c_id_dict["channel_id"], 0)
+    assert owner_view["messages"][0]["reacts"][0]["is_this_user_reacted"] is True
+    assert other_view["messages"][0]["reacts"][0]["is_this_user_reacted"] is False
+    stored = database.get_message(message_file["message_id"])
+    assert stored["reacts"][0]["is_this_user_reacted"] is False
+
 def test_messages_nvid():
     """
     tests if channel_messages returns an InputError when channel ID is not a valid channel
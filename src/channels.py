@@ -6,22 +6,13 @@ from channel import channel_join
 import input_checkers
 
 @input_checkers.validate_token
-def channels_list(token):
+def channels_list(token, *, auth_u_id):
     """ Returns {channels}, where channels is a list of channels that the user is part of.
     i.e. {'channels': [{channel_id, name}, {channel_id, name}]} """
+    # pylint: disable=unused-argument
 
-    u_id = database.get_current_user(token)
-
-    output = {'channels': []}
-
-    # obtain channels so that I can see lists of members
-    # insert channel into the output list if user is a member
-    for channel in database.get_channels():
-        channeldata = database.get_channel_data(channel['channel_id'])
-        if u_id in channeldata['member_ids']:
-            output['channels'].append(channel)
-
-    return output
+    # the database indexes the channels each user is a member of
+    return {'channels': database.get_user_channels(auth_u_id)}
 
 @input_checkers.validate_token
 def channels_listall(token):
@@ -46,11 +37,9 @@ def channels_create(token, name, is_public):
         raise error.InputError(description="The name you entered is more than 20 characters long")
 
     # Generate a channel_id for the new channel
-    # Simply done in order of time of creation (1..)
-    # Generation of channel_id will be done in this way as long as ability to delete channels
-    # remains unimplemented
-    num_channels = len(database.get_channels())
-    channel_id = num_channels + 1
+    # The database counts the channel ids handed out, so two new channels
+    # never take the same id, even if they are created at once
+    channel_id = database.generate_channel_id()
 
     # Use database.set_channel to create channel in the database
     channel = {'channel_id': channel_id, 'name': name}
@@ -4,9 +4,16 @@ File for handling pytest session fixtures
 import urllib.request
 import pytest
 import database
+import passwords
 
 URL = "http://127.0.0.1:8080"
 
+# Tests register many users, so passwords are hashed as cheaply as possible.
+CHEAP_KDF_PARAMS = {
+    'scrypt': {'n': 2, 'r': 1, 'p': 1},
+    'pbkdf2_sha256': {'iterations': 1},
+}
+
 
 # Rquest parameter parses in the context the fixture
 # is run in.
@@ -22,3 +29,12 @@ def clean_database(request):
     if module_prefix[0] == "server":
         clear_request = urllib.request.Request(f"{URL}/workspace/reset", method="POST")
         urllib.request.urlopen(clear_request)
+
+
+@pytest.fixture(autouse=True, scope="session")
+def cheap_password_hashing():
+    """ Hash passwords with the lowest KDF costs for the whole test session. """
+    saved = {kdf: dict(params) for kdf, params in passwords.KDF_PARAMS.items()}
+    passwords.KDF_PARAMS.update(CHEAP_KDF_PARAMS)
+    yield
+    passwords.KDF_PARAMS.update(saved)
@@ -0,0 +1,26 @@
+"""
+Convert the snapshot files in the database directory between formats.
+
+Usage, from the src directory:
+    python3 convert_database.py json binary
+
+Then start the server with SLACKR_SNAPSHOT_FORMAT=binary to use the new files.
+"""
+import sys
+
+import database
+
+def main(from_format, to_format):
+    """ Convert every snapshot file from from_format to to_format. """
+    for snapshot_format in (from_format, to_format):
+        if snapshot_format not in database.SNAPSHOT_EXTENSIONS:
+            sys.exit(f"Unknown snapshot format '{snapshot_format}', expected one of: "
+                     + ", ".join(database.SNAPSHOT_EXTENSIONS))
+
+    database.convert_snapshot(from_format, to_format)
+    print(f"Converted {from_format} snapshot files to {to_format}.")
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit(__doc__)
+    main(sys.argv[1], sys.argv[2])
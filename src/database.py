@@ -8,8 +8,20 @@ import threading
 import time
 import os
 import json
+import gc
+import hashlib
+import mmap
+import pickle
+import struct
+
+from collections import OrderedDict
+from contextlib import ExitStack
+from functools import wraps
+from inspect import getfullargspec, signature
 
 import error
+import search_index
+import sqlite_storage
 
 DATABASE_PATH = os.path.join(os.path.dirname(__file__), '../database')
 
@@ -25,13 +37,22 @@ USERS = []
 # [ {u_id, permission_id} , ...]
 USER_GLOBAL_PERMISSIONS_LIST = []
 
-# [ {u_id, token} , {u_id, token} , ... ]
-CURRENT_USERS = []
+# Logged in sessions, indexed in both directions.
+# {token: u_id, token: u_id, ... }
+CURRENT_USERS = {}
+# {u_id: token, u_id: token, ... }
+CURRENT_TOKENS = {}
+
+# {token_id: expires_at, ... }
+# Signed tokens revoked by logging out, kept until they expire.
+REVOKED_TOKENS = {}
 
 # [ {channel_id, name} , {channel_id, name} ]
 CHANNELS = []
 
 # [ {channel_id, owner_ids, member_ids, messages, is_public} , ... ]
+# messages are stored oldest first, so that sending a message is an append.
+# owner_ids and member_ids are MemberSets, so membership checks are O(1).
 CHANNEL_DATA_LIST = []
 
 # [ {message_id, channel_id} , {message_id, channel_id} ]
@@ -43,82 +64,438 @@ PASSWORD_DATA_LIST = []
 # {num_users}
 NUM_USERS = {'num_users': 0}
 
+# [ {message_id, channel_id, u_id, message, time_sent} , ... ]
+# Messages from message_sendlater that haven't been sent yet.
+SCHEDULED_MESSAGES = []
+
+# {next_message_id, num_channels, resets}
+# How many of each kind of id have been reserved by reserve_ids, and how
+# many times the database has been cleared.
+MESSAGE_IDS = {'next_message_id': 0, 'num_channels': 0, 'resets': 0}
+
+# {version}
+# The layout of the snapshot files, see SNAPSHOT_VERSION.
+SNAPSHOT_INFO = {}
+
+###############################################################
+#
+#                        Table Indexes
+#
+###############################################################
+
+# Primary key indexes for the lists above. Each maps a key to the same
+# dictionary that is stored in the list, so updating one updates both.
+# These are kept in sync by the set_* and remove_* functions below.
+
+# {u_id: user}
+USERS_INDEX = {}
+
+# {u_id: permission_dict}
+PERMISSIONS_INDEX = {}
+
+# {channel_id: channel}
+CHANNELS_INDEX = {}
+
+# {channel_id: channel_data}
+CHANNEL_DATA_INDEX = {}
+
+# {message_id: message_location}
+MESSAGE_LOCATION_INDEX = {}
+
+# {message_id: message}
+# Holds the message dictionaries stored in each channel_data's messages.
+MESSAGE_INDEX = {}
+
+# {email: password_data}
+PASSWORD_DATA_INDEX = {}
+
+# {message_id: scheduled_message}
+SCHEDULED_MESSAGES_INDEX = {}
+
+# {email: user} and {handle_str: user}
+# So that registering or changing an email or handle doesn't check every
+# user. Kept in sync by set_user_data.
+USERS_BY_EMAIL_INDEX = {}
+USERS_BY_HANDLE_INDEX = {}
+
+# {u_id: (email, handle_str)}
+# The keys each user was last indexed under. Routes change users in
+# place, so this is how set_user_data finds the keys to remove.
+INDEXED_USER_KEYS = {}
 
+# {handle_str: next suffix}
+# The suffix to try next when handle_str is taken, so that registering
+# many users with the same name doesn't try every suffix already used.
+HANDLE_SUFFIXES = {}
+
+# {u_id: {u_id, name_first, name_last, profile_img_url}}
+# The part of each user shown in channel_details, built the first time it
+# is asked for. set_user_data drops a user's entry when they change.
+USER_PROFILES_CACHE = {}
+
+# {u_id: {channel_id, ...}}
+# The channels each user is a member of, so channels_list doesn't read
+# every channel. Kept in sync by set_channel_data.
+USER_CHANNELS_INDEX = {}
+
+# {channel_id: {u_id, ...}}
+# The member_ids USER_CHANNELS_INDEX was last updated from. Routes change
+# member_ids in place, so this is how set_channel_data finds who left.
+INDEXED_MEMBER_IDS = {}
+
+def rebuild_indexes():
+    """ Rebuild every index from the lists they index. """
+
+    USERS_INDEX.clear()
+    USERS_INDEX.update((user['u_id'], user) for user in USERS)
+
+    USERS_BY_EMAIL_INDEX.clear()
+    USERS_BY_HANDLE_INDEX.clear()
+    INDEXED_USER_KEYS.clear()
+    HANDLE_SUFFIXES.clear()
+    for user in USERS:
+        index_user(user)
+
+    PERMISSIONS_INDEX.clear()
+    PERMISSIONS_INDEX.update((perm['u_id'], perm) for perm in USER_GLOBAL_PERMISSIONS_LIST)
+
+    CHANNELS_INDEX.clear()
+    CHANNELS_INDEX.update((channel['channel_id'], channel) for channel in CHANNELS)
+
+    CHANNEL_DATA_INDEX.clear()
+    CHANNEL_DATA_INDEX.update((channel_data['channel_id'], channel_data)
+                              for channel_data in CHANNEL_DATA_LIST)
+
+    MESSAGE_LOCATION_INDEX.clear()
+    MESSAGE_LOCATION_INDEX.update((location['message_id'], location)
+                                  for location in MESSAGE_LOCATION_LIST)
+
+    # Only histories that are loaded are indexed, see load_history.
+    MESSAGE_INDEX.clear()
+    MESSAGE_INDEX.update((message['message_id'], message)
+                         for channel_data in CHANNEL_DATA_LIST if 'messages' in channel_data
+                         for message in channel_data['messages'])
+
+    LOADED_HISTORIES.clear()
+    LOADED_HISTORIES.update((channel_data['channel_id'], len(channel_data['messages']))
+                            for channel_data in CHANNEL_DATA_LIST if 'messages' in channel_data)
+    HISTORY_CACHE['num_messages'] = sum(LOADED_HISTORIES.values())
+
+    PASSWORD_DATA_INDEX.clear()
+    PASSWORD_DATA_INDEX.update((pwd_data['email'], pwd_data) for pwd_data in PASSWORD_DATA_LIST)
+
+    SCHEDULED_MESSAGES_INDEX.clear()
+    SCHEDULED_MESSAGES_INDEX.update((scheduled['message_id'], scheduled)
+                                    for scheduled in SCHEDULED_MESSAGES)
+
+    USER_PROFILES_CACHE.clear()
+
+    USER_CHANNELS_INDEX.clear()
+    INDEXED_MEMBER_IDS.clear()
+    for channel_data in CHANNEL_DATA_LIST:
+        index_channel_members(channel_data['channel_id'], channel_data['member_ids'])
 
 
+###############################################################
+#
+#                        Storage Engine
+#
+###############################################################
+
+# By default the database is held in the lists above, in this process's
+# memory. A storage engine is a module providing the same get_* and set_*
+# functions, which are then called in place of the ones here.
+# sqlite_storage is one, and lets several server processes share the
+# database.
+STORAGE = {'engine': None}
+
+# {name: engine}, where the 'memory' engine is the lists above.
+STORAGE_ENGINES = {'memory': None, 'sqlite': sqlite_storage}
+
+# Names of the functions every storage engine provides, added by @stored.
+STORED_FUNCTIONS = []
+
+def use_storage_engine(engine):
+    """
+    Store the database with the engine module, or in memory if engine is None.
+    Raises ValueError if the engine is missing any of the stored functions.
+    """
+    missing = [name for name in STORED_FUNCTIONS
+               if engine is not None and not hasattr(engine, name)]
+    if missing:
+        raise ValueError(f"Storage engine {engine.__name__} is missing {', '.join(missing)}")
+    STORAGE['engine'] = engine
+    # Ids reserved from the old storage aren't reserved in the new one.
+    drop_id_blocks()
+
+def select_storage_engine(name):
+    """
+    Store the database with the engine called name in STORAGE_ENGINES.
+    Engines other than 'memory' must be opened first.
+    """
+    if name not in STORAGE_ENGINES:
+        raise ValueError(f"Unknown storage engine {name}, choose from "
+                         f"{', '.join(STORAGE_ENGINES)}")
+    use_storage_engine(STORAGE_ENGINES[name])
+
+def stored(func):
+    """
+    Decorator for the functions making up the database's API, which hands
+    each call on to the storage engine in use, if there is one.
+    """
+    name = func.__name__
+    STORED_FUNCTIONS.append(name)
+    @wraps(func)
+    def wrapper_func(*args, **kwargs):
+        """ Wrapper function """
+        engine = STORAGE['engine']
+        if engine is None:
+            return func(*args, **kwargs)
+        return getattr(engine, name)(*args, **kwargs)
+    return wrapper_func
+
+###############################################################
+#
+#                           Locks
+#
+###############################################################
+
+# Flask runs requests on many threads, alongside the scheduler and backup
+# threads, so every change to the database is made while holding a lock.
+# Each channel has its own lock guarding its channel_data and messages, and
+# each of the other tables has its own lock, so requests working on
+# different channels or tables never wait on each other.
+#
+# The locks are re-entrant, so a route can hold a channel's lock across a
+# read-modify-write while the set_* functions it calls take it again.
+# To avoid deadlocks, channel locks are taken before table locks, table locks
+# are taken in the order listed here, and WAL_LOCK is taken last of all.
+# Reads of a single row don't lock, as dictionary lookups are atomic.
+TABLE_LOCKS = {table: threading.RLock() for table in (
+    "users", "permissions", "sessions", "revoked_tokens", "channels", "user_channels",
+    "message_locations", "passwords", "num_users", "scheduled_messages", "message_ids",
+    "histories")}
+
+# {channel_id: lock}
+CHANNEL_LOCKS = {}
+
+@stored
+def table_lock(table):
+    """ Return the lock guarding a table. """
+    return TABLE_LOCKS[table]
+
+@stored
+def channel_lock(channel_id):
+    """ Return the lock guarding a channel's channel_data and messages. """
+
+    lock = CHANNEL_LOCKS.get(channel_id)
+    if lock is None:
+        # setdefault is atomic, so two threads can't create different locks.
+        lock = CHANNEL_LOCKS.setdefault(channel_id, threading.RLock())
+    return lock
+
+def locks_channel(func):
+    """
+    Decorator which holds a channel's lock for the whole of a route, so its
+    read-modify-write of the channel can't interleave with another request's.
+    The channel is taken from the channel_id argument, or else from where the
+    message in the message_id argument is stored.
+    """
+    argspec = getfullargspec(func)
+    @wraps(func)
+    def wrapper_func(*args, **kwargs):
+        """ Wrapper function """
+        if "channel_id" in argspec.args:
+            channel_id = args[argspec.args.index("channel_id")]
+        else:
+            message_location = get_message_location(args[argspec.args.index("message_id")])
+            if message_location is None:
+                return func(*args, **kwargs)
+            channel_id = message_location['channel_id']
+
+        with channel_lock(channel_id):
+            return func(*args, **kwargs)
+    wrapper_func.__signature__ = signature(func)
+    # Checks from input_checkers take the lock themselves, before looking up
+    # the channel or message.
+    wrapper_func.locks_channel = True
+    return wrapper_func
+
 ###############################################################
 #
 #                        User Data
 #
 ###############################################################
 
+@stored
 def get_users():
     """ Returns a the list of registered USERS. """
     return USERS
 
+@stored
 def get_user_data(u_id):
     """
     Returns the dictionary matching the ID provided.
     If no match, then will return None.
     """
 
-    for user in USERS:
-        if user['u_id'] == u_id:
-            return user
-
-    return None
+    return USERS_INDEX.get(u_id)
 
+@stored
 def set_user_data(user):
     """ Adds/Updates the information stored for a user. """
 
-    target_user = get_user_data(user['u_id'])
-    if target_user is None:
-        USERS.append(user)
-    else:
-        target_user['u_id'] = user['u_id']
-        target_user['email'] = user['email']
-        target_user['name_first'] = user['name_first']
-        target_user['name_last'] = user['name_last']
-        target_user['handle_str'] = user['handle_str']
-        # target_user['profile_img_url'] = user['profile_img_url']
+    with table_lock("users"):
+        target_user = get_user_data(user['u_id'])
+        if target_user is None:
+            USERS.append(user)
+            USERS_INDEX[user['u_id']] = user
+        else:
+            target_user['u_id'] = user['u_id']
+            target_user['email'] = user['email']
+            target_user['name_first'] = user['name_first']
+            target_user['name_last'] = user['name_last']
+            target_user['handle_str'] = user['handle_str']
+            # target_user['profile_img_url'] = user['profile_img_url']
+        index_user(USERS_INDEX[user['u_id']])
+        USER_PROFILES_CACHE.pop(user['u_id'], None)
+
+        log_mutation('users', USERS_INDEX[user['u_id']])
+
+def index_user(user):
+    """
+    Index the stored user dictionary under its email and handle_str,
+    removing the keys it was indexed under before if they have changed.
+    """
+
+    old_email, old_handle = INDEXED_USER_KEYS.get(user['u_id'], (None, None))
+    if old_email != user['email'] and USERS_BY_EMAIL_INDEX.get(old_email) is user:
+        del USERS_BY_EMAIL_INDEX[old_email]
+    if old_handle != user['handle_str'] and USERS_BY_HANDLE_INDEX.get(old_handle) is user:
+        del USERS_BY_HANDLE_INDEX[old_handle]
+
+    USERS_BY_EMAIL_INDEX[user['email']] = user
+    USERS_BY_HANDLE_INDEX[user['handle_str']] = user
+    INDEXED_USER_KEYS[user['u_id']] = (user['email'], user['handle_str'])
 
+@stored
+def get_user_by_email(email):
+    """ Returns the user with the email, or None if no user has it. """
+    return USERS_BY_EMAIL_INDEX.get(email)
 
+@stored
+def get_user_by_handle(handle_str):
+    """ Returns the user with the handle_str, or None if no user has it. """
+    return USERS_BY_HANDLE_INDEX.get(handle_str)
+
+@stored
+def next_handle_suffix(handle_str):
+    """
+    Returns the next number to try adding to handle_str when it is taken.
+    Numbers start at 0, and are only handed out once per handle_str.
+    """
+
+    with table_lock("users"):
+        suffix = HANDLE_SUFFIXES.get(handle_str, 0)
+        HANDLE_SUFFIXES[handle_str] = suffix + 1
+    return suffix
+
+@stored
+def get_users_by_ids(u_ids):
+    """
+    Returns a {u_id, name_first, name_last, profile_img_url} dictionary for
+    each ID in u_ids, in the same order. The dictionaries are shared between
+    calls, so must not be changed.
+    """
+
+    profiles = []
+    for u_id in u_ids:
+        profile = USER_PROFILES_CACHE.get(u_id)
+        if profile is None:
+            # Held so that a change to the user can't be cached half made.
+            with table_lock("users"):
+                user = USERS_INDEX[u_id]
+                profile = {'u_id': u_id, 'name_first': user['name_first'],
+                           'name_last': user['name_last'],
+                           'profile_img_url': user['profile_img_url']}
+                USER_PROFILES_CACHE[u_id] = profile
+        profiles.append(profile)
+    return profiles
+
+
+@stored
 def set_current_user(u_id, token):
     """ Adds a current user to the current user database. """
 
-    current_user = {'u_id': u_id, 'token': token}
-    CURRENT_USERS.append(current_user)
+    with table_lock("sessions"):
+        CURRENT_USERS[token] = u_id
+        CURRENT_TOKENS.setdefault(u_id, token)
 
+@stored
 def get_current_user(token):
     """ Given a token, returns the u_id of the user.
     If token is not valid, will return None.
     Can be used to check for valid tokens, raising AccessError. """
 
-    for current_user in CURRENT_USERS:
-        if token == current_user['token']:
-            return current_user['u_id']
-    return None
+    return CURRENT_USERS.get(token)
 
+@stored
 def get_token_from_user(u_id):
     """ Given a token, returns the token of the user.
     If u_id is not valid, will return None.
     """
 
-    for current_user in CURRENT_USERS:
-        if u_id == current_user['u_id']:
-            return current_user['token']
-    return None
+    return CURRENT_TOKENS.get(u_id)
 
+@stored
 def remove_current_user(token):
     """ Given a token, removes user who owns this token from CURRENT_USERS.
     Used to logout individuals.
     Returns True is user could be logged out, False otherwise. """
 
-    for current_user in CURRENT_USERS:
-        if token == current_user['token']:
-            CURRENT_USERS.remove(current_user)
-            return True
-    return False
+    with table_lock("sessions"):
+        u_id = CURRENT_USERS.pop(token, None)
+        if u_id is None:
+            return False
+
+        if CURRENT_TOKENS.get(u_id) == token:
+            del CURRENT_TOKENS[u_id]
+        return True
+
+# The time.time() revoked tokens were last pruned at, and how often to.
+REVOKED_TOKENS_PRUNED = {'at': 0}
+REVOKED_TOKENS_PRUNE_SECONDS = 60
+
+@stored
+def revoke_token(token_id, expires_at):
+    """
+    Revoke the signed token with the token_id, which expires at the
+    time.time() timestamp expires_at. Tokens that have expired are
+    forgotten, as they are no longer valid anyway.
+    """
+
+    with table_lock("revoked_tokens"):
+        now = time.time()
+        if now - REVOKED_TOKENS_PRUNED['at'] > REVOKED_TOKENS_PRUNE_SECONDS:
+            prune_revoked_tokens(now)
+            log_mutation('revoked_tokens', {'expired_before': now}, operation='prune')
+            REVOKED_TOKENS_PRUNED['at'] = now
+
+        REVOKED_TOKENS[token_id] = expires_at
+        log_mutation('revoked_tokens', {'token_id': token_id, 'expires_at': expires_at})
+
+def prune_revoked_tokens(expired_before):
+    """ Forget the revoked tokens that expired before expired_before. """
+
+    for token_id in [token_id for token_id, expires_at in REVOKED_TOKENS.items()
+                     if expires_at < expired_before]:
+        del REVOKED_TOKENS[token_id]
+
+@stored
+def is_any_token_revoked(token_ids):
+    """ Return whether any of the signed token ids in token_ids has been revoked. """
+
+    return any(token_id in REVOKED_TOKENS for token_id in token_ids)
 
 ###############################################################
 #
@@ -126,22 +503,21 @@ def remove_current_user(token):
 #
 ###############################################################
 
+@stored
 def get_permissions_list():
     """Return the list of all registered users and their respective permissions"""
     return USER_GLOBAL_PERMISSIONS_LIST
 
+@stored
 def get_permission_dict(u_id):
     """
     Return the permission_dictionary for a particular user.
 
     Return None if the user doesn't exist.
     """
-    for perm_dictionary in USER_GLOBAL_PERMISSIONS_LIST:
-        if u_id == perm_dictionary['u_id']:
-            return perm_dictionary
-
-    return None
+    return PERMISSIONS_INDEX.get(u_id)
 
+@stored
 def set_permissions(u_id, permission_id):
     """
     If no entry exists for the u_id, create a new entry in
@@ -151,12 +527,16 @@ def set_permissions(u_id, permission_id):
     If an entry already exists, update the permission_id of the
     given u_id.
     """
-    perm_dictionary = get_permission_dict(u_id)
-    new_perm_dictionary = {"u_id": u_id, "permission_id": permission_id}
-    if perm_dictionary is None:
-        USER_GLOBAL_PERMISSIONS_LIST.append(new_perm_dictionary)
-    else:
-        perm_dictionary["permission_id"] = permission_id
+    with table_lock("permissions"):
+        perm_dictionary = get_permission_dict(u_id)
+        new_perm_dictionary = {"u_id": u_id, "permission_id": permission_id}
+        if perm_dictionary is None:
+            USER_GLOBAL_PERMISSIONS_LIST.append(new_perm_dictionary)
+            PERMISSIONS_INDEX[u_id] = new_perm_dictionary
+        else:
+            perm_dictionary["permission_id"] = permission_id
+
+        log_mutation('permissions', new_perm_dictionary)
 
 ###############################################################
 #
@@ -164,27 +544,84 @@ def set_permissions(u_id, permission_id):
 #
 ###############################################################
 
+class MemberSet:
+    """
+    The owner_ids or member_ids of a channel: u_ids in the order they were
+    added, with O(1) membership tests, additions and removals.
+    Supports the list methods the routes use, and is equal to a list of the
+    same u_ids in the same order. Snapshots store it as that list.
+    """
+    __slots__ = ('u_ids',)
+    __hash__ = None
+
+    def __init__(self, u_ids=()):
+        # Dictionaries keep their keys in the order they were added.
+        self.u_ids = dict.fromkeys(u_ids)
+
+    def __contains__(self, u_id):
+        return u_id in self.u_ids
+
+    def __iter__(self):
+        return iter(self.u_ids)
+
+    def __len__(self):
+        return len(self.u_ids)
+
+    def __eq__(self, other):
+        if isinstance(other, MemberSet):
+            other = list(other)
+        if not isinstance(other, list):
+            return NotImplemented
+        return len(self) == len(other) and list(self) == other
+
+    def __repr__(self):
+        return f"MemberSet({list(self)})"
+
+    def append(self, u_id):
+        """ Add u_id, if it isn't in the set already. """
+        self.u_ids[u_id] = None
+
+    def remove(self, u_id):
+        """ Remove u_id, raising ValueError if it isn't in the set. """
+        try:
+            del self.u_ids[u_id]
+        except KeyError:
+            raise ValueError(f"{u_id} is not in the set") from None
+
+@stored
 def get_channels():
     """ Returns dataType *CHANNELS* (all currently created CHANNELS) """
     return CHANNELS
 
+@stored
 def get_channel(channel_id):
     """ Returns the channel dictionary with the matching ID. """
-    for channel in CHANNELS:
-        if channel['channel_id'] == channel_id:
-            return channel
-
-    return None
+    return CHANNELS_INDEX.get(channel_id)
 
+@stored
 def get_channel_data(channel_id):
     """ Returns the channel_data dictionary with the matching ID. """
-    for channel_data in CHANNEL_DATA_LIST:
-        if channel_data['channel_id'] == channel_id:
-            return channel_data
+    return CHANNEL_DATA_INDEX.get(channel_id)
+
+
+def add_channel_data(channel_id):
+    """
+    Make an empty entry in CHANNEL_DATA_LIST for *channel_id*.
+    The caller must hold the channel's lock.
+    """
 
-    return None
+    new_channel_data = ChannelData({"channel_id": channel_id,
+                                    "owner_ids": MemberSet(), "member_ids": MemberSet(),
+                                    "messages": [], "is_public": True})
+    CHANNEL_DATA_LIST.append(new_channel_data)
+    CHANNEL_DATA_INDEX[channel_id] = new_channel_data
+    with table_lock("histories"):
+        LOADED_HISTORIES[channel_id] = 0
+    DIRTY_HISTORIES.add(channel_id)
+    index_channel_members(channel_id, new_channel_data['member_ids'])
 
 
+@stored
 def set_channel(channel):
     """
     Update the CHANNELS list with a name if it already exists
@@ -194,17 +631,20 @@ def set_channel(channel):
     with the same channel_id and empty parameters.
     """
 
-    target_channel = get_channel(channel['channel_id'])
+    with channel_lock(channel['channel_id']), table_lock("channels"):
+        target_channel = get_channel(channel['channel_id'])
 
-    if target_channel is not None:
-        target_channel['name'] = channel['name']
-    else:
-        CHANNELS.append(channel)
-        new_channel_data = {"channel_id": channel['channel_id'], "owner_ids": [],
-                            "member_ids": [], "messages": [], "is_public": True}
-        CHANNEL_DATA_LIST.append(new_channel_data)
+        if target_channel is not None:
+            target_channel['name'] = channel['name']
+        else:
+            CHANNELS.append(channel)
+            CHANNELS_INDEX[channel['channel_id']] = channel
+            add_channel_data(channel['channel_id'])
+
+        log_mutation('channels', CHANNELS_INDEX[channel['channel_id']])
 
 
+@stored
 def set_channel_data(channel_data):
     """
     If channel_id doesn't exist, raise InputError, otherwise:
@@ -221,9 +661,57 @@ def set_channel_data(channel_data):
                                            " - create an entry in CHANNELS before creating"
                                            " one in CHANNEL_DATA_LIST.")
 
-    target_channel_data['owner_ids'] = channel_data['owner_ids']
-    target_channel_data['member_ids'] = channel_data['member_ids']
-    target_channel_data['is_public'] = channel_data['is_public']
+    with channel_lock(channel_data['channel_id']):
+        for key in ('owner_ids', 'member_ids'):
+            # Routes change the stored MemberSet in place, so it is usually
+            # the same one being passed back.
+            if not isinstance(channel_data[key], MemberSet):
+                target_channel_data[key] = MemberSet(channel_data[key])
+            else:
+                target_channel_data[key] = channel_data[key]
+        target_channel_data['is_public'] = channel_data['is_public']
+        index_channel_members(channel_data['channel_id'], target_channel_data['member_ids'])
+
+        log_mutation('channel_data', {'channel_id': channel_data['channel_id'],
+                                      'owner_ids': list(target_channel_data['owner_ids']),
+                                      'member_ids': list(target_channel_data['member_ids']),
+                                      'is_public': target_channel_data['is_public']})
+
+def index_channel_members(channel_id, member_ids):
+    """
+    Update USER_CHANNELS_INDEX for the users who joined or left the channel
+    since it was last indexed, given its member_ids.
+    """
+
+    with table_lock("user_channels"):
+        indexed = INDEXED_MEMBER_IDS.setdefault(channel_id, set())
+        for u_id in indexed.difference(member_ids):
+            USER_CHANNELS_INDEX[u_id].discard(channel_id)
+        for u_id in member_ids:
+            if u_id not in indexed:
+                USER_CHANNELS_INDEX.setdefault(u_id, set()).add(channel_id)
+        INDEXED_MEMBER_IDS[channel_id] = set(member_ids)
+
+@stored
+def get_user_channels(u_id):
+    """
+    Returns the channel dictionaries of the channels u_id is a member of,
+    in the order they were created.
+    """
+
+    with table_lock("user_channels"):
+        channel_ids = sorted(USER_CHANNELS_INDEX.get(u_id, ()))
+    return [CHANNELS_INDEX[channel_id] for channel_id in channel_ids]
+
+@stored
+def is_channel_member(channel_id, u_id):
+    """ Return whether u_id is a member of the channel. """
+    return u_id in get_channel_data(channel_id)['member_ids']
+
+@stored
+def is_channel_owner(channel_id, u_id):
+    """ Return whether u_id is an owner of the channel. """
+    return u_id in get_channel_data(channel_id)['owner_ids']
 
 
 ###############################################################
@@ -232,86 +720,303 @@ def set_channel_data(channel_data):
 #
 ###############################################################
 
+@stored
 def get_message_locations():
     """ Return a list of all message_location dictionaries. """
     return MESSAGE_LOCATION_LIST
 
+@stored
 def get_message_location(message_id):
     """
     Given a message_id, return the message_location dictionary containing
     that ID, and the channel it is stored under
     """
-    for message_location in MESSAGE_LOCATION_LIST:
-        if message_location['message_id'] == message_id:
-            return message_location
-
-    return None
+    return MESSAGE_LOCATION_INDEX.get(message_id)
 
+@stored
 def get_message(message_id):
     """
     Return a message stored in channel.
     Returns None if no message is found with a matching message_id.
     """
 
-    channel = get_message_location(message_id)
-
-    if channel is None:
+    message_location = MESSAGE_LOCATION_INDEX.get(message_id)
+    if message_location is None:
         return None
 
-    channel_id = channel.get('channel_id')
-    target_channel = get_channel_data(channel_id)
+    # Held so that the history can't be unloaded between loading and reading it.
+    with channel_lock(message_location['channel_id']):
+        touch_history(message_location['channel_id'])
+        return MESSAGE_INDEX.get(message_id)
+
+@stored
+def get_num_messages(channel_id):
+    """ Return the number of messages stored in a channel. """
+    with channel_lock(channel_id):
+        touch_history(channel_id)
+        return len(get_channel_data(channel_id)['messages'])
+
+@stored
+def get_channel_messages(channel_id, start, count):
+    """
+    Return up to count messages from a channel, newest first, skipping
+    the start most recent messages.
+    """
+    with channel_lock(channel_id):
+        touch_history(channel_id)
+        messages = get_channel_data(channel_id)['messages']
 
-    target_message = {}
-    for message in target_channel['messages']:
-        if message['message_id'] == message_id:
-            target_message = message
-    return target_message
+        # Messages are stored oldest first, so offsets are taken from the end.
+        stop = max(len(messages) - start, 0)
+        return messages[max(stop - count, 0):stop][::-1]
 
+@stored
 def set_message(channel_id, message):
     """
     Add/update a message stored in channel_data in CHANNEL_DATA_LIST.
 
     If the message is new, add a reference to its location in
-    MESSAGE_LOCATION_LIST and PREPEND it to messages in channel_data.
-    """
-
-    target_message = get_message(message['message_id'])
-    # i.e. Message exists already.
-    time_create_date = datetime.now().replace(microsecond=0)
-    time_create = time_create_date.timestamp()
-    if target_message is not None:
-        #experiment
-        target_message['message'] = message['message']
-        #target_message['time_created'] = time_create
-        target_message['reacts'] = message['reacts']
-        target_message['is_pinned'] = message['is_pinned']
-    else:
-        message['time_created'] = time_create
-        target_channel = get_channel_data(channel_id)
-        target_channel['messages'].insert(0, message)
-        MESSAGE_LOCATION_LIST.append({"message_id": message['message_id'],
-                                      "channel_id": channel_id})
+    MESSAGE_LOCATION_LIST and add it to messages in channel_data. New
+    messages without a time_created are given the current time.
+    """
 
+    with channel_lock(channel_id):
+        target_message = get_message(message['message_id'])
+        # i.e. Message exists already.
+        time_create_date = datetime.now().replace(microsecond=0)
+        time_create = time_create_date.timestamp()
+        if target_message is not None:
+            old_text = target_message['message']
+            #experiment
+            target_message['message'] = message['message']
+            #target_message['time_created'] = time_create
+            target_message['reacts'] = message['reacts']
+            target_message['is_pinned'] = message['is_pinned']
+            search_index.reindex_message(channel_id, target_message, old_text)
+        else:
+            if not message.get('time_created'):
+                message['time_created'] = time_create
+            insert_message(channel_id, message)
+
+        DIRTY_HISTORIES.add(channel_id)
+        log_mutation('messages', {'channel_id': channel_id,
+                                  'message': MESSAGE_INDEX[message['message_id']]})
+
+
+def insert_message(channel_id, message):
+    """
+    Append a new message to a channel's history and index it.
+    Used by set_message, and when replaying the write-ahead log so that the
+    logged time_created is kept.
+    """
 
+    with channel_lock(channel_id):
+        touch_history(channel_id)
+        # A history written out when it was unloaded may already hold messages
+        # from the write-ahead log that are newer than the snapshot.
+        if message['message_id'] not in MESSAGE_INDEX:
+            messages = get_channel_data(channel_id)['messages']
+            # Messages are kept oldest first. Scheduled messages sent late
+            # are older than the ones sent while they waited.
+            position = len(messages)
+            while position and messages[position - 1]['time_created'] > message['time_created']:
+                position -= 1
+            messages.insert(position, message)
+            MESSAGE_INDEX[message['message_id']] = message
+            count_history_messages(channel_id, 1)
+
+        # The location may already be stored if a crash left the snapshot
+        # files from different compactions.
+        with table_lock("message_locations"):
+            if get_message_location(message['message_id']) is None:
+                message_location = {"message_id": message['message_id'],
+                                    "channel_id": channel_id}
+                MESSAGE_LOCATION_LIST.append(message_location)
+                MESSAGE_LOCATION_INDEX[message['message_id']] = message_location
+
+        search_index.index_message(channel_id, MESSAGE_INDEX[message['message_id']])
+        DIRTY_HISTORIES.add(channel_id)
+    enforce_history_budget(channel_id)
+
+@stored
 def remove_message(message_id):
     """
     Delete entry from list of messages in relevant channel_data dictionary.
     Remove reference to location in message_location list.
     """
 
-    channel_id = get_message_location(message_id).get('channel_id')
-    target_channel_data = get_channel_data(channel_id)
-    message_locations = get_message_locations()
-    message_location = get_message_location(message_id)
-    message_to_remove = {}
+    channel_id = MESSAGE_LOCATION_INDEX[message_id]['channel_id']
+    with channel_lock(channel_id):
+        touch_history(channel_id)
+        message_to_remove = MESSAGE_INDEX.pop(message_id)
+        search_index.unindex_message(channel_id, message_to_remove)
+
+        target_channel_data = get_channel_data(channel_id)
+        target_channel_data['messages'].remove(message_to_remove)
+        with table_lock("message_locations"):
+            MESSAGE_LOCATION_LIST.remove(MESSAGE_LOCATION_INDEX.pop(message_id))
+        count_history_messages(channel_id, -1)
+        DIRTY_HISTORIES.add(channel_id)
+
+        log_mutation('messages', {'message_id': message_id}, operation='remove')
+
+
+@stored
+def search_messages(channel_ids, query_str, before=None):
+    """
+    Return an iterator over the (time_created, message_id) of messages in
+    any of channel_ids containing query_str, newest first. If before is
+    given, only messages older than that (time_created, message_id) are
+    included.
+    """
+    for channel_id in channel_ids:
+        if channel_id not in search_index.INDEXED_CHANNELS:
+            index_channel_messages(channel_id)
+    return search_index.search(channel_ids, query_str, get_message_text, before)
+
+def index_channel_messages(channel_id):
+    """ Add a channel's messages to the search index, the first time it is searched. """
+
+    with channel_lock(channel_id):
+        touch_history(channel_id)
+        search_index.index_channel(channel_id, get_channel_data(channel_id)['messages'])
+    enforce_history_budget(channel_id)
+
+def get_message_text(message_id):
+    """ Return the text of a message, or None if it has been removed. """
+
+    message = get_message(message_id)
+    return None if message is None else message['message']
+
+
+###############################################################
+#
+#                   Lazy Channel History
+#
+###############################################################
+
+# When LAZY_HISTORY is on, each channel's messages are stored in their own
+# snapshot file under messages/, and are only loaded into memory the first
+# time they are needed. Once more than HISTORY_MEMORY_BUDGET messages are
+# loaded, the least recently used histories are written out and dropped.
+LAZY_HISTORY = os.environ.get("SLACKR_LAZY_HISTORY", "0") == "1"
+HISTORY_MEMORY_BUDGET = int(os.environ.get("SLACKR_HISTORY_BUDGET", "1000000"))
+
+# {channel_id: num_messages} for every loaded history, least recently used first.
+LOADED_HISTORIES = OrderedDict()
+
+# {num_messages} held across all loaded histories.
+HISTORY_CACHE = {'num_messages': 0}
+
+# {channel_id, ...} of loaded histories that differ from their file on disk.
+DIRTY_HISTORIES = set()
+
+class ChannelData(dict):
+    """
+    A channel_data dictionary that loads its messages from disk the first
+    time they are accessed, if they aren't in memory already.
+    Its owner_ids and member_ids are stored as MemberSets.
+    """
+
+    def __init__(self, row):
+        super().__init__(row)
+        for key in ('owner_ids', 'member_ids'):
+            if key in self and not isinstance(self[key], MemberSet):
+                self[key] = MemberSet(self[key])
+
+    def __missing__(self, key):
+        if key != 'messages':
+            raise KeyError(key)
+        return load_history(self['channel_id'])
+
+def get_history_name(channel_id):
+    """ Return the name of the snapshot file holding a channel's messages. """
+    return f"messages/{channel_id}"
+
+def load_history(channel_id):
+    """ Load a channel's messages from disk into its channel_data and index them. """
+
+    with channel_lock(channel_id):
+        channel_data = get_channel_data(channel_id)
+        # Another thread loaded it while this one waited for the lock.
+        if 'messages' in channel_data:
+            return channel_data['messages']
+
+        try:
+            messages = read_snapshot_file(get_history_name(channel_id))
+        except FileNotFoundError:
+            messages = []
+
+        channel_data['messages'] = messages
+        MESSAGE_INDEX.update((message['message_id'], message) for message in messages)
+        with table_lock("histories"):
+            LOADED_HISTORIES[channel_id] = len(messages)
+            HISTORY_CACHE['num_messages'] += len(messages)
+
+        enforce_history_budget(channel_id)
+        return messages
+
+def unload_history(channel_id):
+    """
+    Write a channel's messages to disk if needed, then drop them from memory.
+    The channel's lock must be held.
+    """
+
+    channel_data = get_channel_data(channel_id)
+    if channel_id in DIRTY_HISTORIES:
+        write_snapshot_file(get_history_name(channel_id), channel_data['messages'])
+        DIRTY_HISTORIES.discard(channel_id)
+
+    for message in channel_data['messages']:
+        MESSAGE_INDEX.pop(message['message_id'], None)
+    del channel_data['messages']
+    with table_lock("histories"):
+        HISTORY_CACHE['num_messages'] -= LOADED_HISTORIES.pop(channel_id)
 
-    for message in target_channel_data['messages']:
-        if message['message_id'] == message_id:
-            message_to_remove = message
+def count_history_messages(channel_id, change):
+    """ Add change to the number of messages counted for a loaded history. """
 
-    target_channel_data['messages'].remove(message_to_remove)
-    message_locations.remove(message_location)
+    with table_lock("histories"):
+        if channel_id in LOADED_HISTORIES:
+            LOADED_HISTORIES[channel_id] += change
+            HISTORY_CACHE['num_messages'] += change
 
+def touch_history(channel_id):
+    """ Mark a channel's history as most recently used, loading it if needed. """
+
+    if LAZY_HISTORY:
+        with channel_lock(channel_id):
+            if channel_id not in LOADED_HISTORIES:
+                load_history(channel_id)
+            with table_lock("histories"):
+                LOADED_HISTORIES.move_to_end(channel_id)
+
+def enforce_history_budget(keep_channel_id):
+    """
+    Unload the least recently used histories until the budget is met,
+    never unloading the history of keep_channel_id.
+    Histories whose channel is locked by another thread are skipped, so
+    that the channel lock can be taken after the histories lock.
+    """
+
+    if not LAZY_HISTORY:
+        return
+
+    while True:
+        with table_lock("histories"):
+            if HISTORY_CACHE['num_messages'] <= HISTORY_MEMORY_BUDGET:
+                return
+            unload_id = next((channel_id for channel_id in LOADED_HISTORIES
+                              if channel_id != keep_channel_id and
+                              channel_lock(channel_id).acquire(blocking=False)), None)
+            if unload_id is None:
+                return
+
+        # Written out without the histories lock, so other channels carry on.
+        try:
+            unload_history(unload_id)
+        finally:
+            channel_lock(unload_id).release()
 
 ###############################################################
 #
@@ -319,29 +1024,76 @@ def remove_message(message_id):
 #
 ###############################################################
 
+@stored
 def get_password_data(user_email):
     """
     Return the dictionary storing {'email': ____, 'password': ____}
     whose email matches userEmail given.
     """
-    for pwd_data in PASSWORD_DATA_LIST:
-        if pwd_data['email'] == user_email:
-            return pwd_data
-
-
-    return None
+    return PASSWORD_DATA_INDEX.get(user_email)
 
+@stored
 def set_password(user_email, password):
     """
     Update the password element of the password_data dictionary
     for a certain user.
     """
-    target_pwd_data = get_password_data(user_email)
+    with table_lock("passwords"):
+        target_pwd_data = get_password_data(user_email)
 
-    if target_pwd_data is None:
-        PASSWORD_DATA_LIST.append({"email": user_email, "password": password})
-    else:
-        target_pwd_data['password'] = password
+        if target_pwd_data is None:
+            new_pwd_data = {"email": user_email, "password": password}
+            PASSWORD_DATA_LIST.append(new_pwd_data)
+            PASSWORD_DATA_INDEX[user_email] = new_pwd_data
+        else:
+            target_pwd_data['password'] = password
+
+        log_mutation('passwords', {"email": user_email, "password": password})
+
+###############################################################
+#
+#                    Scheduled Messages
+#
+###############################################################
+
+@stored
+def get_scheduled_messages():
+    """ Return every message waiting to be sent by message_sendlater. """
+    return SCHEDULED_MESSAGES
+
+@stored
+def get_scheduled_message(message_id):
+    """
+    Return the scheduled message with message_id.
+    Returns None if no message with that id is waiting to be sent.
+    """
+    return SCHEDULED_MESSAGES_INDEX.get(message_id)
+
+@stored
+def set_scheduled_message(scheduled):
+    """
+    Add/update a message waiting to be sent.
+    scheduled is {message_id, channel_id, u_id, message, time_sent}.
+    """
+
+    with table_lock("scheduled_messages"):
+        target_scheduled = get_scheduled_message(scheduled['message_id'])
+        if target_scheduled is None:
+            SCHEDULED_MESSAGES.append(scheduled)
+            SCHEDULED_MESSAGES_INDEX[scheduled['message_id']] = scheduled
+        else:
+            target_scheduled.update(scheduled)
+
+        log_mutation('scheduled_messages', scheduled)
+
+@stored
+def remove_scheduled_message(message_id):
+    """ Remove a message that has been sent from the scheduled messages. """
+
+    with table_lock("scheduled_messages"):
+        SCHEDULED_MESSAGES.remove(SCHEDULED_MESSAGES_INDEX.pop(message_id))
+
+        log_mutation('scheduled_messages', {'message_id': message_id}, operation='remove')
 
 ###############################################################
 #
@@ -349,109 +1101,682 @@ def set_password(user_email, password):
 #
 ###############################################################
 
+@stored
 def generate_u_id():
     """ Tick NUM_USERS up by 1 and return new NUM_USERS. """
 
-    NUM_USERS['num_users'] = NUM_USERS.get('num_users', 0) + 1
+    with table_lock("num_users"):
+        NUM_USERS['num_users'] = NUM_USERS.get('num_users', 0) + 1
+        log_mutation('num_users', NUM_USERS)
+
+        return NUM_USERS['num_users']
+
+@stored
+def reserve_ids(name, count):
+    """
+    Reserve the next count ids of the counter name in MESSAGE_IDS, returning
+    the first of them and the reset count they were reserved at. The counter
+    is stored before returning, so reserved ids are never handed out again,
+    even after a restart, until the database is reset.
+    """
+
+    with table_lock("message_ids"):
+        first_id = MESSAGE_IDS[name]
+        MESSAGE_IDS[name] = first_id + count
+        log_mutation('message_ids', MESSAGE_IDS)
+        return first_id, MESSAGE_IDS.get('resets', 0)
+
+# {counter name: ids reserved at once}
+# Ids left in a block when the server stops are skipped, so counters that
+# rarely tick use small blocks.
+ID_BLOCK_SIZES = {'next_message_id': 100, 'num_channels': 10}
+
+# {(pid, counter name): (reset count, iterator over the ids left in the block)}
+# Keyed by pid, so that forked worker processes don't share their parent's
+# block. Taking an id from a range iterator is atomic, so only reserving a
+# new block needs ID_BLOCKS_LOCK. Resetting the database starts the counters
+# again, so blocks reserved before the latest reset are dropped, including
+# when another process reset it.
+ID_BLOCKS = {}
+ID_BLOCKS_LOCK = threading.Lock()
+
+def allocate_id(name):
+    """
+    Return a new id from the counter name, taken from this process's block
+    of reserved ids. Between resets, ids from one process only ever go up,
+    and no two processes are handed the same id.
+    """
+
+    key = (os.getpid(), name)
+    while True:
+        resets, block = ID_BLOCKS.get(key, (None, None))
+        if block is not None and resets == get_reset_count():
+            new_id = next(block, None)
+            if new_id is not None:
+                return new_id
+
+        with ID_BLOCKS_LOCK:
+            # Another thread may have reserved a block while this one waited.
+            if ID_BLOCKS.get(key, (None, None))[1] is block:
+                first_id, resets = reserve_ids(name, ID_BLOCK_SIZES[name])
+                ID_BLOCKS[key] = (resets, iter(range(first_id,
+                                                     first_id + ID_BLOCK_SIZES[name])))
+
+def drop_id_blocks():
+    """ Forget every reserved block, e.g. after the database has been loaded. """
+
+    with ID_BLOCKS_LOCK:
+        ID_BLOCKS.clear()
+
+def generate_message_id():
+    """
+    Return a new message_id, which is never handed out again.
+    Ids are counted rather than taken from the newest message, so that an
+    id can be reserved for a message that is sent later.
+    """
 
-    return NUM_USERS['num_users']
+    return allocate_id('next_message_id')
+
+def generate_channel_id():
+    """ Return a new channel_id, which is never handed out again. """
+
+    return allocate_id('num_channels') + 1
+
+@stored
+def get_reset_count():
+    """ Return how many times the database has been cleared. """
+
+    return MESSAGE_IDS.get('resets', 0)
 
 ###############################################################
 #
-#                 General Database Functions
+#                      Snapshot Files
 #
 ###############################################################
-def clear_database():
-    """ Wipes the whole database clean."""
-    USERS.clear()
-    USER_GLOBAL_PERMISSIONS_LIST.clear()
-    CURRENT_USERS.clear()
-    CHANNELS.clear()
-    CHANNEL_DATA_LIST.clear()
-    MESSAGE_LOCATION_LIST.clear()
-    PASSWORD_DATA_LIST.clear()
-    NUM_USERS['num_users'] = 0
 
-def transcribe_database():
+# {name: table} for every file in a snapshot of the database.
+SNAPSHOT_TABLES = {
+    "channel_data": CHANNEL_DATA_LIST,
+    "channels": CHANNELS,
+    "message_locations": MESSAGE_LOCATION_LIST,
+    "num_users": NUM_USERS,
+    "passwords": PASSWORD_DATA_LIST,
+    "users": USERS,
+    "permissions": USER_GLOBAL_PERMISSIONS_LIST,
+    "scheduled_messages": SCHEDULED_MESSAGES,
+    "message_ids": MESSAGE_IDS,
+    "revoked_tokens": REVOKED_TOKENS,
+    "snapshot_info": SNAPSHOT_INFO,
+}
+
+# Version 2 stores each channel's messages oldest first, where version 1
+# (snapshots without a snapshot_info file) stored them newest first.
+SNAPSHOT_VERSION = 2
+
+# Snapshots are written as either 'json' or 'binary' files.
+# JSON files are easy to read, binary files are smaller and faster to load.
+SNAPSHOT_FORMAT = os.environ.get("SLACKR_SNAPSHOT_FORMAT", "json")
+SNAPSHOT_EXTENSIONS = {"json": ".json", "binary": ".bin"}
+
+# Each JSON snapshot file starts with a line holding the checksum of the JSON
+# that follows it. Files without this line are from before checksums were
+# added and are loaded without being checked.
+CHECKSUM_PREFIX = b"sha256:"
+
+# Binary snapshot files are laid out as:
+#   BINARY_MAGIC, 'L' for a list of rows or 'D' for a single dictionary,
+#   the number of records (8 bytes), then each record, and finally the
+#   sha256 of all of the above.
+# A record is its type (1 byte) and length (4 bytes), followed by a pickled
+# list of up to BINARY_BATCH_SIZE items. Type 'R' records hold rows, and
+# type 'M' records hold messages belonging to the last row read, so that
+# a channel's history is also split across many small records.
+BINARY_MAGIC = b"SLKR\x02"
+BINARY_HEADER = struct.Struct(">cQ")
+BINARY_RECORD = struct.Struct(">cI")
+BINARY_BATCH_SIZE = 1000
+BINARY_PICKLE_PROTOCOL = 4
+
+def copy_message(message):
+    """ Return a copy of a message that shares no lists with the original. """
+
+    return dict(message, reacts=[dict(react, u_ids=list(react['u_ids']))
+                                 for react in message['reacts']])
+
+def copy_table(table, copy_row):
+    """ Return a copy of a table made with copy_row, while holding the table's lock. """
+
+    with table_lock(table):
+        table_data = SNAPSHOT_TABLES[table]
+        if isinstance(table_data, dict):
+            return copy_row(table_data)
+        return [copy_row(row) for row in table_data]
+
+def capture_snapshot():
+    """
+    Return a copy of every table that can be written to disk while the
+    database carries on changing.
+    Each table and each channel is copied while holding only its own lock,
+    so no request waits on the whole database. The copy as a whole may see
+    some changes made during it, which is safe as the write-ahead log
+    replays them again.
+    """
+
+    # Channels are copied before their data, so every channel in the copy
+    # has its data in it too. A channel made after this copy may still have
+    # data and no channel, which replaying the log fixes.
+    channels = copy_table("channels", dict)
+    histories = {}
+    channel_data_rows = []
+    for channel_data in list(CHANNEL_DATA_LIST):
+        channel_id = channel_data['channel_id']
+        with channel_lock(channel_id):
+            row = dict(channel_data,
+                       owner_ids=list(channel_data['owner_ids']),
+                       member_ids=list(channel_data['member_ids']))
+            if not LAZY_HISTORY:
+                row['messages'] = [copy_message(message) for message in channel_data['messages']]
+            else:
+                # Histories are stored in their own files, and only the ones
+                # that have changed need to be written.
+                row.pop('messages', None)
+                if channel_id in DIRTY_HISTORIES and channel_id in LOADED_HISTORIES:
+                    histories[get_history_name(channel_id)] = [
+                        copy_message(message) for message in channel_data['messages']]
+                    DIRTY_HISTORIES.discard(channel_id)
+        channel_data_rows.append(row)
+
+    return {
+        **histories,
+        "channel_data": channel_data_rows,
+        "channels": channels,
+        "message_locations": copy_table("message_locations", dict),
+        "num_users": copy_table("num_users", dict),
+        "passwords": copy_table("passwords", dict),
+        "users": copy_table("users", dict),
+        "permissions": copy_table("permissions", dict),
+        "scheduled_messages": copy_table("scheduled_messages", dict),
+        "message_ids": copy_table("message_ids", dict),
+        "revoked_tokens": copy_table("revoked_tokens", dict),
+        "snapshot_info": {'version': SNAPSHOT_VERSION},
+    }
+
+def get_snapshot_path(name, snapshot_format=None):
+    """ Return the path of a snapshot file, in SNAPSHOT_FORMAT by default. """
+
+    return os.path.join(DATABASE_PATH,
+                        name + SNAPSHOT_EXTENSIONS[snapshot_format or SNAPSHOT_FORMAT])
+
+def write_atomically(path, chunks):
     """
-    Write the stored databases into a JSON file.
+    Write chunks of bytes to a temporary file that is then renamed over path,
+    so a crash can never leave a half written file.
     """
-    with open(os.path.join(DATABASE_PATH, "channel_data.json"), "w") as output:
-        json.dump(CHANNEL_DATA_LIST, output)
 
-    with open(os.path.join(DATABASE_PATH, "channels.json"), "w") as output:
-        json.dump(CHANNELS, output)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "wb") as output:
+        for chunk in chunks:
+            output.write(chunk)
+        output.flush()
+        os.fsync(output.fileno())
 
-    with open(os.path.join(DATABASE_PATH, "message_locations.json"), "w") as output:
-        json.dump(MESSAGE_LOCATION_LIST, output)
+    os.replace(path + ".tmp", path)
 
-    with open(os.path.join(DATABASE_PATH, "num_users.json"), "w") as output:
-        json.dump(NUM_USERS, output)
+def write_json_snapshot_file(path, data):
+    """ Write data to a JSON snapshot file, along with its checksum. """
 
-    with open(os.path.join(DATABASE_PATH, "passwords.json"), "w") as output:
-        json.dump(PASSWORD_DATA_LIST, output)
+    body = json.dumps(data).encode()
+    write_atomically(path, [CHECKSUM_PREFIX + hashlib.sha256(body).hexdigest().encode() + b"\n",
+                            body])
 
-    with open(os.path.join(DATABASE_PATH, "users.json"), "w") as output:
-        json.dump(USERS, output)
+def read_json_snapshot_file(path):
+    """
+    Load the data stored in a JSON snapshot file.
+    Raises ValueError if the file doesn't match its checksum.
+    """
 
-    with open(os.path.join(DATABASE_PATH, "permissions.json"), "w") as output:
-        json.dump(USER_GLOBAL_PERMISSIONS_LIST, output)
+    with open(path, "rb") as output:
+        body = output.read()
 
-    print("Transcribed database information to JSON files.")
+    if body.startswith(CHECKSUM_PREFIX):
+        checksum, body = body.split(b"\n", 1)
+        if hashlib.sha256(body).hexdigest().encode() != checksum[len(CHECKSUM_PREFIX):]:
+            raise ValueError(f"{path} does not match its checksum - the file is corrupt.")
 
-def start_db_backup_scheduler():
+    return json.loads(body)
+
+def binary_snapshot_records(rows):
+    """ Generate the (type, items) records used to store rows in a binary snapshot. """
+
+    batch = []
+    for row in rows:
+        if 'messages' not in row:
+            batch.append(row)
+        else:
+            # Flush the batch so this row is the last one read before its messages.
+            if batch:
+                yield b"R", batch
+                batch = []
+            yield b"R", [dict(row, messages=[])]
+            for start in range(0, len(row['messages']), BINARY_BATCH_SIZE):
+                yield b"M", row['messages'][start:start + BINARY_BATCH_SIZE]
+
+        if len(batch) == BINARY_BATCH_SIZE:
+            yield b"R", batch
+            batch = []
+
+    if batch:
+        yield b"R", batch
+
+def binary_snapshot_chunks(data):
+    """ Generate the bytes of a binary snapshot file holding data. """
+
+    if isinstance(data, dict):
+        kind, rows = b"D", [data]
+    else:
+        kind, rows = b"L", data
+
+    records = [BINARY_RECORD.pack(record_type, 0) + pickle.dumps(items, BINARY_PICKLE_PROTOCOL)
+               for record_type, items in binary_snapshot_records(rows)]
+
+    checksum = hashlib.sha256()
+    header = BINARY_MAGIC + BINARY_HEADER.pack(kind, len(records))
+    checksum.update(header)
+    yield header
+
+    for record in records:
+        # Fill in the length now the record has been pickled.
+        record = BINARY_RECORD.pack(record[:1], len(record) - BINARY_RECORD.size) \
+            + record[BINARY_RECORD.size:]
+        checksum.update(record)
+        yield record
+
+    yield checksum.digest()
+
+def read_binary_snapshot_file(path):
     """
-    Creates a daemon thread that will run transcribe database every
-    30 seconds.
+    Load the data stored in a binary snapshot file.
+    The file is memory mapped and unpickled one small record at a time,
+    rather than being read and parsed as one document.
+    Raises ValueError if the file doesn't match its checksum.
     """
 
-    def transcribe_timed():
-        """ Helper function to run the delayed loop on transcribe_database """
-        while True:
-            time.sleep(30)
-            transcribe_database()
+    with open(path, "rb") as output, \
+            mmap.mmap(output.fileno(), 0, access=mmap.ACCESS_READ) as mapped, \
+            memoryview(mapped) as view:
 
-    backup_thread = threading.Thread(target=transcribe_timed)
-    backup_thread.daemon = True
-    backup_thread.start()
+        body_end = len(view) - hashlib.sha256().digest_size
+        if (view[:len(BINARY_MAGIC)] != BINARY_MAGIC or
+                hashlib.sha256(view[:body_end]).digest() != view[body_end:]):
+            raise ValueError(f"{path} does not match its checksum - the file is corrupt.")
 
+        offset = len(BINARY_MAGIC)
+        kind, num_records = BINARY_HEADER.unpack_from(view, offset)
+        offset += BINARY_HEADER.size
 
-def retrieve_data_from_files():
+        rows = []
+        for _ in range(num_records):
+            record_type, length = BINARY_RECORD.unpack_from(view, offset)
+            offset += BINARY_RECORD.size
+            items = pickle.loads(view[offset:offset + length])
+            offset += length
+
+            if record_type == b"M":
+                rows[-1]['messages'].extend(items)
+            else:
+                rows.extend(items)
+
+    return rows[0] if kind == b"D" else rows
+
+def write_snapshot_file(name, data, snapshot_format=None):
+    """ Write data to the snapshot file for name, in SNAPSHOT_FORMAT by default. """
+
+    snapshot_format = snapshot_format or SNAPSHOT_FORMAT
+    path = get_snapshot_path(name, snapshot_format)
+    if snapshot_format == "binary":
+        write_atomically(path, binary_snapshot_chunks(data))
+    else:
+        write_json_snapshot_file(path, data)
+
+def read_snapshot_file(name, snapshot_format=None):
     """
-    Fetch information from the database files into
-    the global variables.
+    Load the data stored in the snapshot file for name.
+    If there is no file in SNAPSHOT_FORMAT yet, a file in the other
+    format is loaded instead, and will be replaced on the next compaction.
     """
-    with open(os.path.join(DATABASE_PATH, "channel_data.json"), "r") as output:
-        data = json.load(output)
-        CHANNEL_DATA_LIST.clear()
-        CHANNEL_DATA_LIST.extend(data)
 
-    with open(os.path.join(DATABASE_PATH, "channels.json"), "r") as output:
-        data = json.load(output)
-        CHANNELS.clear()
-        CHANNELS.extend(data)
+    snapshot_format = snapshot_format or SNAPSHOT_FORMAT
+    if not os.path.exists(get_snapshot_path(name, snapshot_format)):
+        snapshot_format = next(other for other in SNAPSHOT_EXTENSIONS if other != snapshot_format)
 
-    with open(os.path.join(DATABASE_PATH, "message_locations.json"), "r") as output:
-        data = json.load(output)
-        MESSAGE_LOCATION_LIST.clear()
-        MESSAGE_LOCATION_LIST.extend(data)
+    path = get_snapshot_path(name, snapshot_format)
+    if snapshot_format == "binary":
+        return read_binary_snapshot_file(path)
+    return read_json_snapshot_file(path)
 
-    with open(os.path.join(DATABASE_PATH, "num_users.json"), "r") as output:
-        data = json.load(output)
-        NUM_USERS['num_users'] = 0
-        NUM_USERS['num_users'] = data['num_users']
+def convert_snapshot(from_format, to_format):
+    """ Rewrite every snapshot file stored in from_format in to_format. """
 
-    with open(os.path.join(DATABASE_PATH, "passwords.json"), "r") as output:
-        data = json.load(output)
-        PASSWORD_DATA_LIST.clear()
-        PASSWORD_DATA_LIST.extend(data)
+    for name in SNAPSHOT_TABLES:
+        write_snapshot_file(name, read_snapshot_file(name, from_format), to_format)
 
-    with open(os.path.join(DATABASE_PATH, "users.json"), "r") as output:
-        data = json.load(output)
-        USERS.clear()
-        USERS.extend(data)
+def write_snapshot(snapshot):
+    """ Write a snapshot from capture_snapshot to the database files. """
+
+    for name, data in snapshot.items():
+        write_snapshot_file(name, data)
+
+    WAL['snapshot_bytes'] = get_snapshot_bytes()
+
+###############################################################
+#
+#                      Write-Ahead Log
+#
+###############################################################
+
+# The snapshot files hold the database as it was at some point. Every change made through
+# the set_* and remove_* functions since that snapshot is appended to the
+# write-ahead log as one line of JSON:
+#   {"table": ..., "operation": "set"/"remove"/"clear", "row": {...}}
+WAL_PATH = os.path.join(DATABASE_PATH, "wal.log")
+
+# While a new snapshot is being written, the log it replaces is moved here.
+WAL_COMPACTING_PATH = os.path.join(DATABASE_PATH, "wal.log.compacting")
+
+# The log is compacted into a new snapshot once it is larger than both
+# this and the previous snapshot, so persisting costs O(writes).
+WAL_COMPACT_MIN_BYTES = 1024 * 1024
+
+# If True, fsync after every write so the log also survives power loss,
+# not just the server crashing.
+WAL_FSYNC = False
+
+# {file, snapshot_bytes}
+# file is None while logging is turned off, e.g. when running tests.
+WAL = {'file': None, 'snapshot_bytes': 0}
+WAL_LOCK = threading.Lock()
+
+def log_mutation(table, row, operation='set'):
+    """ Append a change to the write-ahead log, if it is open. """
+
+    with WAL_LOCK:
+        if WAL['file'] is None:
+            return
+
+        WAL['file'].write(json.dumps({'table': table, 'operation': operation,
+                                      'row': row}) + '\n')
+        WAL['file'].flush()
+        if WAL_FSYNC:
+            os.fsync(WAL['file'].fileno())
+
+def replay_channel(channel):
+    """
+    Replay a change to a channel's name. A snapshot taken while the channel
+    was made may have its data but not the channel, or the other way round,
+    so whichever is missing is made here.
+    """
+
+    with channel_lock(channel['channel_id']):
+        if get_channel(channel['channel_id']) is None \
+                and get_channel_data(channel['channel_id']) is not None:
+            with table_lock("channels"):
+                CHANNELS.append(channel)
+                CHANNELS_INDEX[channel['channel_id']] = channel
+        else:
+            set_channel(channel)
+        if get_channel_data(channel['channel_id']) is None:
+            add_channel_data(channel['channel_id'])
+
+def replay_mutation(record):
+    """ Apply a change read back from the write-ahead log. """
+
+    table = record['table']
+    row = record['row']
+
+    if record['operation'] == 'clear':
+        clear_database()
+        # Clears logged before resets were counted have no row.
+        if row is not None:
+            MESSAGE_IDS['resets'] = row['resets']
+    elif table == 'users':
+        if get_user_data(row['u_id']) is None:
+            USERS.append(row)
+            USERS_INDEX[row['u_id']] = row
+        else:
+            get_user_data(row['u_id']).update(row)
+        index_user(USERS_INDEX[row['u_id']])
+    elif table == 'permissions':
+        set_permissions(row['u_id'], row['permission_id'])
+    elif table == 'channels':
+        replay_channel(row)
+    elif table == 'channel_data':
+        with channel_lock(row['channel_id']):
+            # A snapshot taken while the channel was made may have missed it.
+            if get_channel_data(row['channel_id']) is None:
+                add_channel_data(row['channel_id'])
+        set_channel_data(row)
+    elif table == 'messages' and record['operation'] == 'remove':
+        if get_message(row['message_id']) is not None:
+            remove_message(row['message_id'])
+        elif get_message_location(row['message_id']) is not None:
+            MESSAGE_LOCATION_LIST.remove(MESSAGE_LOCATION_INDEX.pop(row['message_id']))
+    elif table == 'messages':
+        message = row['message']
+        # A message with a location but no message was removed in a later
+        # snapshot file, so is inserted again until the log removes it.
+        if get_message(message['message_id']) is None:
+            insert_message(row['channel_id'], message)
+        else:
+            set_message(row['channel_id'], message)
+    elif table == 'passwords':
+        set_password(row['email'], row['password'])
+    elif table == 'num_users':
+        NUM_USERS['num_users'] = row['num_users']
+    elif table == 'scheduled_messages' and record['operation'] == 'remove':
+        if get_scheduled_message(row['message_id']) is not None:
+            remove_scheduled_message(row['message_id'])
+    elif table == 'scheduled_messages':
+        set_scheduled_message(row)
+    elif table == 'message_ids':
+        MESSAGE_IDS.update(row)
+    elif table == 'revoked_tokens' and record['operation'] == 'prune':
+        prune_revoked_tokens(row['expired_before'])
+    elif table == 'revoked_tokens':
+        REVOKED_TOKENS[row['token_id']] = row['expires_at']
+
+def replay_write_ahead_log(path):
+    """ Apply every change stored in the log file at path. """
+
+    if not os.path.exists(path):
+        return
+
+    with open(path, "r") as log:
+        for line in log:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # The server stopped part way through writing this line.
+                break
+            replay_mutation(record)
+
+def open_write_ahead_log():
+    """
+    Start logging changes to the write-ahead log.
+    Should be called after retrieve_data_from_files.
+    """
+
+    # A crash happened while compacting, so the snapshot on disk may not
+    # contain the compacting log. Write one that does before carrying on.
+    if os.path.exists(WAL_COMPACTING_PATH):
+        transcribe_database()
+        os.remove(WAL_COMPACTING_PATH)
+
+    with WAL_LOCK:
+        WAL['file'] = open(WAL_PATH, "a")
+        WAL['snapshot_bytes'] = get_snapshot_bytes()
+
+def close_write_ahead_log():
+    """ Stop logging changes to the write-ahead log. """
+
+    with WAL_LOCK:
+        if WAL['file'] is not None:
+            WAL['file'].close()
+            WAL['file'] = None
+
+def compact_database():
+    """
+    Write a new snapshot of the database and discard the part of the
+    write-ahead log that it covers.
+    """
+
+    # Every change logged before this point has already been made, so the
+    # snapshot will include it. Changes made during the capture are logged
+    # to the new log, and replaying those over the snapshot is safe as
+    # every change is idempotent.
+    with WAL_LOCK:
+        WAL['file'].close()
+        os.replace(WAL_PATH, WAL_COMPACTING_PATH)
+        WAL['file'] = open(WAL_PATH, "a")
+
+    # Copy and serialise outside of WAL_LOCK, so requests only ever wait on
+    # the lock of the table or channel being copied.
+    snapshot = capture_snapshot()
+    write_snapshot(snapshot)
+    os.remove(WAL_COMPACTING_PATH)
+
+    print("Compacted write-ahead log into snapshot files.")
+
+def get_snapshot_bytes():
+    """ Return the total size of the snapshot files. """
+
+    return sum(os.path.getsize(os.path.join(DATABASE_PATH, filename))
+               for filename in os.listdir(DATABASE_PATH)
+               if filename.endswith(SNAPSHOT_EXTENSIONS[SNAPSHOT_FORMAT]))
+
+def wal_needs_compacting():
+    """ Return True if the write-ahead log has grown large enough to compact. """
 
-    with open(os.path.join(DATABASE_PATH, "permissions.json"), "r") as output:
-        data = json.load(output)
+    return (WAL['file'] is not None and
+            os.path.getsize(WAL_PATH) > max(WAL_COMPACT_MIN_BYTES, WAL['snapshot_bytes']))
+
+###############################################################
+#
+#                 General Database Functions
+#
+###############################################################
+def clear_database():
+    """ Wipes the whole database clean."""
+    clear_tables()
+    # The counters start again, so the ids reserved from them are free.
+    drop_id_blocks()
+
+@stored
+def clear_tables():
+    """ Empties every table. """
+    with ExitStack() as stack:
+        for lock in TABLE_LOCKS.values():
+            stack.enter_context(lock)
+
+        USERS.clear()
         USER_GLOBAL_PERMISSIONS_LIST.clear()
-        USER_GLOBAL_PERMISSIONS_LIST.extend(data)
+        CURRENT_USERS.clear()
+        CURRENT_TOKENS.clear()
+        # REVOKED_TOKENS are kept until they expire.
+        CHANNELS.clear()
+        CHANNEL_DATA_LIST.clear()
+        MESSAGE_LOCATION_LIST.clear()
+        PASSWORD_DATA_LIST.clear()
+        NUM_USERS['num_users'] = 0
+        SCHEDULED_MESSAGES.clear()
+        MESSAGE_IDS['next_message_id'] = 0
+        MESSAGE_IDS['num_channels'] = 0
+        # Signed tokens from before now hold an older count, so aren't valid.
+        MESSAGE_IDS['resets'] = MESSAGE_IDS.get('resets', 0) + 1
+        DIRTY_HISTORIES.clear()
+        rebuild_indexes()
+        search_index.clear_index()
+
+        log_mutation(None, {'resets': MESSAGE_IDS['resets']}, operation='clear')
+
+def transcribe_database():
+    """
+    Write the stored databases into the snapshot files.
+    """
+    write_snapshot(capture_snapshot())
+
+    print("Transcribed database information to snapshot files.")
+
+def start_db_backup_scheduler():
+    """
+    Opens the write-ahead log, then creates a daemon thread that checks
+    every 30 seconds whether the log should be compacted into a new snapshot.
+    """
+
+    open_write_ahead_log()
+
+    def compact_timed():
+        """ Helper function to run the delayed loop on compact_database """
+        while True:
+            time.sleep(30)
+            if wal_needs_compacting():
+                compact_database()
+
+    backup_thread = threading.Thread(target=compact_timed)
+    backup_thread.daemon = True
+    backup_thread.start()
+
+
+def retrieve_data_from_files():
+    """
+    Fetch information from the database files into
+    the global variables, then replay the write-ahead log on top.
+    """
+    # Loading creates millions of objects that are never freed, so the cyclic
+    # garbage collector would repeatedly scan them all for nothing.
+    gc.disable()
+    try:
+        for name, table in SNAPSHOT_TABLES.items():
+            try:
+                data = read_snapshot_file(name)
+            except FileNotFoundError:
+                # Tables added since the snapshot was written start out empty.
+                data = {} if isinstance(table, dict) else []
+            table.clear()
+            if isinstance(table, dict):
+                table.update(data)
+            elif name == "channel_data":
+                # Rows without messages have their history stored in its own file.
+                table.extend(ChannelData(row) for row in data)
+            else:
+                table.extend(data)
+
+        if SNAPSHOT_INFO.get('version', 1) < 2:
+            # Version 1 snapshots store messages newest first.
+            for channel_data in CHANNEL_DATA_LIST:
+                if 'messages' in channel_data:
+                    channel_data['messages'].reverse()
+        SNAPSHOT_INFO['version'] = SNAPSHOT_VERSION
+
+        rebuild_indexes()
+        # Histories stored in channel_data.json don't have their own file yet.
+        DIRTY_HISTORIES.clear()
+        DIRTY_HISTORIES.update(LOADED_HISTORIES)
+        # Channels are indexed again the first time they are searched.
+        search_index.clear_index()
+
+        replay_write_ahead_log(WAL_COMPACTING_PATH)
+        replay_write_ahead_log(WAL_PATH)
+        enforce_history_budget(None)
+
+        # The counters never go back behind an id already in use, in case
+        # they are missing (snapshots from before ids were counted) or stale.
+        MESSAGE_IDS['next_message_id'] = max(
+            MESSAGE_IDS.get('next_message_id', 0),
+            max(MESSAGE_LOCATION_INDEX, default=-1) + 1,
+            max(SCHEDULED_MESSAGES_INDEX, default=-1) + 1)
+        MESSAGE_IDS['num_channels'] = max(MESSAGE_IDS.get('num_channels', 0),
+                                          max(CHANNELS_INDEX, default=0))
+        # The blocks of ids held before loading may not be reserved any more.
+        drop_id_blocks()
+    finally:
+        gc.enable()
@@ -5,12 +5,17 @@ In most cases these tests are checking issues that are checked for
 in database.py which prevent other coders from improperly using the functions
 provided.
 """
+import json
+import threading
 import pytest
 import database
 import auth
 import channels
 import channel
+import message
 import error
+import other
+import search_index
 
 
 def test_remove_token_invalid_token():
@@ -67,3 +72,536 @@ def test_update_password():
 
     database.set_password("email@email.com", "anotherPassword23")
     assert database.get_password_data("email@email.com")['password'] == "anotherPassword23"
+
+def test_indexes_match_lists():
+    """ Every row in the lists can be found through its index. """
+    user = auth.auth_register("email@email.com", "password4", "test", "name")
+    c_id_dict = channels.channels_create(user['token'], "test_channel", True)
+
+    assert database.get_user_data(user['u_id']) is database.get_users()[0]
+    assert database.get_permission_dict(user['u_id']) is database.get_permissions_list()[0]
+    assert database.get_channel(c_id_dict['channel_id']) is database.get_channels()[0]
+    assert database.get_password_data("email@email.com")['email'] == "email@email.com"
+
+def test_rebuild_indexes():
+    """ Indexes are rebuilt from the lists, e.g. after loading from files. """
+    user = auth.auth_register("email@email.com", "password4", "test", "name")
+    c_id_dict = channels.channels_create(user['token'], "test_channel", True)
+
+    database.USERS_INDEX.clear()
+    database.CHANNEL_DATA_INDEX.clear()
+    assert database.get_user_data(user['u_id']) is None
+
+    database.rebuild_indexes()
+    assert database.get_user_data(user['u_id'])['name_first'] == "test"
+    assert database.get_channel_data(c_id_dict['channel_id'])['member_ids'] == [user['u_id']]
+
+def test_sessions_both_directions():
+    """ Sessions can be looked up by token or by u_id, and revoked from both. """
+    database.set_current_user(5, "token5")
+
+    assert database.get_current_user("token5") == 5
+    assert database.get_token_from_user(5) == "token5"
+
+    assert database.remove_current_user("token5") is True
+    assert database.get_current_user("token5") is None
+    assert database.get_token_from_user(5) is None
+
+def test_message_index():
+    """ Messages are found through the message index and removed from it. """
+    user = auth.auth_register("email@email.com", "password4", "test", "name")
+    c_id_dict = channels.channels_create(user['token'], "test_channel", True)
+    message_file = {'message_id': 7, 'u_id': user['u_id'], 'message': "hello",
+                    'time_created': 0, 'reacts': [], 'is_pinned': False}
+
+    database.set_message(c_id_dict['channel_id'], message_file)
+    assert database.get_message(7) is message_file
+
+    database.remove_message(7)
+    assert database.get_message(7) is None
+    assert database.get_message_location(7) is None
+    assert database.get_channel_data(c_id_dict['channel_id'])['messages'] == []
+
+def test_get_channel_messages_newest_first():
+    """ Messages are appended but read back newest first. """
+    user = auth.auth_register("email@email.com", "password4", "test", "name")
+    c_id_dict = channels.channels_create(user['token'], "test_channel", True)
+    for message_id in range(5):
+        database.set_message(c_id_dict['channel_id'],
+                             {'message_id': message_id, 'u_id': user['u_id'],
+                              'message': str(message_id), 'time_created': 0,
+                              'reacts': [], 'is_pinned': False})
+
+    assert database.get_num_messages(c_id_dict['channel_id']) == 5
+    messages = database.get_channel_messages(c_id_dict['channel_id'], 1, 3)
+    assert [message['message_id'] for message in messages] == [3, 2, 1]
+    messages = database.get_channel_messages(c_id_dict['channel_id'], 3, 50)
+    assert [message['message_id'] for message in messages] == [1, 0]
+
+def test_member_set():
+    """ MemberSets keep u_ids in the order added, and compare equal to lists. """
+    members = database.MemberSet([3, 1])
+    members.append(2)
+    members.append(1)
+    assert members == [3, 1, 2]
+    assert members != [1, 2, 3]
+    assert 2 in members and 4 not in members
+    assert len(members) == 3
+
+    members.remove(1)
+    assert list(members) == [3, 2]
+    with pytest.raises(ValueError):
+        members.remove(1)
+
+def test_channel_membership():
+    """ Owners and members are checked without scanning the channel's lists. """
+    owner = auth.auth_register("email@email.com", "password4", "test", "name")
+    member = auth.auth_register("email2@email.com", "password4", "test", "name")
+    c_id = channels.channels_create(owner['token'], "test_channel", True)['channel_id']
+    channel.channel_join(member['token'], c_id)
+
+    channel_data = database.get_channel_data(c_id)
+    assert isinstance(channel_data['member_ids'], database.MemberSet)
+    assert channel_data['member_ids'] == [owner['u_id'], member['u_id']]
+    assert database.is_channel_member(c_id, member['u_id'])
+    assert not database.is_channel_owner(c_id, member['u_id'])
+    assert database.is_channel_owner(c_id, owner['u_id'])
+
+    # Lists passed to set_channel_data are stored as MemberSets too.
+    database.set_channel_data({'channel_id': c_id, 'owner_ids': [member['u_id']],
+                               'member_ids': [member['u_id']], 'is_public': True})
+    assert isinstance(database.get_channel_data(c_id)['owner_ids'], database.MemberSet)
+    assert not database.is_channel_member(c_id, owner['u_id'])
+
+def test_user_channels_index():
+    """ The channels each user is in are kept up to date as they join and leave. """
+    owner = auth.auth_register("email@email.com", "password4", "test", "name")
+    member = auth.auth_register("email2@email.com", "password4", "test", "name")
+    c_ids = [channels.channels_create(owner['token'], f"channel_{i}", True)['channel_id']
+             for i in range(3)]
+
+    channel.channel_join(member['token'], c_ids[2])
+    channel.channel_invite(owner['token'], c_ids[0], member['u_id'])
+    assert [chan['channel_id'] for chan in database.get_user_channels(member['u_id'])] \
+        == [c_ids[0], c_ids[2]]
+
+    channel.channel_leave(member['token'], c_ids[0])
+    channel.channel_leave(owner['token'], c_ids[1])
+    assert [chan['channel_id'] for chan in database.get_user_channels(member['u_id'])] \
+        == [c_ids[2]]
+    assert [chan['channel_id'] for chan in database.get_user_channels(owner['u_id'])] \
+        == [c_ids[0], c_ids[2]]
+
+    database.USER_CHANNELS_INDEX.clear()
+    database.rebuild_indexes()
+    assert [chan['channel_id'] for chan in database.get_user_channels(member['u_id'])] \
+        == [c_ids[2]]
+
+def use_tmp_database(monkeypatch, tmp_path):
+    """ Point the database files at an empty snapshot in tmp_path. """
+    monkeypatch.setattr(database, "DATABASE_PATH", str(tmp_path))
+    monkeypatch.setattr(database, "WAL_PATH", str(tmp_path / "wal.log"))
+    monkeypatch.setattr(database, "WAL_COMPACTING_PATH", str(tmp_path / "wal.log.compacting"))
+    database.transcribe_database()
+
+def create_activity():
+    """ Make a change to every table, returning the user and channel. """
+    user = auth.auth_register("email@email.com", "password4", "test", "name")
+    c_id_dict = channels.channels_create(user['token'], "test_channel", True)
+    message_id = message.message_send(user['token'], c_id_dict['channel_id'], "hello")
+    message.message_react(user['token'], message_id['message_id'], 1)
+    message.message_send(user['token'], c_id_dict['channel_id'], "to be removed")
+    database.remove_message(message_id['message_id'] + 1)
+    return user, c_id_dict
+
+def reload_database():
+    """ Wipe the database in memory and load it back from disk. """
+    saved = json.dumps([database.USERS, database.USER_GLOBAL_PERMISSIONS_LIST,
+                        database.CHANNELS, database.CHANNEL_DATA_LIST,
+                        database.MESSAGE_LOCATION_LIST, database.PASSWORD_DATA_LIST,
+                        database.NUM_USERS], default=list)
+    database.close_write_ahead_log()
+    database.clear_database()
+    database.retrieve_data_from_files()
+    loaded = json.dumps([database.USERS, database.USER_GLOBAL_PERMISSIONS_LIST,
+                         database.CHANNELS, database.CHANNEL_DATA_LIST,
+                         database.MESSAGE_LOCATION_LIST, database.PASSWORD_DATA_LIST,
+                         database.NUM_USERS], default=list)
+    return saved, loaded
+
+def test_write_ahead_log_replay(monkeypatch, tmp_path):
+    """ Changes made since the last snapshot are replayed from the log. """
+    use_tmp_database(monkeypatch, tmp_path)
+    database.open_write_ahead_log()
+    try:
+        _, c_id_dict = create_activity()
+    finally:
+        saved, loaded = reload_database()
+
+    assert saved == loaded
+    assert database.get_num_messages(c_id_dict['channel_id']) == 1
+
+def test_write_ahead_log_compaction(monkeypatch, tmp_path):
+    """ Compacting writes a snapshot and starts a new log. """
+    use_tmp_database(monkeypatch, tmp_path)
+    database.open_write_ahead_log()
+    try:
+        user, c_id_dict = create_activity()
+        database.compact_database()
+        assert (tmp_path / "wal.log").stat().st_size == 0
+        assert not (tmp_path / "wal.log.compacting").exists()
+
+        message.message_send(user['token'], c_id_dict['channel_id'], "after compacting")
+    finally:
+        saved, loaded = reload_database()
+
+    assert saved == loaded
+    assert database.get_num_messages(c_id_dict['channel_id']) == 2
+
+def test_compact_while_creating_channels(monkeypatch, tmp_path):
+    """ Channels made while a snapshot is captured are loaded with their data. """
+    use_tmp_database(monkeypatch, tmp_path)
+    database.open_write_ahead_log()
+    created = []
+    try:
+        user = auth.auth_register("email@email.com", "password4", "test", "name")
+        copy_table = database.copy_table
+
+        def create_while_copying(table, copy_row):
+            if table != "channels":
+                return copy_table(table, copy_row)
+            created.append(channels.channels_create(user['token'], "before", True))
+            copied = copy_table(table, copy_row)
+            created.append(channels.channels_create(user['token'], "after", True))
+            return copied
+
+        monkeypatch.setattr(database, "copy_table", create_while_copying)
+        database.compact_database()
+        monkeypatch.setattr(database, "copy_table", copy_table)
+    finally:
+        saved, loaded = reload_database()
+
+    assert saved == loaded
+    for c_id_dict in created:
+        assert database.get_channel(c_id_dict['channel_id']) is not None
+        assert user['u_id'] in database.get_channel_data(c_id_dict['channel_id'])['member_ids']
+
+def test_snapshot_checksum(monkeypatch, tmp_path):
+    """ Snapshot files are checked against their checksum when loaded. """
+    use_tmp_database(monkeypatch, tmp_path)
+    auth.auth_register("email@email.com", "password4", "test", "name")
+    database.transcribe_database()
+    assert not list(tmp_path.glob("*.tmp"))
+
+    corrupt = (tmp_path / "users.json").read_bytes().replace(b"test", b"tset")
+    (tmp_path / "users.json").write_bytes(corrupt)
+    with pytest.raises(ValueError):
+        database.retrieve_data_from_files()
+
+def test_snapshot_without_checksum(monkeypatch, tmp_path):
+    """ Files written before checksums were added can still be loaded. """
+    use_tmp_database(monkeypatch, tmp_path)
+    (tmp_path / "num_users.json").write_text('{"num_users": 4}')
+
+    database.retrieve_data_from_files()
+    assert database.NUM_USERS['num_users'] == 4
+
+def test_binary_snapshot(monkeypatch, tmp_path):
+    """ A binary snapshot loads back the same data as a JSON one. """
+    use_tmp_database(monkeypatch, tmp_path)
+    create_activity()
+    database.transcribe_database()
+
+    database.convert_snapshot("json", "binary")
+    monkeypatch.setattr(database, "SNAPSHOT_FORMAT", "binary")
+    for name in database.SNAPSHOT_TABLES:
+        assert (database.read_snapshot_file(name, "binary")
+                == database.read_snapshot_file(name, "json"))
+
+    saved, loaded = reload_database()
+    assert saved == loaded
+
+def test_binary_snapshot_checksum(monkeypatch, tmp_path):
+    """ Binary snapshot files are checked against their checksum when loaded. """
+    use_tmp_database(monkeypatch, tmp_path)
+    monkeypatch.setattr(database, "SNAPSHOT_FORMAT", "binary")
+    auth.auth_register("email@email.com", "password4", "test", "name")
+    database.transcribe_database()
+
+    corrupt = (tmp_path / "users.bin").read_bytes().replace(b"test", b"tset")
+    (tmp_path / "users.bin").write_bytes(corrupt)
+    with pytest.raises(ValueError):
+        database.retrieve_data_from_files()
+
+def test_lazy_history(monkeypatch, tmp_path):
+    """
+    Histories over the memory budget are written to disk and dropped,
+    then loaded again when they are next needed.
+    """
+    use_tmp_database(monkeypatch, tmp_path)
+    monkeypatch.setattr(database, "LAZY_HISTORY", True)
+    monkeypatch.setattr(database, "HISTORY_MEMORY_BUDGET", 2)
+
+    user = auth.auth_register("email@email.com", "password4", "test", "name")
+    channel_1 = channels.channels_create(user['token'], "channel_1", True)['channel_id']
+    channel_2 = channels.channels_create(user['token'], "channel_2", True)['channel_id']
+    message_id = message.message_send(user['token'], channel_1, "first")['message_id']
+    message.message_send(user['token'], channel_1, "second")
+    message.message_send(user['token'], channel_2, "third")
+
+    # channel_1 was least recently used, so it was unloaded.
+    assert channel_1 not in database.LOADED_HISTORIES
+    assert 'messages' not in database.get_channel_data(channel_1)
+    assert (tmp_path / "messages" / f"{channel_1}.json").exists()
+
+    assert database.get_message(message_id)['message'] == "first"
+    assert channel_1 in database.LOADED_HISTORIES
+    assert channel_2 not in database.LOADED_HISTORIES
+
+    messages = channel.channel_messages(user['token'], channel_2, 0)['messages']
+    assert [msg['message'] for msg in messages] == ["third"]
+    assert len(other.search(user['token'], "i")['messages']) == 2
+
+def test_lazy_history_snapshot(monkeypatch, tmp_path):
+    """ A snapshot with lazy histories loads back the same data. """
+    use_tmp_database(monkeypatch, tmp_path)
+    monkeypatch.setattr(database, "LAZY_HISTORY", True)
+    monkeypatch.setattr(database, "HISTORY_MEMORY_BUDGET", 1)
+    database.open_write_ahead_log()
+    try:
+        user, c_id_dict = create_activity()
+        channels.channels_create(user['token'], "channel_2", True)
+        database.compact_database()
+        message.message_send(user['token'], c_id_dict['channel_id'], "after compacting")
+    finally:
+        database.close_write_ahead_log()
+
+    saved = [database.get_channel_messages(channel_id, 0, 50) for channel_id in (1, 2)]
+    database.close_write_ahead_log()
+    database.clear_database()
+    database.retrieve_data_from_files()
+    loaded = [database.get_channel_messages(channel_id, 0, 50) for channel_id in (1, 2)]
+
+    assert saved == loaded
+    assert database.get_num_messages(c_id_dict['channel_id']) == 2
+
+def test_search_index_reload(monkeypatch, tmp_path):
+    """ The search index is rebuilt from the snapshot and the write-ahead log. """
+    use_tmp_database(monkeypatch, tmp_path)
+    database.open_write_ahead_log()
+    try:
+        user, c_id_dict = create_activity()
+        database.compact_database()
+        message_id = message.message_send(user['token'], c_id_dict['channel_id'], "hello again")
+        message.message_edit(user['token'], message_id['message_id'], "edited")
+    finally:
+        reload_database()
+
+    # Sessions aren't stored, so log in again.
+    user = auth.auth_login("email@email.com", "password4")
+    assert [msg['message'] for msg in other.search(user['token'], "hello")['messages']] == ["hello"]
+    assert [msg['message'] for msg in other.search(user['token'], "edit")['messages']] == ["edited"]
+    assert other.search(user['token'], "removed")['messages'] == []
+
+def test_baseline_snapshot(monkeypatch, tmp_path):
+    """ Snapshots written before messages were stored oldest first are read in the right order. """
+    monkeypatch.setattr(database, "DATABASE_PATH", str(tmp_path))
+    monkeypatch.setattr(database, "WAL_PATH", str(tmp_path / "wal.log"))
+    monkeypatch.setattr(database, "WAL_COMPACTING_PATH", str(tmp_path / "wal.log.compacting"))
+    messages = [{'message_id': message_id, 'u_id': 1, 'message': f"message {message_id}",
+                 'time_created': 1000 + message_id, 'reacts': [], 'is_pinned': False}
+                for message_id in range(60)]
+    # Written as the first version did, newest first and without snapshot_info.
+    baseline = {
+        "channel_data": [{'channel_id': 1, 'owner_ids': [1], 'member_ids': [1],
+                          'messages': messages[::-1], 'is_public': True}],
+        "channels": [{'channel_id': 1, 'name': "channel"}],
+        "message_locations": [{'message_id': message['message_id'], 'channel_id': 1}
+                              for message in messages],
+    }
+    for name, data in baseline.items():
+        with open(tmp_path / f"{name}.json", "w") as snapshot_file:
+            json.dump(data, snapshot_file)
+
+    database.retrieve_data_from_files()
+    newest = database.get_channel_messages(1, 0, 50)
+    assert [msg['message_id'] for msg in newest] == list(range(59, 9, -1))
+    assert [msg['message_id'] for msg in database.get_channel_messages(1, 50, 50)] \
+        == list(range(9, -1, -1))
+
+    # Once written again, the snapshot is read back the same way.
+    database.transcribe_database()
+    assert database.read_snapshot_file("snapshot_info") == {'version': 2}
+    database.clear_database()
+    database.retrieve_data_from_files()
+    assert database.get_channel_messages(1, 0, 50) == newest
+
+def test_search_index_built_on_search(monkeypatch, tmp_path):
+    """ Loading the database doesn't read histories into the search index until searched. """
+    use_tmp_database(monkeypatch, tmp_path)
+    monkeypatch.setattr(database, "LAZY_HISTORY", True)
+    monkeypatch.setattr(database, "HISTORY_MEMORY_BUDGET", 1)
+    user = auth.auth_register("email@email.com", "password4", "test", "name")
+    c_ids = [channels.channels_create(user['token'], f"channel_{i}", True)['channel_id']
+             for i in range(2)]
+    for c_id in c_ids:
+        message.message_send(user['token'], c_id, f"hello {c_id}")
+    database.transcribe_database()
+
+    database.clear_database()
+    database.retrieve_data_from_files()
+    assert not database.LOADED_HISTORIES
+    assert not search_index.INDEXED_CHANNELS
+
+    user = auth.auth_login("email@email.com", "password4")
+    assert len(other.search(user['token'], "hello")['messages']) == 2
+    assert search_index.INDEXED_CHANNELS == set(c_ids)
+
+def test_scheduled_messages_reload(monkeypatch, tmp_path):
+    """ Scheduled messages and the next message_id are replayed from the log. """
+    use_tmp_database(monkeypatch, tmp_path)
+    database.open_write_ahead_log()
+    try:
+        create_activity()
+        message_id = database.generate_message_id()
+        database.set_scheduled_message({'message_id': message_id, 'channel_id': 1, 'u_id': 1,
+                                        'message': "later", 'time_sent': 0})
+    finally:
+        reload_database()
+
+    assert database.get_scheduled_message(message_id)['message'] == "later"
+    # Ids left in the block reserved before reloading are skipped.
+    assert database.generate_message_id() == database.ID_BLOCK_SIZES['next_message_id']
+
+def test_message_ids_legacy_snapshot(monkeypatch, tmp_path):
+    """ Snapshots without a message_ids file carry on after the newest message. """
+    use_tmp_database(monkeypatch, tmp_path)
+    create_activity()
+    database.transcribe_database()
+    (tmp_path / "message_ids.json").unlink()
+    (tmp_path / "scheduled_messages.json").unlink()
+
+    database.clear_database()
+    database.retrieve_data_from_files()
+    assert database.generate_message_id() == 1
+
+def test_message_ids_stale_snapshot(monkeypatch, tmp_path):
+    """ A message_ids file behind the stored messages doesn't hand out their ids again. """
+    use_tmp_database(monkeypatch, tmp_path)
+    user, c_id_dict = create_activity()
+    channels.channels_create(user['token'], "second_channel", True)
+    database.transcribe_database()
+    database.write_snapshot_file("message_ids", {'next_message_id': 0, 'num_channels': 0})
+
+    database.clear_database()
+    database.retrieve_data_from_files()
+    # Message 0 is still stored, and message 1 was removed.
+    assert database.generate_message_id() == 1
+    assert database.generate_channel_id() == c_id_dict['channel_id'] + 2
+
+def test_id_blocks():
+    """ Ids are handed out in order from blocks, reserving a new block when one runs out. """
+    block_size = database.ID_BLOCK_SIZES['next_message_id']
+    message_ids = [database.generate_message_id() for _ in range(block_size + 1)]
+    assert message_ids == list(range(block_size + 1))
+    assert database.MESSAGE_IDS['next_message_id'] == 2 * block_size
+
+    database.clear_database()
+    assert database.generate_message_id() == 0
+    assert database.generate_channel_id() == 1
+
+    # Blocks reserved before a reset are dropped, even if this process didn't reset.
+    database.clear_tables()
+    assert database.generate_message_id() == 0
+    assert database.generate_channel_id() == 1
+
+def test_concurrent_channel_creates():
+    """ Channels created at once are all given different ids. """
+    user = auth.auth_register("email@email.com", "password4", "test", "name")
+    c_ids = []
+    run_in_threads(lambda i: c_ids.append(
+        channels.channels_create(user['token'], f"channel_{i}", True)['channel_id']),
+                   [(i,) for i in range(20)])
+
+    assert sorted(c_ids) == list(range(1, 21))
+    assert len(database.get_channels()) == 20
+
+def test_email_and_handle_indexes(monkeypatch, tmp_path):
+    """ Users are found by email and handle, including after changing them and reloading. """
+    use_tmp_database(monkeypatch, tmp_path)
+    database.open_write_ahead_log()
+    try:
+        user = auth.auth_register("email@email.com", "password4", "test", "name")
+        assert database.get_user_by_handle("testname")['u_id'] == user['u_id']
+
+        database.set_user_data(dict(database.get_user_data(user['u_id']),
+                                    email="new@email.com", handle_str="newhandle"))
+        assert database.get_user_by_email("email@email.com") is None
+        assert database.get_user_by_handle("testname") is None
+    finally:
+        reload_database()
+
+    assert database.get_user_by_email("new@email.com")['u_id'] == user['u_id']
+    assert database.get_user_by_handle("newhandle")['u_id'] == user['u_id']
+    assert database.get_user_by_handle("testname") is None
+
+def run_in_threads(function, args_list):
+    """ Run function once per args in args_list, each on its own thread. """
+    threads = [threading.Thread(target=function, args=args) for args in args_list]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+def test_concurrent_reacts():
+    """ Reacts from many threads on one message are all kept. """
+    owner = auth.auth_register("email@email.com", "password4", "test", "name")
+    c_id = channels.channels_create(owner['token'], "channel", True)['channel_id']
+    message_id = message.message_send(owner['token'], c_id, "hello")['message_id']
+    users = [auth.auth_register(f"email{i}@email.com", "password4", "test", "name")
+             for i in range(20)]
+    for user in users:
+        channel.channel_join(user['token'], c_id)
+
+    run_in_threads(message.message_react,
+                   [(user['token'], message_id, 1) for user in users])
+
+    react = database.get_message(message_id)['reacts'][0]
+    assert sorted(react['u_ids']) == sorted(user['u_id'] for user in users)
+
+def test_concurrent_joins():
+    """ Users joining different channels at once are all added. """
+    owner = auth.auth_register("email@email.com", "password4", "test", "name")
+    c_ids = [channels.channels_create(owner['token'], f"channel_{i}", True)['channel_id']
+             for i in range(4)]
+    users = [auth.auth_register(f"email{i}@email.com", "password4", "test", "name")
+             for i in range(20)]
+
+    run_in_threads(channel.channel_join,
+                   [(user['token'], c_ids[i % 4]) for i, user in enumerate(users)])
+
+    for i, c_id in enumerate(c_ids):
+        expected = [owner['u_id']] + [user['u_id'] for user in users[i::4]]
+        assert sorted(database.get_channel_data(c_id)['member_ids']) == sorted(expected)
+
+def test_compact_while_sending(monkeypatch, tmp_path):
+    """ Messages sent while the database is compacted are all kept. """
+    use_tmp_database(monkeypatch, tmp_path)
+    database.open_write_ahead_log()
+    try:
+        user, c_id_dict = create_activity()
+
+        def send_messages(start):
+            for i in range(start, start + 50):
+                message.message_send(user['token'], c_id_dict['channel_id'], f"message {i}")
+
+        compactor = threading.Thread(target=lambda: [database.compact_database()
+                                                     for _ in range(5)])
+        compactor.start()
+        run_in_threads(send_messages, [(0,), (50,)])
+        compactor.join()
+    finally:
+        saved, loaded = reload_database()
+
+    assert saved == loaded
+    assert database.get_num_messages(c_id_dict['channel_id']) == 101
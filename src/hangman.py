@@ -1,6 +1,7 @@
 """ Functions for hangman. """
 
 import random
+from array import array
 import error
 import hangmanbot
 import message_parser
@@ -14,6 +15,85 @@ import message_parser
 # List not in database.py as we have decided to not make hangman games persistent
 HANGMANS = []
 
+WORDS_PATH = "/usr/share/dict/words"
+
+# Used when there is no word list at WORDS_PATH, as not every host has one.
+FALLBACK_WORDS = (
+    "cat", "dog", "sun", "tree", "book", "fish", "apple", "house", "river", "cloud",
+    "garden", "planet", "bridge", "market", "orange", "kitchen", "library", "mountain",
+    "keyboard", "elephant", "umbrella", "computer", "hospital", "notebook", "dinosaur",
+    "blacksmith", "playground", "thunderclap", "watermelon", "journalism", "background",
+)
+
+# Words are rated by how many different letters they have, since each
+# different letter is another guess that can be correct.
+# [(difficulty, fewest different letters), ...], easiest first
+DIFFICULTIES = [('easy', 8), ('medium', 5), ('hard', 0)]
+
+# The word list, read from WORDS_PATH by load_words the first time a word is chosen.
+# words is a tuple of every word.
+# filtered maps (length, difficulty) to an array of the positions in words
+# of the words that match, where None matches anything.
+WORD_LIST = {'words': None, 'filtered': {}}
+
+def get_difficulty(word):
+    """ Helper function used to return the difficulty of guessing word. """
+
+    num_letters = len(set(word.lower()))
+    return next(difficulty for difficulty, fewest in DIFFICULTIES if num_letters >= fewest)
+
+def load_words(path=WORDS_PATH):
+    """
+    Read the word list into WORD_LIST and index it by length and difficulty.
+    FALLBACK_WORDS are used if there is no word list at path.
+    """
+
+    try:
+        with open(path) as wordfile:
+            words = tuple(word for word in (line.strip() for line in wordfile) if word != '')
+    except FileNotFoundError:
+        words = FALLBACK_WORDS
+
+    filtered = {}
+    for position, word in enumerate(words):
+        difficulty = get_difficulty(word)
+        for key in ((len(word), None), (None, difficulty), (len(word), difficulty)):
+            filtered.setdefault(key, array('I')).append(position)
+
+    WORD_LIST['filtered'] = filtered
+    WORD_LIST['words'] = words
+
+def choose_word(length=None, difficulty=None):
+    """ Return a random word, of the given length and difficulty if given. """
+
+    if WORD_LIST['words'] is None:
+        load_words()
+    words = WORD_LIST['words']
+
+    if length is None and difficulty is None:
+        positions = range(len(words))
+    else:
+        positions = WORD_LIST['filtered'].get((length, difficulty))
+
+    if not positions:
+        raise error.InputError(description="There are no words for hangman to choose from")
+    return words[random.choice(positions)]
+
+def parse_hangman_options(options):
+    """ Helper function used to return the (length, difficulty) given after /hangman,
+    returns None if the options are not valid. """
+
+    length = None
+    difficulty = None
+    for option in options:
+        if option.isdigit() and length is None:
+            length = int(option)
+        elif option in dict(DIFFICULTIES) and difficulty is None:
+            difficulty = option
+        else:
+            return None
+    return (length, difficulty)
+
 def find_game(channel_id):
     """ Helper function used to return game of hangman,
     returns None if game not found. """
@@ -23,8 +103,9 @@ def find_game(channel_id):
             return game
     return None
 
-def hangman_start(channel_id):
-    """ Given channel_id, start a game of hangman. """
+def hangman_start(channel_id, length=None, difficulty=None):
+    """ Given channel_id, start a game of hangman.
+    The word can be limited to a length and difficulty. """
 
     # If hangman game already active in this channel, raise InputError.
     for game in HANGMANS:
@@ -32,6 +113,9 @@ def hangman_start(channel_id):
             raise error.InputError(description="""There is already a game of hangman active
                                                   in this channel""")
 
+    # Generate a word that should be used
+    word = choose_word(length, difficulty)
+
     # Bot is called
     bot_id = hangmanbot.call_bot(channel_id)
 
@@ -39,12 +123,6 @@ def hangman_start(channel_id):
     msg = "A game of hangman has been started in this channel"
     message_parser.parse_message(bot_id['bot_id'], channel_id, msg)
 
-    # Generate a word that should be used
-    words = []
-    with open("/usr/share/dict/words") as wordfile:
-        words = wordfile.readlines()
-    word = random.choice(words).strip()
-
     # Add the hangman game to the list HANGMANS
     new_game = {"channel_id": channel_id,
                 "word": word,
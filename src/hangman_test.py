@@ -12,6 +12,7 @@ from message import message_send
 from message_test import set_reacts
 from other import search
 from hangman import hangman_evil_answer, hangman_clear_game_data
+import hangman
 BOT_TOKEN = "thisisthetokenforthebot"
 
 
@@ -204,3 +205,63 @@ def test_hangmne_guess_fail():
             'is_pinned': False
         }]
     }
+
+###############################################################
+#
+#                   hangman_word_list_testing
+#
+###############################################################
+
+@pytest.fixture
+def word_file(monkeypatch, tmp_path):
+    """
+    Load a small word list instead of the system one, and put the
+    system one back after the test.
+    """
+    monkeypatch.setitem(hangman.WORD_LIST, 'words', None)
+    monkeypatch.setitem(hangman.WORD_LIST, 'filtered', {})
+    path = tmp_path / "words"
+    path.write_text("cat\ndog\n\nzzz\nabcdefgh\nabcdefghij\n")
+    hangman.load_words(str(path))
+
+def test_hangman_word_filters(word_file):
+    """
+    Test words can be chosen by length and difficulty.
+    """
+    # pylint: disable=unused-argument,redefined-outer-name
+    assert hangman.choose_word() in ("cat", "dog", "zzz", "abcdefgh", "abcdefghij")
+    assert hangman.choose_word(3) in ("cat", "dog", "zzz")
+    assert hangman.choose_word(difficulty='easy') in ("abcdefgh", "abcdefghij")
+    assert hangman.choose_word(3, 'hard') in ("cat", "dog", "zzz")
+    assert hangman.choose_word(8, 'easy') == "abcdefgh"
+    with pytest.raises(InputError):
+        hangman.choose_word(4)
+    with pytest.raises(InputError):
+        hangman.choose_word(3, 'medium')
+
+def test_hangman_start_options(word_file):
+    """
+    Test "/hangman" followed by a length and difficulty starts a game with a matching word,
+    and other text after "/hangman" is just a message.
+    """
+    # pylint: disable=unused-argument,redefined-outer-name
+    user_infor = auth_register(
+        "337992611@gamil.com", "ccc337992611", "Min", "Li")
+    channel_infor = channels_create(user_infor['token'], 'test_one', True)
+
+    message_send(user_infor['token'], channel_infor['channel_id'], "/hangman is fun")
+    assert hangman_evil_answer(channel_infor['channel_id']) is None
+
+    message_send(user_infor['token'], channel_infor['channel_id'], "/hangman easy 10")
+    assert hangman_evil_answer(channel_infor['channel_id'])['word'] == "abcdefghij"
+    hangman_clear_game_data()
+
+def test_hangman_no_word_file(monkeypatch, tmp_path):
+    """
+    Test words are chosen from the built in list if there is no word list.
+    """
+    monkeypatch.setitem(hangman.WORD_LIST, 'words', None)
+    monkeypatch.setitem(hangman.WORD_LIST, 'filtered', {})
+    hangman.load_words(str(tmp_path / "missing"))
+    assert hangman.choose_word() in hangman.FALLBACK_WORDS
+    assert len(hangman.choose_word(3)) == 3
@@ -1,129 +1,156 @@
 """
 File to handle all the decorators to be used to error check.
+
+The token, u_id, channel_id and message_id checks stacked on a route share
+one wrapper. Each check finds its argument's position when the route is
+decorated, and looks up what the argument refers to once per request. The
+route takes its arguments as before, and is passed what it needs of these
+lookups as keyword-only arguments, instead of looking them up again:
+    auth_u_id: the user the token argument belongs to (validate_token)
+    user: the user dictionary of the u_id argument (validate_u_id)
+    channel_data: the channel_data of the channel_id argument (validate_c_id)
+    message_location, message_data: those of the message_id argument (validate_msg_id)
 """
 
+from contextlib import ExitStack
 from functools import wraps
 from inspect import getfullargspec, signature
 
 from email_helper import email_check
 import database
 import error
+import tokens
 
-def validate_token(func):
+def warn_missing_arg(func, arg_name):
+    """ Print a warning that func will run without the check of arg_name. """
+    print("\033[93m" + f"WARNING: {arg_name} arg not found - running function "
+          + f"{func.__name__} without {arg_name} check." + "\033[0m")
+
+def add_check(func, arg_name, check):
     """
-    Runs a check if the token of an input is valid.
+    Returns func with check(context, value) run on its arg_name argument
+    before it. Checks added to an already checked route join its wrapper
+    and run before the checks already there.
+
+    The route is called with its own arguments, along with the keyword-only
+    arguments it names from the context the checks fill in, or all of it if
+    it takes **kwargs.
     """
-    argspec = getfullargspec(func)
-    @wraps(func)
+    checks = getattr(func, 'route_checks', [])
+    route = getattr(func, 'route_func', func)
+    argspec = getfullargspec(route)
+    if arg_name not in argspec.args:
+        warn_missing_arg(route, arg_name)
+        return func
+
+    checks = [(argspec.args.index(arg_name), arg_name, check)] + checks
+    # A route locked by database.locks_channel has its lock taken by the
+    # channel_id or message_id check, so that what they look up can't be
+    # changed before the route runs.
+    locks = getattr(route, 'locks_channel', False) and any(
+        name in ("channel_id", "message_id") for _, name, _ in checks)
+    body = route.__wrapped__ if locks else route
+    context_args = argspec.kwonlyargs if argspec.varkw is None else None
+
+    @wraps(route)
     def wrapper_func(*args, **kwargs):
         """ Wrapper function """
-        try:
-            token_arg_index = argspec.args.index("token")
-            # Check the token is valid.
-            if database.get_current_user(args[token_arg_index]) is None:
-                # Token is invalid
-                raise error.AccessError(description="Current token is not valid.")
-            else:
-                return func(*args, **kwargs)
-        except ValueError:
-            print("\033[93m" + "WARNING: Token arg not found - running function "
-                  + f"{func.__name__} without token check." + "\033[0m")
-            return func(*args, **kwargs)
-    wrapper_func.__signature__ = signature(func)
+        with ExitStack() as held_locks:
+            context = {'locks': held_locks if locks else None}
+            for index, name, arg_check in checks:
+                arg_check(context, args[index] if index < len(args) else kwargs[name])
+            del context['locks']
+
+            if context_args is not None:
+                context = {name: context[name] for name in context_args if name in context}
+            return body(*args, **kwargs, **context)
+    wrapper_func.__signature__ = signature(route)
+    wrapper_func.route_checks = checks
+    wrapper_func.route_func = route
     return wrapper_func
 
+def lock_channel(context, channel_id):
+    """ Hold the channel's lock until the route returns, if the route locks it. """
+    if context['locks'] is not None:
+        context['locks'].enter_context(database.channel_lock(channel_id))
+
+def check_token(context, token):
+    """ Check the token is valid, and store the u_id it belongs to. """
+    context['auth_u_id'] = tokens.get_token_user(token)
+    if context['auth_u_id'] is None:
+        # Token is invalid
+        raise error.AccessError(description="Current token is not valid.")
+
+def check_u_id(context, u_id):
+    """ Check the u_id is valid, and store the user's dictionary. """
+    context['user'] = database.get_user_data(u_id)
+    if context['user'] is None:
+        # u_id is invalid
+        raise error.InputError(description="u_id does not refer to a valid user")
+
+def check_c_id(context, channel_id):
+    """ Check the channel_id is valid, and store its channel_data. """
+    if context['locks'] is not None:
+        # Channels are never removed, so the channel still exists once locked.
+        if database.get_channel(channel_id) is None:
+            raise error.InputError(description="Channel ID is not a valid channel")
+        lock_channel(context, channel_id)
+
+    context['channel_data'] = database.get_channel_data(channel_id)
+    if context['channel_data'] is None:
+        raise error.InputError(description="Channel ID is not a valid channel")
+
+def check_msg_id(context, message_id):
+    """ Check the message_id exists, and store the message and where it is. """
+    context['message_location'] = database.get_message_location(message_id)
+    if context['message_location'] is not None:
+        lock_channel(context, context['message_location']['channel_id'])
+        # The message may have been removed while waiting for the lock.
+        context['message_data'] = database.get_message(message_id)
+    if context['message_location'] is None or context['message_data'] is None:
+        raise error.InputError(description="Message based on ID does not exist")
+
+def validate_token(func):
+    """
+    Runs a check if the token of an input is valid.
+    """
+    return add_check(func, "token", check_token)
+
 def validate_u_id(func):
     """
     Runs a check if the user_id input is valid.
     """
-    argspec = getfullargspec(func)
-    @wraps(func)
-    def wrapper_func(*args, **kwargs):
-        """ Wrapper function """
-        try:
-            uid_arg_index = argspec.args.index("u_id")
-            target_user = database.get_user_data(args[uid_arg_index])
-            # Check the u_id is valid.
-            if target_user is None:
-                # u_id is invalid
-                raise error.InputError(description="u_id does not refer to a valid user")
-            else:
-                return func(*args, **kwargs)
-        except ValueError:
-            print("\033[93m" + "WARNING: u_id arg not found - running function "
-                  + f"{func.__name__} without u_id check." + "\033[0m")
-            return func(*args, **kwargs)
-    wrapper_func.__signature__ = signature(func)
-    return wrapper_func
+    return add_check(func, "u_id", check_u_id)
 
 def validate_c_id(func):
     """
     Runs a check if the channel_id input is valid.
     """
-    argspec = getfullargspec(func)
-    @wraps(func)
-    def wrapper_func(*args, **kwargs):
-        """ Wrapper function """
-        try:
-            cidarg_index = argspec.args.index("channel_id")
-            target_channel = database.get_channel_data(args[cidarg_index])
-            # Check the u_id is valid.
-            if target_channel is None:
-                # u_id is invalid
-                raise error.InputError(description="Channel ID is not a valid channel")
-            else:
-                return func(*args, **kwargs)
-        except ValueError:
-            print("\033[93m" + "WARNING: c_id arg not found - running function "
-                  + f"{func.__name__} without c_id check." + "\033[0m")
-            return func(*args, **kwargs)
-    wrapper_func.__signature__ = signature(func)
-    return wrapper_func
+    return add_check(func, "channel_id", check_c_id)
 
 def validate_msg_id(func):
     """
     Runs a check if the message_id exists anywhere in the database.
     """
-    argspec = getfullargspec(func)
-    @wraps(func)
-    def wrapper_func(*args, **kwargs):
-        """ Wrapper function """
-        try:
-            msg_arg_index = argspec.args.index("message_id")
-            target_message = database.get_message(args[msg_arg_index])
-            # Check the u_id is valid.
-            if target_message is None:
-                # u_id is invalid
-                raise error.InputError(description="Message based on ID does not exist")
-            else:
-                return func(*args, **kwargs)
-        except ValueError:
-            print("\033[93m" + "WARNING: msg_id arg not found - running function "
-                  + f"{func.__name__} without msg_id check." + "\033[0m")
-            return func(*args, **kwargs)
-    wrapper_func.__signature__ = signature(func)
-    return wrapper_func
+    return add_check(func, "message_id", check_msg_id)
 
 def validate_email_format(func):
     """
     Runs a check if the email parameter is not a valid email format.
     """
     argspec = getfullargspec(func)
+    if "email" not in argspec.args:
+        warn_missing_arg(func, "email")
+        return func
+    email_arg_index = argspec.args.index("email")
     @wraps(func)
     def wrapper_func(*args, **kwargs):
         """ Wrapper function """
-        try:
-            email_arg_index = argspec.args.index("email")
-            email = args[email_arg_index]
-            # Check the email is valid
-            if email_check(email) is False:
-                raise error.InputError(description="The email you entered is not valid")
-            else:
-                return func(*args, **kwargs)
-        except ValueError:
-            print("\033[93m" + "WARNING: email arg not found - running function "
-                  + f"{func.__name__} without email check." + "\033[0m")
-            return func(*args, **kwargs)
+        email = args[email_arg_index] if email_arg_index < len(args) else kwargs["email"]
+        # Check the email is valid
+        if email_check(email) is False:
+            raise error.InputError(description="The email you entered is not valid")
+        return func(*args, **kwargs)
     wrapper_func.__signature__ = signature(func)
     return wrapper_func
 
@@ -133,32 +160,28 @@ def validate_login_perms(func):
     removed from the slackr.
     """
     argspec = getfullargspec(func)
+    if "email" not in argspec.args:
+        warn_missing_arg(func, "email")
+        return func
+    email_arg_index = argspec.args.index("email")
     @wraps(func)
     def wrapper_func(*args, **kwargs):
         """ Wrapper function """
-        try:
-            email_arg_index = argspec.args.index("email")
-            email = args[email_arg_index]
-
-            # Try to grab this users ID. If the user doesnt exist, create a warning
-            # and run the function without checking the permission_id.
-            try:
-                target_u_id = next(u['u_id'] for u in database.get_users() if u['email'] == email)
-                target_perm_id = database.get_permission_dict(target_u_id).get('permission_id')
-                if target_perm_id == 66:
-                    raise error.AccessError(description="The account registered to this email has" +
-                                            " been removed from the slakr. " +
-                                            "[I'm sorry Dave, I'm afraid I can't do that]")
-                else:
-                    return func(*args, **kwargs)
-            except StopIteration:
-                print("\033[93m" + "WARNING: This email was not found  - running function "
-                      + f"{func.__name__} without permission_id check." + "\033[0m")
-                return func(*args, **kwargs)
-
-        except ValueError:
-            print("\033[93m" + "WARNING: email arg not found - running function "
-                  + f"{func.__name__} without email check." + "\033[0m")
+        email = args[email_arg_index] if email_arg_index < len(args) else kwargs["email"]
+
+        # Try to grab this users ID. If the user doesnt exist, create a warning
+        # and run the function without checking the permission_id.
+        target_user = database.get_user_by_email(email)
+        if target_user is None:
+            print("\033[93m" + "WARNING: This email was not found  - running function "
+                  + f"{func.__name__} without permission_id check." + "\033[0m")
             return func(*args, **kwargs)
+
+        target_perm_id = database.get_permission_dict(target_user['u_id']).get('permission_id')
+        if target_perm_id == 66:
+            raise error.AccessError(description="The account registered to this email has" +
+                                    " been removed from the slakr. " +
+                                    "[I'm sorry Dave, I'm afraid I can't do that]")
+        return func(*args, **kwargs)
     wrapper_func.__signature__ = signature(func)
     return wrapper_func
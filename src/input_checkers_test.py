@@ -0,0 +1,123 @@
+"""
+Tests for the checks in input_checkers.py, and what they pass on to routes.
+"""
+import inspect
+import sys
+import threading
+import pytest
+import database
+import input_checkers
+import auth
+import channels
+import channel
+import message
+import error
+import sqlite_storage
+
+@input_checkers.validate_token
+@input_checkers.validate_u_id
+@input_checkers.validate_c_id
+def checked_route(token, channel_id, u_id, **context):
+    """ Stand-in for a route, returning its arguments and what its checks looked up. """
+    return dict(context, token=token, channel_id=channel_id, u_id=u_id)
+
+@input_checkers.validate_token
+@input_checkers.validate_msg_id
+def message_route(token, message_id, *, message_data):
+    """ Stand-in for a route that only needs the message its checks looked up. """
+    # pylint: disable=unused-argument
+    return message_data
+
+def count_calls(monkeypatch, name):
+    """ Count the calls made to the database function name from outside database.py. """
+    calls = []
+    function = getattr(database, name)
+    def counted(*args):
+        if sys._getframe(1).f_globals is not vars(database): # pylint: disable=protected-access
+            calls.append(args)
+        return function(*args)
+    monkeypatch.setattr(database, name, counted)
+    return calls
+
+def test_route_context():
+    """ Each check looks up its argument once, and passes it on to the route. """
+    user = auth.auth_register("email@email.com", "password", "first", "user")
+    c_id = channels.channels_create(user['token'], "channel", True)['channel_id']
+
+    context = checked_route(user['token'], c_id, u_id=user['u_id'])
+    assert context['auth_u_id'] == user['u_id']
+    assert context['user'] is database.get_user_data(user['u_id'])
+    assert context['channel_data'] is database.get_channel_data(c_id)
+    assert context['token'] == user['token']
+    assert context['channel_id'] == c_id
+    assert context['u_id'] == user['u_id']
+    assert checked_route.route_checks[0][1] == "token"
+
+def test_route_args():
+    """ Routes are called with their own arguments, and only the context they name. """
+    user = auth.auth_register("email@email.com", "password", "first", "user")
+    c_id = channels.channels_create(user['token'], "channel", True)['channel_id']
+    message_id = message.message_send(user['token'], c_id, "hello")['message_id']
+
+    assert list(inspect.signature(message_route).parameters) \
+        == ["token", "message_id", "message_data"]
+    assert message_route(user['token'], message_id)['message'] == "hello"
+    assert message_route(message_id=message_id, token=user['token'])['message'] == "hello"
+    with pytest.raises(error.InputError):
+        message_route(user['token'], message_id + 1)
+
+def test_checks_in_order():
+    """ Checks run in the order they are stacked, outermost first. """
+    user = auth.auth_register("email@email.com", "password", "first", "user")
+    with pytest.raises(error.AccessError):
+        checked_route("invalid token", 123, 456)
+    with pytest.raises(error.InputError):
+        checked_route(user['token'], 123, user['u_id'])
+    with pytest.raises(error.InputError):
+        checked_route(user['token'], 123, 456)
+
+def test_one_lookup_per_entity(monkeypatch):
+    """ A route and its checks look up the token and message only once. """
+    user = auth.auth_register("email@email.com", "password", "first", "user")
+    c_id = channels.channels_create(user['token'], "channel", True)['channel_id']
+    message_id = message.message_send(user['token'], c_id, "hello")['message_id']
+
+    sessions = count_calls(monkeypatch, "get_current_user")
+    locations = count_calls(monkeypatch, "get_message_location")
+    messages = count_calls(monkeypatch, "get_message")
+    message.message_react(user['token'], message_id, 1)
+    assert len(sessions) == 1
+    assert len(locations) == 1
+    assert len(messages) == 1
+
+def test_nested_routes():
+    """ A route called from another route gets its own request context. """
+    user = auth.auth_register("email@email.com", "password", "first", "user")
+    # channels_create calls channel_join, which checks the same token.
+    c_id = channels.channels_create(user['token'], "channel", True)['channel_id']
+    assert channel.channel_details(user['token'], c_id)['name'] == "channel"
+
+def test_concurrent_sqlite_reacts(tmp_path):
+    """ Routes read their message after taking its channel's lock, even from SQLite. """
+    sqlite_storage.open_database(str(tmp_path / "slackr.sqlite3"))
+    database.use_storage_engine(sqlite_storage)
+    try:
+        owner = auth.auth_register("email@email.com", "password", "first", "user")
+        c_id = channels.channels_create(owner['token'], "channel", True)['channel_id']
+        users = [auth.auth_register(f"email{i}@email.com", "password", "first", "user")
+                 for i in range(8)]
+        for user in users:
+            channel.channel_join(user['token'], c_id)
+        message_id = message.message_send(owner['token'], c_id, "hello")['message_id']
+
+        threads = [threading.Thread(target=message.message_react,
+                                    args=(user['token'], message_id, 1)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        react = database.get_message(message_id)['reacts'][0]
+        assert sorted(react['u_ids']) == sorted(user['u_id'] for user in users)
+    finally:
+        database.use_storage_engine(None)
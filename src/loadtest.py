@@ -0,0 +1,114 @@
+"""
+Load test for running the server as several worker processes.
+
+Starts the server with an increasing number of workers sharing an SQLite
+database, and measures how many /message/send, /channel/messages and
+/channel/details requests per second a pool of client processes gets
+through.
+Each worker uses its own core, so expect throughput to grow with the
+number of workers until it reaches the number of cores.
+
+Run from the src directory with:
+    python3 loadtest.py [max_workers]
+"""
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+
+PORT = 8090
+URL = f"http://127.0.0.1:{PORT}"
+
+def post(route, payload):
+    """ POST payload as JSON to route, returning the decoded response. """
+    server_request = urllib.request.Request(f"{URL}{route}",
+                                            data=json.dumps(payload).encode('utf-8'),
+                                            headers={"Content-Type": "application/json"},
+                                            method="POST")
+    return json.load(urllib.request.urlopen(server_request))
+
+def get(route, params):
+    """ GET route with params, returning the decoded response. """
+    return json.load(urllib.request.urlopen(f"{URL}{route}?{urllib.parse.urlencode(params)}"))
+
+def wait_for_server(timeout=10):
+    """ Wait until the server answers requests. """
+    deadline = time.time() + timeout
+    while True:
+        try:
+            get("/echo", {'data': "hello"})
+            return
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.1)
+
+def run_client(token, channel_id, num_requests):
+    """
+    Make num_requests requests, taking turns sending a message, reading the
+    newest messages and reading the channel's details.
+    """
+    for i in range(num_requests // 3):
+        post("/message/send", {'token': token, 'channel_id': channel_id,
+                               'message': f"load test message {i}"})
+        get("/channel/messages", {'token': token, 'channel_id': channel_id, 'start': 0})
+        get("/channel/details", {'token': token, 'channel_id': channel_id})
+
+def load_test(num_workers, num_clients, requests_per_client):
+    """
+    Time num_clients clients making requests_per_client requests each
+    against a server with num_workers workers.
+    Returns a {workers, requests, seconds, requests_per_second} dictionary.
+    """
+    with tempfile.TemporaryDirectory() as tmp_path:
+        env = dict(os.environ, SLACKR_WORKERS=str(num_workers),
+                   SLACKR_SQLITE_PATH=os.path.join(tmp_path, "loadtest.sqlite3"))
+        server = subprocess.Popen([sys.executable, "server.py", str(PORT)], env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_server()
+            clients = []
+            for client in range(num_clients):
+                user = post("/auth/register", {'email': f"load{client}@test.com",
+                                               'password': "password", 'name_first': "load",
+                                               'name_last': f"test{client}"})
+                # Clients write to separate channels, as they would in practice.
+                channel_id = post("/channels/create", {'token': user['token'],
+                                                       'name': f"load{client}",
+                                                       'is_public': True})['channel_id']
+                clients.append((user['token'], channel_id, requests_per_client))
+
+            start = time.perf_counter()
+            with multiprocessing.Pool(num_clients) as pool:
+                pool.starmap(run_client, clients)
+            seconds = time.perf_counter() - start
+        finally:
+            server.terminate()
+            server.wait()
+
+    num_requests = num_clients * (requests_per_client // 3 * 3)
+    return {'workers': num_workers, 'requests': num_requests, 'seconds': seconds,
+            'requests_per_second': num_requests / seconds}
+
+def main(max_workers, requests_per_client=300):
+    """ Load test 1, 2, 4, ... workers up to max_workers. """
+    worker_counts = [1]
+    while worker_counts[-1] * 2 <= max_workers:
+        worker_counts.append(worker_counts[-1] * 2)
+
+    baseline = None
+    for num_workers in worker_counts:
+        # Enough clients to keep every worker busy.
+        result = load_test(num_workers, 2 * max_workers, requests_per_client)
+        baseline = baseline or result['requests_per_second']
+        result['speedup'] = result['requests_per_second'] / baseline
+        print(", ".join(f"{key}={value:.3f}" if isinstance(value, float)
+                        else f"{key}={value}" for key, value in result.items()))
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) == 2 else os.cpu_count())
@@ -1,17 +1,19 @@
 """
 The file contain all message function.
 """
-import time
 from datetime import datetime
 from error import InputError, AccessError
-from database import (set_message,
-                      get_message_location, remove_message, get_message, get_channel_data,
-                      get_current_user, get_permission_dict
+from database import (set_message, remove_message,
+                      get_permission_dict, generate_message_id,
+                      get_scheduled_message, get_scheduled_messages, set_scheduled_message,
+                      remove_scheduled_message, locks_channel, is_channel_member,
+                      is_channel_owner
                      )
 from channel import is_user_channel_member
 import hangman
 import input_checkers
 import message_parser
+import scheduler
 
 ###############################################################
 #
@@ -23,13 +25,16 @@ def check_command(channel_id, message):
     """
     A helper function to check whether the message given is a command for hangman
     Start a hangman if the message is "/hangman" or make a guess if message is "/guess X"
-    X i a single letter.
+    X i a single letter. "/hangman" can be followed by a word length and/or a
+    difficulty of easy, medium or hard.
     """
-    if message == "/hangman":
-        hangman.hangman_start(channel_id)
-        return True
-
     message_data = message.split()
+    if message_data and message_data[0] == "/hangman":
+        options = hangman.parse_hangman_options(message_data[1:])
+        if options is not None:
+            hangman.hangman_start(channel_id, *options)
+            return True
+
     if message_data[0] == "/guess":
         if len(message_data) == 2 and len(message_data[1]) == 1:
             hangman.hangman_guess(message_data[1], channel_id)
@@ -41,19 +46,13 @@ def check_command(channel_id, message):
     return False
 
 
-def user_in_message_channel(message_id, u_id):
+def user_in_message_channel(message_location, u_id):
     """
-    A helper function to check whether the user is in channel with channel_id provided
+    A helper function to check whether the user is in the channel the message is within
     Returns True if passes check - otherwise raises InputError.
     """
-    message_location = get_message_location(message_id)
     channel_id = message_location["channel_id"]
-    channel_data = get_channel_data(channel_id)
-    check = False
-
-    for user in channel_data["member_ids"]:
-        if user == u_id:
-            check = True
+    check = is_channel_member(channel_id, u_id)
     if check is False:
         raise InputError(
             description='message_id is not a valid message within' +
@@ -62,6 +61,43 @@ def user_in_message_channel(message_id, u_id):
         return check
 
 
+def schedule_message(scheduled):
+    """
+    A helper function to have the scheduler send a message from
+    message_sendlater at its time_sent.
+    """
+    scheduler.schedule(scheduled['time_sent'], send_scheduled_message, scheduled)
+
+def send_scheduled_message(scheduled):
+    """
+    A helper function run by the scheduler to send a message from
+    message_sendlater, with the message_id reserved for it.
+    """
+    # The message was dropped (e.g. by a workspace reset) since it was scheduled.
+    if get_scheduled_message(scheduled['message_id']) != scheduled:
+        return
+
+    remove_scheduled_message(scheduled['message_id'])
+    # The sender may have left the channel while the message was waiting.
+    if is_user_channel_member(scheduled['channel_id'], scheduled['u_id']) is False:
+        return
+
+    # Sent at time_sent, even if the server was down or busy then.
+    message_parser.parse_message(scheduled['u_id'], scheduled['channel_id'],
+                                 scheduled['message'], scheduled['message_id'],
+                                 scheduled['time_sent'])
+    check_command(scheduled['channel_id'], scheduled['message'])
+
+def restore_scheduled_messages():
+    """
+    Schedule every message from message_sendlater that was waiting to be
+    sent when the server last stopped.
+    Messages whose time_sent has passed are sent straight away.
+    """
+    for scheduled in list(get_scheduled_messages()):
+        schedule_message(scheduled)
+
+
 ###############################################################
 #
 #                        Message functions
@@ -72,14 +108,13 @@ def user_in_message_channel(message_id, u_id):
 # token check | channel_id check | user_in_channel check | msg_len check
 @input_checkers.validate_token
 @input_checkers.validate_c_id
-def message_send(token, channel_id, message):
+@locks_channel
+def message_send(token, channel_id, message, *, auth_u_id):
     """
     Grab information from the frontend chat bar and send it.
     """
-
-    u_id = get_current_user(token)
-
-    if is_user_channel_member(channel_id, u_id) is False:
+    # pylint: disable=unused-argument
+    if is_user_channel_member(channel_id, auth_u_id) is False:
         raise AccessError(description='The authorised user has not ' +
                           'joined the channel they are trying to post to')
 
@@ -91,7 +126,7 @@ def message_send(token, channel_id, message):
         raise InputError(description='Cannot send an empty message')
 
     # Now parse the message
-    message_id = message_parser.parse_message(u_id, channel_id, message)
+    message_id = message_parser.parse_message(auth_u_id, channel_id, message)
     check_command(channel_id, message)
 
     return {
@@ -100,83 +135,72 @@ def message_send(token, channel_id, message):
 
 @input_checkers.validate_token
 @input_checkers.validate_msg_id
-def message_remove(token, message_id):
+@locks_channel
+def message_remove(token, message_id, *, auth_u_id, message_location, message_data):
     """
     Given a message_id for a message, this message is removed from the channel.
     """
-    u_id = get_current_user(token)
-
-    message_location = get_message_location(message_id)
-
+    # pylint: disable=unused-argument
     channel_id = message_location["channel_id"]
-    channel_data = get_channel_data(channel_id)
 
-    if u_id not in channel_data['member_ids']:
+    if not is_channel_member(channel_id, auth_u_id):
         raise AccessError(description="User must be a member of the channel they are trying" +
                           " to access.")
 
     # Find the message to be deleted. At this point
     #   The message definitely exists and the user is definitely a member of the channel
     #   it exists in.
-    for message in channel_data["messages"]:
-        if message['message_id'] == message_id:
-            if message["u_id"] != u_id and get_permission_dict(u_id).get('permission_id') != 1:
-                raise AccessError(description="Authorised user did not send the message " +
-                                  "and is not a server/channel owner.")
-            else:
-                remove_message(message_id)
+    if (message_data["u_id"] != auth_u_id
+            and get_permission_dict(auth_u_id).get('permission_id') != 1):
+        raise AccessError(description="Authorised user did not send the message " +
+                          "and is not a server/channel owner.")
+    remove_message(message_id)
 
     return {}
 
 @input_checkers.validate_token
 @input_checkers.validate_msg_id
-def message_edit(token, message_id, message):
+@locks_channel
+def message_edit(token, message_id, message, *, auth_u_id, message_location, message_data):
     """
     Given a message, update it's text with new text.
     If the new message is an empty string, the message is deleted.
     """
-    u_id = get_current_user(token)
-
-    message_location = get_message_location(message_id)
-
+    # pylint: disable=unused-argument
     # if message is longer than 1000 an Inputerror should be raised.
     if len(message) > 1000:
         raise InputError(
             description='Message is more than 1000 characters or try to send an empty message')
 
     channel_id = message_location["channel_id"]
-    channel_data = get_channel_data(channel_id)
 
-    if u_id not in channel_data['member_ids']:
+    if not is_channel_member(channel_id, auth_u_id):
         raise AccessError(description="User must be a member of the channel they are trying" +
                           " to access.")
 
-    # Find the message to be deleted (assume it definitely exists)
-    msg_to_edit = next(msg for msg in channel_data['messages'] if msg['message_id'] == message_id)
-
-    if msg_to_edit['u_id'] != u_id and get_permission_dict(u_id)['permission_id'] != 1:
+    if (message_data['u_id'] != auth_u_id
+            and get_permission_dict(auth_u_id)['permission_id'] != 1):
         raise AccessError(description="Authorised user did not send the message " +
                           "and is not a server/channel owner.")
 
     if message == '':
         remove_message(message_id)
     else:
-        msg_to_edit['message'] = message
-        set_message(channel_id, msg_to_edit)
+        message_data['message'] = message
+        set_message(channel_id, message_data)
 
     return {}
 
 
 @input_checkers.validate_token
 @input_checkers.validate_c_id
-def message_sendlater(token, channel_id, message, time_sent):
+def message_sendlater(token, channel_id, message, time_sent, *, auth_u_id):
     """
     Send a message from authorised_user to the channel specified by
     channel_id automatically at a specified time in the future.
     """
-    u_id = get_current_user(token)
-
-    if is_user_channel_member(channel_id, u_id) is False:
+    # pylint: disable=unused-argument
+    if is_user_channel_member(channel_id, auth_u_id) is False:
         raise AccessError(description='The authorised user has not ' +
                           'joined the channel they are trying to post to')
 
@@ -191,23 +215,29 @@ def message_sendlater(token, channel_id, message, time_sent):
     time_now = time_now_datetime.timestamp()
     if time_now > time_sent:
         raise InputError(description='Time sent is a time in the past')
-    else:
-        # Run sendlater
-        time_diff = time_sent - time_now
 
-        time.sleep(time_diff)
-        return message_send(token, channel_id, message)
+    # Reserve the message_id now, and leave the sending to the scheduler.
+    scheduled = {'message_id': generate_message_id(),
+                 'channel_id': channel_id,
+                 'u_id': auth_u_id,
+                 'message': message,
+                 'time_sent': time_sent}
+    set_scheduled_message(scheduled)
+    schedule_message(scheduled)
+
+    return {
+        "message_id": scheduled['message_id'],
+    }
 
 @input_checkers.validate_token
 @input_checkers.validate_msg_id
-def message_react(token, message_id, react_id):
+@locks_channel
+def message_react(token, message_id, react_id, *, auth_u_id, message_location, message_data):
     """
     Given a message within a channel the authorised user is part of,
     add a "react" to that particular message.
     """
-
-    u_id = get_current_user(token)
-
+    # pylint: disable=unused-argument
     # React_id check
     if react_id != 1:
         raise InputError(
@@ -216,9 +246,9 @@ def message_react(token, message_id, react_id):
 
     # Check user is in channel they are reacting in and if they are,
     # execute.
-    if user_in_message_channel(message_id, u_id) is True:
-        message_file = get_message(message_id)
-        u_id_to_react = next((i for i in message_file['reacts'][0]['u_ids'] if u_id == i), False)
+    if user_in_message_channel(message_location, auth_u_id) is True:
+        u_id_to_react = next((i for i in message_data['reacts'][0]['u_ids']
+                              if auth_u_id == i), False)
 
         if u_id_to_react is not False:
             # This user has already reacted.
@@ -227,20 +257,20 @@ def message_react(token, message_id, react_id):
                 + 'contains an active React with ID react_id')
         else:
             # User has not already reacted.
-            message_file['reacts'][0]['u_ids'].append(u_id)
+            message_data['reacts'][0]['u_ids'].append(auth_u_id)
+            set_message(message_location['channel_id'], message_data)
 
     return {}
 
 @input_checkers.validate_token
 @input_checkers.validate_msg_id
-def message_unreact(token, message_id, react_id):
+@locks_channel
+def message_unreact(token, message_id, react_id, *, auth_u_id, message_location, message_data):
     """
     Given a message within a channel the authorised user is part of,
     remove a "react" to that particular message.
     """
-    # Token check
-    u_id = get_current_user(token)
-
+    # pylint: disable=unused-argument
     # React_id check
     if react_id != 1:
         raise InputError(
@@ -249,13 +279,14 @@ def message_unreact(token, message_id, react_id):
 
     # Check user is in channel they are reacting in and if they are,
     # execute.
-    if user_in_message_channel(message_id, u_id) is True:
-        message_file = get_message(message_id)
-        u_id_to_unreact = next((i for i in message_file['reacts'][0]['u_ids'] if u_id == i), None)
+    if user_in_message_channel(message_location, auth_u_id) is True:
+        u_id_to_unreact = next((i for i in message_data['reacts'][0]['u_ids']
+                                if auth_u_id == i), None)
 
         if u_id_to_unreact is not None:
             # If there was a react from the user.
-            message_file['reacts'][0]['u_ids'].remove(u_id)
+            message_data['reacts'][0]['u_ids'].remove(auth_u_id)
+            set_message(message_location['channel_id'], message_data)
         else:
             # If there wasn't a react from the user.
             raise InputError(
@@ -266,65 +297,55 @@ def message_unreact(token, message_id, react_id):
 
 @input_checkers.validate_token
 @input_checkers.validate_msg_id
-def message_pin(token, message_id):
+@locks_channel
+def message_pin(token, message_id, *, auth_u_id, message_location, message_data):
     """
     Given a message within a channel, mark it as "pinned"
     to be given special display treatment by the frontend.
     """
-    u_id = get_current_user(token)
-    message_location = get_message_location(message_id)
-    message_file = get_message(message_id)
-
+    # pylint: disable=unused-argument
     ################### START ERROR CHECKS ############################
 
-    channel_data = get_channel_data(message_location['channel_id'])
-
-    check = next((i for i in channel_data['member_ids'] if i == u_id), False)
-
-    if check is False:
+    if not is_channel_member(message_location['channel_id'], auth_u_id):
         raise AccessError(description='The authorised user is not ' +
                           'a member of the channel that the message is within')
 
-    if u_id not in channel_data['owner_ids']:
+    if not is_channel_owner(message_location['channel_id'], auth_u_id):
         raise AccessError(description='The authorised user is not an owner')
 
     ##################### END ERROR CHECKS ########################
 
-    if message_file['is_pinned'] is True:
+    if message_data['is_pinned'] is True:
         raise InputError(
             description='Message with ID message_id is already pinned')
     else:
-        message_file['is_pinned'] = True
+        message_data['is_pinned'] = True
+        set_message(message_location['channel_id'], message_data)
 
     return {}
 
 @input_checkers.validate_token
 @input_checkers.validate_msg_id
-def message_unpin(token, message_id):
+@locks_channel
+def message_unpin(token, message_id, *, auth_u_id, message_location, message_data):
     """
     Given a message within a channel, remove it's mark as unpinned.
     """
-    u_id = get_current_user(token)
-    message_location = get_message_location(message_id)
-    message_file = get_message(message_id)
-
+    # pylint: disable=unused-argument
     ################### START ERROR CHECKS ############################
 
-    channel_data = get_channel_data(message_location['channel_id'])
-
-    check = next((i for i in channel_data['member_ids'] if i == u_id), False)
-
-    if check is False:
+    if not is_channel_member(message_location['channel_id'], auth_u_id):
         raise AccessError(description='The authorised user is not ' +
                           'a member of the channel that the message is within')
 
-    if u_id not in channel_data['owner_ids']:
+    if not is_channel_owner(message_location['channel_id'], auth_u_id):
         raise AccessError(description='The authorised user is not an owner')
 
     ##################### END ERROR CHECKS ########################
 
-    if message_file['is_pinned'] is False:
+    if message_data['is_pinned'] is False:
         raise InputError(description='Message with ID message_id is already unpinned')
     else:
-        message_file['is_pinned'] = False
+        message_data['is_pinned'] = False
+        set_message(message_location['channel_id'], message_data)
     return {}
@@ -12,30 +12,30 @@ def set_reacts():
         'is_this_user_reacted': False
     }
 
-def create_message(u_id, message):
+def create_message(u_id, message, message_id=None, time_created=0):
     """
     A helper function which generates the message_id and returns a dictionary
     containing this new id, the u_id who called it and the message.
+    A message_id reserved earlier can be given instead, and a time_created
+    (otherwise the message is given the time it is stored).
     """
-    message_location_list = database.get_message_locations()
-    if message_location_list != []:
-        new_message_id = message_location_list[-1]['message_id'] + 1
-    else:
-        new_message_id = 0
+    if message_id is None:
+        message_id = database.generate_message_id()
     return {
-        'message_id': new_message_id,
+        'message_id': message_id,
         'u_id': u_id,
         'message': message,
-        'time_created': 0,
+        'time_created': time_created,
         'reacts': [set_reacts()],
         'is_pinned': False
     }
 
-def parse_message(u_id, channel_id, message):
+def parse_message(u_id, channel_id, message, message_id=None, time_created=0):
     """
     A function which will generate a message_id and immediately send
     that message to the database.
+    A message_id reserved earlier can be given instead, and a time_created.
     """
-    message_file = create_message(u_id, message)
+    message_file = create_message(u_id, message, message_id, time_created)
     database.set_message(channel_id, message_file)
     return message_file['message_id']
@@ -2,18 +2,22 @@
 Test file for message.py
 """
 import datetime
-import threading
+import time
 
 import pytest
 
 from message import (message_send, message_remove,
                      message_edit, message_sendlater,
-                     message_pin, message_unpin, message_react, message_unreact)
+                     message_pin, message_unpin, message_react, message_unreact,
+                     restore_scheduled_messages)
 from message_parser import set_reacts
 from error import InputError, AccessError
 from auth import auth_register
 from channels import channels_create, channel_join
+from channel import channel_messages
 from other import search
+from database import get_scheduled_messages
+import scheduler
 
 ###############################################################
 #
@@ -329,35 +333,71 @@ def test_message_edit_emty_string():
 def test_message_sendlater():
     """
     test whether message_sendlater works as expect.
+    The message_id is returned straight away, and the message is sent at time_sent.
     """
-    def helper_func(token):
-        """
-        Run search in a seperate thread, so it checks before message is sent.
-        We use threads here because the flask side of thing uses local threads
-        for routes, so we just use time.sleep inside the functions. This means
-        we need a seperate thread to check before sendlater finishes.
-        """
-        messages = search(token, 'a'*99)
-        assert messages['messages'] == []
-
     user_infor = auth_register("337992611@gamil.com", "ccc337992611", "Min", "Li")
     channel_infor = channels_create(user_infor['token'], 'test_one', True)
     time_sent_date = datetime.datetime.now().replace(
-        microsecond=0) + datetime.timedelta(0, 4)
+        microsecond=0) + datetime.timedelta(0, 2)
     time_sent = time_sent_date.timestamp()
 
-    # Run test check empty a second after message_sendlater has been
-    # called (but hasn't finished executing)
-    new_thread = threading.Timer(1, helper_func, args=(user_infor['token']))
-    new_thread.start()
-
     message_id = message_sendlater(user_infor['token'],
                                    channel_infor['channel_id'], 'a'*99, time_sent)
+    assert search(user_infor['token'], 'a'*99)['messages'] == []
+
+    # A message sent in the meantime gets a different id.
+    other_id = message_send(user_infor['token'], channel_infor['channel_id'], 'b')
+    assert other_id['message_id'] != message_id['message_id']
 
+    time.sleep(time_sent - time.time() + 0.5)
     messages = search(user_infor['token'], 'a'*99)
     assert messages['messages'][0]['message_id'] == message_id['message_id']
     assert messages['messages'][0]['time_created'] == time_sent
+    assert get_scheduled_messages() == []
+
+def test_message_sendlater_restored():
+    """
+    test whether a message waiting to be sent is sent once it is restored,
+    e.g. after the server restarts, and is sent straight away if its time has passed.
+    """
+    user_infor = auth_register("337992611@gamil.com", "ccc337992611", "Min", "Li")
+    channel_infor = channels_create(user_infor['token'], 'test_one', True)
+    time_sent = datetime.datetime.now().replace(microsecond=0).timestamp() + 60
+    message_id = message_sendlater(user_infor['token'],
+                                   channel_infor['channel_id'], 'a'*99, time_sent)
 
+    # Stand in for the server stopping before the message is sent.
+    scheduler.clear_jobs()
+    get_scheduled_messages()[0]['time_sent'] = time.time()
+    restore_scheduled_messages()
+
+    time.sleep(0.5)
+    messages = search(user_infor['token'], 'a'*99)
+    assert messages['messages'][0]['message_id'] == message_id['message_id']
+
+def test_message_sendlater_sent_late():
+    """
+    test whether a message sent after its time_sent, e.g. after the server
+    was down, is shown as sent at time_sent, before the messages sent since.
+    """
+    user_infor = auth_register("337992611@gamil.com", "ccc337992611", "Min", "Li")
+    channel_infor = channels_create(user_infor['token'], 'test_one', True)
+    time_sent = datetime.datetime.now().replace(microsecond=0).timestamp() + 60
+    message_id = message_sendlater(user_infor['token'],
+                                   channel_infor['channel_id'], 'late', time_sent)
+
+    # Stand in for the server being down from time_sent until after 'sooner' was sent.
+    scheduler.clear_jobs()
+    time_sent -= 120
+    get_scheduled_messages()[0]['time_sent'] = time_sent
+    sooner_id = message_send(user_infor['token'], channel_infor['channel_id'], 'sooner')
+    restore_scheduled_messages()
+
+    time.sleep(0.5)
+    messages = channel_messages(user_infor['token'], channel_infor['channel_id'], 0)
+    assert [message['message_id'] for message in messages['messages']] == [
+        sooner_id['message_id'], message_id['message_id']]
+    assert messages['messages'][1]['time_created'] == time_sent
 
 def test_message_sendlater_0_string():
     """
@@ -1,10 +1,9 @@
 """
 Implementation for other.py
 """
-from operator import itemgetter
+from itertools import islice
 import error
 import database
-import channels
 import input_checkers
 
 @input_checkers.validate_token
@@ -20,20 +19,43 @@ def users_all(token):
 
     return {"users": users_list}
 
+def encode_cursor(entry):
+    """ Turn the (time_created, message_id) of the last result into a cursor. """
+    return f"{entry[0]}:{entry[1]}"
+
+def decode_cursor(cursor):
+    """ Turn a cursor back into the (time_created, message_id) it was made from. """
+    try:
+        time_created, message_id = cursor.split(":")
+        return (float(time_created), int(message_id))
+    except (AttributeError, ValueError):
+        raise error.InputError(description="search received an invalid cursor")
+
 @input_checkers.validate_token
-def search(token, query_str):
+def search(token, query_str, limit=None, cursor=None, *, auth_u_id):
     """
     returns all messages that user is in with certain quesry string
+
+    If limit is given, only the newest limit messages after cursor are
+    returned, along with the cursor to pass in for the next page
+    (None once there are no more messages).
     """
+    # pylint: disable=unused-argument
     if query_str == "":
         raise error.InputError(description="search received an empty query string")
-    # user_channels = {'channels': [], []}
-    user_channels = channels.channels_list(token)
-    message_list = []
-    for channel in user_channels['channels']:
-        channel_data = database.get_channel_data(channel['channel_id'])
-        for message in channel_data['messages']:
-            if query_str in message['message']:
-                message_list.append(message)
-    message_list.sort(key=itemgetter('time_created'), reverse=True)
-    return {"messages" : message_list}
+    if limit is not None and limit < 1:
+        raise error.InputError(description="search received a limit less than 1")
+    before = decode_cursor(cursor) if cursor is not None else None
+    # the database indexes the channels each user is a member of
+    channel_ids = [channel['channel_id'] for channel in database.get_user_channels(auth_u_id)]
+    # The index gives back matches newest first, so no sort is needed, and
+    # a page stops reading as soon as it is full.
+    results = database.search_messages(channel_ids, query_str, before)
+    if limit is None:
+        return {"messages" : [database.get_message(message_id) for _, message_id in results]}
+
+    # Take one extra result to find out whether there is another page.
+    page = list(islice(results, limit + 1))
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return {"messages" : [database.get_message(message_id) for _, message_id in page[:limit]],
+            "cursor": next_cursor}
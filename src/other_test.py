@@ -109,3 +109,35 @@ def test_search_valid_v():
     auth.auth_logout(login_infor['token'])
     with pytest.raises(error.AccessError):
         other.search(login_infor['token'], 'a'*99)
+
+def test_search_paginated():
+    """
+    test search with a limit returns the newest messages a page at a time,
+    with a cursor for the next page.
+    """
+    user_infor = auth.auth_register("email@email.com", "password", "Min", "Li")
+    channel_one = channels.channels_create(user_infor['token'], 'test_one', True)
+    channel_two = channels.channels_create(user_infor['token'], 'test_two', True)
+    message_ids = []
+    for number in range(5):
+        channel_id = [channel_one, channel_two][number % 2]['channel_id']
+        message_ids.append(message.message_send(user_infor['token'], channel_id,
+                                                f"page {number}")['message_id'])
+
+    first_page = other.search(user_infor['token'], 'page', 2)
+    assert [msg['message_id'] for msg in first_page['messages']] == message_ids[:2:-1]
+    second_page = other.search(user_infor['token'], 'page', 2, first_page['cursor'])
+    assert [msg['message_id'] for msg in second_page['messages']] == message_ids[2:0:-1]
+    last_page = other.search(user_infor['token'], 'page', 2, second_page['cursor'])
+    assert [msg['message_id'] for msg in last_page['messages']] == message_ids[:1]
+    assert last_page['cursor'] is None
+
+def test_search_paginated_invalid():
+    """
+    test search raises InputError for a limit below 1 or a malformed cursor.
+    """
+    login_infor = message_test.test_message_send()
+    with pytest.raises(error.InputError):
+        other.search(login_infor['token'], 'a', 0)
+    with pytest.raises(error.InputError):
+        other.search(login_infor['token'], 'a', 1, "not a cursor")
@@ -1,11 +1,11 @@
 """ Functions for passwordreset routes to call. """
 
-import hashlib
 import random
 import string
 import smtplib
 from error import InputError
 import database
+import passwords
 
 # Global list which holds reset details
 # contains dictionaries of form
@@ -74,7 +74,7 @@ def passwordreset_reset(reset_code, new_password):
         raise InputError(description="The password you entered is less than 6 characters long.")
 
     # Hash new_password
-    passcode = hashlib.sha256(new_password.encode()).hexdigest()
+    passcode = passwords.hash_password(new_password)
 
     # Get password data from the database and change the password associated with the email
     database.get_password_data(reset_details['email'])
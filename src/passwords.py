@@ -0,0 +1,183 @@
+"""
+Hashes passwords, and checks passwords against their hashes.
+
+Passwords are hashed with a salted, slow key derivation function (KDF),
+chosen by SLACKR_PASSWORD_KDF from KDF_PARAMS, so that stolen hashes are
+expensive to guess. Hashes are stored as
+    scrypt$<n>$<r>$<p>$<salt>$<key>
+    pbkdf2_sha256$<iterations>$<salt>$<key>
+with the salt and key in hex. Passwords stored by older versions are an
+unsalted SHA-256 hex digest, and are rehashed when their user next logs in,
+as are hashes made with an older KDF or cost.
+
+The KDF runs on a pool of SLACKR_HASH_WORKERS processes, so hashing can't
+hold up the server's other threads. At most SLACKR_MAX_HASH_JOBS hashes are
+running or waiting for the pool at once, and any more wait for a slot.
+Hash workers are started by a fork server, so they don't hold the server's
+sockets or files, and stop once the process that started them has.
+"""
+import atexit
+import collections
+import concurrent.futures
+import hashlib
+import hmac
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+
+PASSWORD_KDF = os.environ.get("SLACKR_PASSWORD_KDF", "scrypt")
+
+# The cost of each KDF. Raising a cost rehashes passwords on their next login.
+KDF_PARAMS = {
+    'scrypt': {'n': 2 ** 14, 'r': 8, 'p': 1},
+    'pbkdf2_sha256': {'iterations': 600000},
+}
+
+SALT_BYTES = 16
+
+# With no hash workers, passwords are hashed on the thread asking for them.
+HASH_WORKERS = int(os.environ.get("SLACKR_HASH_WORKERS", str(os.cpu_count() or 1)))
+MAX_HASH_JOBS = int(os.environ.get("SLACKR_MAX_HASH_JOBS", str(2 * max(HASH_WORKERS, 1))))
+HASH_JOBS = threading.BoundedSemaphore(MAX_HASH_JOBS)
+
+# The pool of hash workers, made on first use by each process, as a pool
+# can't be shared with the server workers forked from it.
+POOL = {'executor': None, 'pid': None}
+POOL_LOCK = threading.Lock()
+
+# How often hash workers check the process that started them is still running, in seconds.
+OWNER_CHECK_SECONDS = 1
+
+# Seconds taken by the most recent hashes, including waiting for a slot.
+HASH_LATENCIES = collections.deque(maxlen=1000)
+
+def derive_key(kdf, params, password, salt):
+    """ Return the hex key derived from password and salt by kdf with params. """
+
+    if kdf == 'scrypt':
+        # scrypt needs 128 * r * (n + p + 2) bytes, and OpenSSL a little more.
+        maxmem = 128 * params['r'] * (params['n'] + params['p'] + 2) + 2 ** 20
+        return hashlib.scrypt(password.encode(), salt=salt, n=params['n'], r=params['r'],
+                              p=params['p'], maxmem=maxmem).hex()
+    if kdf == 'pbkdf2_sha256':
+        return hashlib.pbkdf2_hmac('sha256', password.encode(), salt,
+                                   params['iterations']).hex()
+    raise ValueError(f"Unknown password KDF {kdf}, choose from {', '.join(KDF_PARAMS)}")
+
+def watch_owner(owner_pid):
+    """ Stop this hash worker once the process owner_pid has stopped. """
+
+    while True:
+        time.sleep(OWNER_CHECK_SECONDS)
+        try:
+            os.kill(owner_pid, 0)
+        except ProcessLookupError:
+            # The owner was killed without shutting down its pool.
+            os._exit(0) # pylint: disable=protected-access
+
+def start_hash_worker(owner_pid):
+    """ Run in each hash worker as it starts. """
+
+    threading.Thread(target=watch_owner, args=(owner_pid,), daemon=True).start()
+
+def get_executor():
+    """ Return this process's pool of hash workers, making it if needed. """
+
+    with POOL_LOCK:
+        if POOL['pid'] != os.getpid():
+            # Forking this process would copy its sockets, files and locks
+            # held by other threads, so workers come from a fork server that
+            # has only imported this module.
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload([__name__])
+            POOL['executor'] = concurrent.futures.ProcessPoolExecutor(
+                max_workers=HASH_WORKERS, mp_context=context,
+                initializer=start_hash_worker, initargs=(os.getpid(),))
+            POOL['pid'] = os.getpid()
+        return POOL['executor']
+
+def shutdown_pool():
+    """ Stop this process's hash workers, without waiting for hashes in progress. """
+
+    with POOL_LOCK:
+        if POOL['pid'] == os.getpid():
+            POOL['executor'].shutdown(wait=False, cancel_futures=True)
+        POOL['executor'] = POOL['pid'] = None
+
+atexit.register(shutdown_pool)
+
+def run_kdf(kdf, params, password, salt):
+    """
+    Return derive_key(kdf, params, password, salt), worked out by the hash
+    workers once a slot is free.
+    """
+
+    start = time.perf_counter()
+    with HASH_JOBS:
+        if not HASH_WORKERS:
+            key = derive_key(kdf, params, password, salt)
+        else:
+            try:
+                key = get_executor().submit(derive_key, kdf, params, password, salt).result()
+            except concurrent.futures.process.BrokenProcessPool:
+                # A worker died, so start a new pool for the next hash.
+                with POOL_LOCK:
+                    POOL['pid'] = None
+                raise
+    HASH_LATENCIES.append(time.perf_counter() - start)
+    return key
+
+def hash_password(password):
+    """ Return the hash of password to store, using PASSWORD_KDF. """
+
+    params = KDF_PARAMS[PASSWORD_KDF]
+    salt = secrets.token_bytes(SALT_BYTES)
+    key = run_kdf(PASSWORD_KDF, params, password, salt)
+    return "$".join([PASSWORD_KDF, *(str(value) for value in params.values()),
+                     salt.hex(), key])
+
+def parse_hash(password_hash):
+    """
+    Return the (kdf, params, salt, key) of a stored hash, or None if it is
+    an unsalted SHA-256 digest.
+    """
+
+    if "$" not in password_hash:
+        return None
+    kdf, *values, salt, key = password_hash.split("$")
+    params = dict(zip(KDF_PARAMS[kdf], (int(value) for value in values)))
+    return kdf, params, bytes.fromhex(salt), key
+
+def check_password(password, password_hash):
+    """ Return whether password is the one password_hash was made from. """
+
+    parsed = parse_hash(password_hash)
+    if parsed is None:
+        key = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(key, password_hash)
+
+    kdf, params, salt, expected_key = parsed
+    return hmac.compare_digest(run_kdf(kdf, params, password, salt), expected_key)
+
+def needs_rehash(password_hash):
+    """ Return whether password_hash wasn't made with PASSWORD_KDF at its current cost. """
+
+    parsed = parse_hash(password_hash)
+    return parsed is None or parsed[:2] != (PASSWORD_KDF, KDF_PARAMS[PASSWORD_KDF])
+
+def get_hash_latencies(percentiles=(50, 90, 99)):
+    """
+    Return the given percentiles of the time taken by the most recent hashes,
+    in milliseconds, as {count, p50, p90, p99}. Percentiles are None if
+    nothing has been hashed.
+    """
+
+    latencies = sorted(HASH_LATENCIES)
+    result = {'count': len(latencies)}
+    for percentile in percentiles:
+        # Nearest rank: the smallest latency at least percentile% of hashes took.
+        rank = max(-(-percentile * len(latencies) // 100), 1)
+        result[f"p{percentile}"] = latencies[rank - 1] * 1000 if latencies else None
+    return result
@@ -0,0 +1,166 @@
+"""
+Tests for hashing passwords, and rehashing old hashes on login.
+"""
+import hashlib
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import pytest
+import database
+import passwords
+import auth
+import error
+
+def test_hash_password():
+    """ Hashes are salted, and only match the password they were made from. """
+    first = passwords.hash_password("password")
+    second = passwords.hash_password("password")
+    assert first != second
+    assert first.startswith(f"{passwords.PASSWORD_KDF}$")
+    assert passwords.check_password("password", first)
+    assert passwords.check_password("password", second)
+    assert not passwords.check_password("Password", first)
+    assert not passwords.needs_rehash(first)
+
+@pytest.mark.parametrize("kdf", list(passwords.KDF_PARAMS))
+def test_each_kdf(monkeypatch, kdf):
+    """ Each KDF can hash and check passwords, and hashes of the other need rehashing. """
+    monkeypatch.setattr(passwords, "PASSWORD_KDF", kdf)
+    password_hash = passwords.hash_password("password")
+    assert password_hash.split("$")[0] == kdf
+    assert passwords.check_password("password", password_hash)
+
+    other_kdf = next(other for other in passwords.KDF_PARAMS if other != kdf)
+    monkeypatch.setattr(passwords, "PASSWORD_KDF", other_kdf)
+    assert passwords.check_password("password", password_hash)
+    assert passwords.needs_rehash(password_hash)
+
+def test_cost_raised(monkeypatch):
+    """ Hashes made at a lower cost than the current one need rehashing. """
+    password_hash = passwords.hash_password("password")
+    params = dict(passwords.KDF_PARAMS[passwords.PASSWORD_KDF])
+    params[next(iter(params))] *= 2
+    monkeypatch.setitem(passwords.KDF_PARAMS, passwords.PASSWORD_KDF, params)
+    assert passwords.needs_rehash(password_hash)
+    assert passwords.check_password("password", password_hash)
+
+def test_legacy_rehashed_on_login():
+    """ Unsalted SHA-256 passwords still log in, and are rehashed when they do. """
+    user = auth.auth_register("email@email.com", "password", "first", "user")
+    auth.auth_logout(user['token'])
+    legacy_hash = hashlib.sha256("password".encode()).hexdigest()
+    database.set_password("email@email.com", legacy_hash)
+    assert passwords.needs_rehash(legacy_hash)
+
+    with pytest.raises(error.InputError):
+        auth.auth_login("email@email.com", "wrong password")
+    assert database.get_password_data("email@email.com")['password'] == legacy_hash
+
+    assert auth.auth_login("email@email.com", "password")['u_id'] == user['u_id']
+    password_hash = database.get_password_data("email@email.com")['password']
+    assert not passwords.needs_rehash(password_hash)
+    assert passwords.check_password("password", password_hash)
+
+def test_invalid_registration_not_hashed(monkeypatch):
+    """ Registrations with invalid details are turned away before hashing. """
+    auth.auth_register("email@email.com", "password", "first", "user")
+    hashed = []
+    monkeypatch.setattr(passwords, "hash_password", hashed.append)
+
+    for details in (("email@email.com", "password", "first", "user"),
+                    ("other@email.com", "short", "first", "user"),
+                    ("other@email.com", "password", "", "user"),
+                    ("other@email.com", "password", "first", "x" * 51)):
+        with pytest.raises(error.InputError):
+            auth.auth_register(*details)
+    assert hashed == []
+
+def test_hash_jobs_bounded(monkeypatch):
+    """ No more than MAX_HASH_JOBS hashes run at once. """
+    running = []
+    most_running = []
+    lock = threading.Lock()
+    def derive_key(*args):
+        with lock:
+            running.append(args)
+            most_running.append(len(running))
+        key = hashlib.sha256(repr(args).encode()).hexdigest()
+        with lock:
+            running.pop()
+        return key
+    monkeypatch.setattr(passwords, "HASH_WORKERS", 0)
+    monkeypatch.setattr(passwords, "HASH_JOBS", threading.BoundedSemaphore(2))
+    monkeypatch.setattr(passwords, "derive_key", derive_key)
+
+    threads = [threading.Thread(target=passwords.hash_password, args=("password",))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(most_running) == 8
+    assert max(most_running) <= 2
+
+def test_hash_latencies(monkeypatch):
+    """ Latency percentiles are taken from the most recent hashes. """
+    monkeypatch.setattr(passwords, "HASH_LATENCIES", passwords.HASH_LATENCIES.__class__(
+        maxlen=passwords.HASH_LATENCIES.maxlen))
+    assert passwords.get_hash_latencies() == {'count': 0, 'p50': None, 'p90': None,
+                                              'p99': None}
+
+    passwords.HASH_LATENCIES.extend(i / 1000 for i in range(100, 0, -1))
+    assert passwords.get_hash_latencies() == pytest.approx(
+        {'count': 100, 'p50': 50, 'p90': 90, 'p99': 99})
+
+    passwords.hash_password("password")
+    assert passwords.get_hash_latencies()['count'] == 101
+
+def get_worker_pids():
+    """ Return the pids of this process's hash workers. """
+    return list(passwords.get_executor()._processes) # pylint: disable=protected-access
+
+def is_running(pid):
+    """ Return whether the process pid is running, and not waiting to be reaped. """
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            return stat.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+def test_workers_hold_no_sockets():
+    """ Hash workers don't keep the server's listening socket open. """
+    passwords.shutdown_pool()
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        listener_inode = os.fstat(listener.fileno()).st_ino
+        passwords.hash_password("password")
+
+        for pid in get_worker_pids():
+            fds = os.listdir(f"/proc/{pid}/fd")
+            links = [os.readlink(f"/proc/{pid}/fd/{fd}") for fd in fds]
+            assert f"socket:[{listener_inode}]" not in links
+    passwords.shutdown_pool()
+
+def test_workers_stop_with_owner():
+    """ Hash workers stop once the process that started them is killed. """
+    owner = subprocess.Popen(
+        [sys.executable, "-c", "import passwords, sys, time\n"
+         "passwords.hash_password('password')\n"
+         "print(*passwords.get_executor()._processes, flush=True)\n"
+         "time.sleep(60)"],
+        stdout=subprocess.PIPE, text=True)
+    worker_pids = [int(pid) for pid in owner.stdout.readline().split()]
+    assert worker_pids
+    os.kill(owner.pid, signal.SIGKILL)
+    owner.wait()
+    owner.stdout.close()
+
+    deadline = time.time() + passwords.OWNER_CHECK_SECONDS + 5
+    while any(is_running(pid) for pid in worker_pids) and time.time() < deadline:
+        time.sleep(0.1)
+    assert not any(is_running(pid) for pid in worker_pids)
@@ -0,0 +1,79 @@
+"""
+Runs functions at a given time from a single dispatcher thread.
+
+Jobs are kept in a heap ordered by the time they should run, so the
+dispatcher only ever waits on the earliest one. Cancelled jobs are left
+in the heap and skipped when they reach the top.
+
+Jobs run one at a time on the dispatcher thread, so they should be quick.
+"""
+import heapq
+import itertools
+import threading
+import time
+import traceback
+
+# Heap of [run_at, sequence, function, args] lists.
+# sequence keeps jobs due at the same time in the order they were scheduled.
+JOBS = []
+SEQUENCE = itertools.count()
+
+# Guards JOBS, and wakes the dispatcher when an earlier job is scheduled.
+JOBS_CONDITION = threading.Condition()
+
+DISPATCHER = {'thread': None}
+
+def schedule(run_at, function, *args):
+    """
+    Run function(*args) at the time.time() timestamp run_at, or as soon as
+    possible if run_at has passed.
+    Returns the job, which can be passed to cancel.
+    """
+
+    job = [run_at, next(SEQUENCE), function, args]
+    with JOBS_CONDITION:
+        heapq.heappush(JOBS, job)
+        if DISPATCHER['thread'] is None:
+            DISPATCHER['thread'] = threading.Thread(target=dispatch_jobs, daemon=True)
+            DISPATCHER['thread'].start()
+        # Only the dispatcher's deadline can have changed.
+        if JOBS[0] is job:
+            JOBS_CONDITION.notify()
+
+    return job
+
+def cancel(job):
+    """ Stop a job from running. Does nothing if it has run already. """
+
+    with JOBS_CONDITION:
+        job[2] = None
+
+def clear_jobs():
+    """ Cancel every job. """
+
+    with JOBS_CONDITION:
+        for job in JOBS:
+            job[2] = None
+        JOBS.clear()
+
+def get_num_jobs():
+    """ Return the number of jobs waiting to run, including cancelled ones. """
+
+    return len(JOBS)
+
+def dispatch_jobs():
+    """ Run each job when it is due. Runs forever on the dispatcher thread. """
+
+    while True:
+        with JOBS_CONDITION:
+            while not JOBS or JOBS[0][0] > time.time():
+                JOBS_CONDITION.wait(JOBS[0][0] - time.time() if JOBS else None)
+            _, _, function, args = heapq.heappop(JOBS)
+
+        if function is None:
+            continue
+        try:
+            function(*args)
+        except Exception: # pylint: disable=broad-except
+            # One failing job mustn't stop the jobs after it.
+            traceback.print_exc()
@@ -0,0 +1,198 @@
+"""
+In-memory inverted index used to answer message searches.
+
+Every message is indexed under each trigram (three character substring)
+of its text. Postings are kept per channel as lists of
+(time_created, message_id) in ascending order, so that the hits for a
+channel can be read newest first without sorting them.
+
+The index only holds posting lists, not message text. Searches check each
+candidate against the stored message, read through the get_text function
+they are given. A channel is only indexed the first time it is searched,
+by index_channel, so starting the server doesn't read every history.
+database.py keeps indexed channels up to date whenever a message is
+stored, edited or removed.
+"""
+from bisect import bisect_left, insort
+from heapq import merge
+import threading
+
+TRIGRAM_LENGTH = 3
+
+# {trigram: {channel_id: [(time_created, message_id), ...]}}
+TRIGRAM_POSTINGS = {}
+# {channel_id: [(time_created, message_id), ...]}, for queries too short
+# to have a trigram.
+CHANNEL_POSTINGS = {}
+# {channel_id, ...} of the channels whose messages are in the index.
+INDEXED_CHANNELS = set()
+
+# Held while the index is updated. Messages in different channels share
+# posting dictionaries, and an empty one can be deleted under another
+# channel's update. Searches don't take it, and tolerate lists changing
+# underneath them.
+INDEX_LOCK = threading.Lock()
+
+###############################################################
+#
+#                        Postings
+#
+###############################################################
+
+def get_trigrams(text):
+    """ Return the set of trigrams found in text. """
+    return {text[i:i + TRIGRAM_LENGTH] for i in range(len(text) - TRIGRAM_LENGTH + 1)}
+
+def add_posting(postings, entry):
+    """ Insert entry into a sorted posting list. """
+
+    # Messages are nearly always indexed in the order they were sent.
+    if not postings or postings[-1] <= entry:
+        postings.append(entry)
+    else:
+        insort(postings, entry)
+
+def remove_posting(postings, entry):
+    """ Remove entry from a sorted posting list. """
+
+    position = bisect_left(postings, entry)
+    if position < len(postings) and postings[position] == entry:
+        del postings[position]
+
+def add_trigrams(channel_id, entry, trigrams):
+    """ Add entry to the postings of each of the trigrams in channel_id. """
+
+    for trigram in trigrams:
+        channel_postings = TRIGRAM_POSTINGS.setdefault(trigram, {})
+        add_posting(channel_postings.setdefault(channel_id, []), entry)
+
+def remove_trigrams(channel_id, entry, trigrams):
+    """ Remove entry from the postings of each of the trigrams in channel_id. """
+
+    for trigram in trigrams:
+        channel_postings = TRIGRAM_POSTINGS[trigram]
+        remove_posting(channel_postings[channel_id], entry)
+        if not channel_postings[channel_id]:
+            del channel_postings[channel_id]
+            if not channel_postings:
+                del TRIGRAM_POSTINGS[trigram]
+
+###############################################################
+#
+#                        Index Updates
+#
+###############################################################
+
+def index_channel(channel_id, messages):
+    """
+    Add every message of a channel to the index, unless it is indexed
+    already. The channel's history mustn't change until this returns.
+    """
+
+    with INDEX_LOCK:
+        if channel_id in INDEXED_CHANNELS:
+            return
+        for message in messages:
+            add_message(channel_id, message)
+        INDEXED_CHANNELS.add(channel_id)
+
+def add_message(channel_id, message):
+    """ Add the postings of a message. INDEX_LOCK must be held. """
+
+    entry = (message['time_created'], message['message_id'])
+    add_posting(CHANNEL_POSTINGS.setdefault(channel_id, []), entry)
+    add_trigrams(channel_id, entry, get_trigrams(message['message']))
+
+def index_message(channel_id, message):
+    """
+    Add a new message to the index. Does nothing if its channel isn't
+    indexed, as index_channel will find it.
+    """
+
+    with INDEX_LOCK:
+        if channel_id in INDEXED_CHANNELS:
+            add_message(channel_id, message)
+
+def reindex_message(channel_id, message, old_text):
+    """ Update the index for a message whose text was old_text, and has been edited. """
+
+    with INDEX_LOCK:
+        if channel_id not in INDEXED_CHANNELS or old_text == message['message']:
+            return
+        entry = (message['time_created'], message['message_id'])
+        old_trigrams = get_trigrams(old_text)
+        new_trigrams = get_trigrams(message['message'])
+        remove_trigrams(channel_id, entry, old_trigrams - new_trigrams)
+        add_trigrams(channel_id, entry, new_trigrams - old_trigrams)
+
+def unindex_message(channel_id, message):
+    """ Remove a message from the index. Does nothing if its channel isn't indexed. """
+
+    with INDEX_LOCK:
+        if channel_id not in INDEXED_CHANNELS:
+            return
+        entry = (message['time_created'], message['message_id'])
+        remove_posting(CHANNEL_POSTINGS[channel_id], entry)
+        remove_trigrams(channel_id, entry, get_trigrams(message['message']))
+
+def clear_index():
+    """ Remove every channel from the index. """
+
+    with INDEX_LOCK:
+        TRIGRAM_POSTINGS.clear()
+        CHANNEL_POSTINGS.clear()
+        INDEXED_CHANNELS.clear()
+
+###############################################################
+#
+#                        Queries
+#
+###############################################################
+
+def search_channel(channel_id, query_str, get_text, before=None):
+    """
+    Yield the (time_created, message_id) of messages in channel_id
+    containing query_str, newest first. If before is given, only messages
+    older than that (time_created, message_id) are yielded.
+    get_text(message_id) returns the text of a message, or None once it
+    has been removed.
+    """
+
+    trigrams = get_trigrams(query_str)
+    if trigrams:
+        postings = [TRIGRAM_POSTINGS.get(trigram, {}).get(channel_id) for trigram in trigrams]
+        # A trigram with no postings here means the intersection is empty.
+        if not all(postings):
+            return
+        # Walk the rarest trigram. The substring check on each candidate
+        # covers the other trigrams, and rules out matches that only share
+        # the trigrams.
+        candidates = min(postings, key=len)
+    else:
+        candidates = CHANNEL_POSTINGS.get(channel_id, [])
+
+    # Walk by position rather than with reversed(), so that messages sent
+    # or removed while the stream is open don't break it.
+    position = len(candidates) if before is None else bisect_left(candidates, before)
+    for position in range(position - 1, -1, -1):
+        if position >= len(candidates):
+            continue
+        entry = candidates[position]
+        text = get_text(entry[1])
+        if text is not None and query_str in text:
+            yield entry
+
+def search(channel_ids, query_str, get_text, before=None):
+    """
+    Yield the (time_created, message_id) of messages in any of channel_ids
+    containing query_str, newest first. If before is given, only messages
+    older than that (time_created, message_id) are yielded. Matches are
+    checked against the text given by get_text, as in search_channel.
+
+    Each channel is read lazily, so taking the first k results only reads
+    as far back as the k-th newest match.
+    """
+
+    streams = [search_channel(channel_id, query_str, get_text, before)
+               for channel_id in channel_ids]
+    return merge(*streams, reverse=True)
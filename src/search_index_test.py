@@ -0,0 +1,82 @@
+"""
+Tests for the search index
+"""
+import search_index
+
+# {message_id: text} of the messages stored by the test, read by searches.
+TEXTS = {}
+
+def make_message(message_id, text, time_created=0):
+    """ Return a message with the fields the index uses, storing its text. """
+    TEXTS[message_id] = text
+    return {'message_id': message_id, 'message': text, 'time_created': time_created}
+
+def clear_messages(*channel_ids):
+    """ Empty the index and the stored messages, then index channel_ids. """
+    search_index.clear_index()
+    TEXTS.clear()
+    for channel_id in channel_ids:
+        search_index.index_channel(channel_id, [])
+
+def search_ids(channel_ids, query_str, before=None):
+    """ Return the ids of the messages found by a search. """
+    return [message_id for _, message_id
+            in search_index.search(channel_ids, query_str, TEXTS.get, before)]
+
+def test_get_trigrams():
+    """ Trigrams are every three character substring. """
+    assert search_index.get_trigrams("hello") == {"hel", "ell", "llo"}
+    assert search_index.get_trigrams("hi") == set()
+
+def test_search_newest_first():
+    """ Matches from every channel come out newest first. """
+    clear_messages(1, 2)
+    search_index.index_message(1, make_message(0, "hello world", 10))
+    search_index.index_message(2, make_message(1, "say hello", 20))
+    search_index.index_message(1, make_message(2, "goodbye", 30))
+    search_index.index_message(2, make_message(3, "hello again", 30))
+
+    assert search_ids([1, 2], "hello") == [3, 1, 0]
+    assert search_ids([1], "hello") == [0]
+    assert search_ids([1, 2], "o") == [3, 2, 1, 0]
+    assert search_ids([1, 2], "missing") == []
+
+    # Only messages older than before are found.
+    assert search_ids([1, 2], "hello", (30, 3)) == [1, 0]
+    assert search_ids([1, 2], "o", (20, 1)) == [0]
+
+def test_search_checks_substring():
+    """ Messages sharing every trigram of the query but not the query don't match. """
+    clear_messages(1)
+    search_index.index_message(1, make_message(0, "abcd bcde"))
+    search_index.index_message(1, make_message(1, "abcde"))
+
+    assert search_ids([1], "abcde") == [1]
+
+def test_edit_and_remove():
+    """ Edited messages are found by their new text, removed ones aren't found. """
+    clear_messages(1)
+    search_index.index_message(1, make_message(0, "first message"))
+    second = make_message(1, "second message")
+    search_index.index_message(1, second)
+
+    search_index.reindex_message(1, make_message(0, "edited"), "first message")
+    assert search_ids([1], "first") == []
+    assert search_ids([1], "edited") == [0]
+
+    search_index.unindex_message(1, second)
+    del TEXTS[1]
+    assert search_ids([1], "message") == []
+    assert "sec" not in search_index.TRIGRAM_POSTINGS
+
+def test_index_channel():
+    """ Channels are only indexed when asked, after which new messages are added. """
+    clear_messages()
+    search_index.index_message(1, make_message(0, "before indexing"))
+    assert not search_index.TRIGRAM_POSTINGS
+
+    search_index.index_channel(1, [make_message(0, "before indexing")])
+    search_index.index_channel(1, [make_message(0, "before indexing")])
+    search_index.index_message(1, make_message(1, "after indexing", 1))
+    assert search_ids([1], "indexing") == [1, 0]
+    assert search_index.CHANNEL_POSTINGS[1] == [(0, 0), (1, 1)]
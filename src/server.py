@@ -1,11 +1,15 @@
 """
 The file contain the route function
 """
+import os
+import signal
+import socket
 import sys
 
 from json import dumps
 from flask import Flask, request, send_from_directory
 from flask_cors import CORS
+from werkzeug.serving import make_server
 from error import InputError
 
 import user
@@ -18,6 +22,9 @@ import other
 import admin
 import database
 import passwordreset
+import passwords
+import sqlite_storage
+import tokens
 
 URL = "http://127.0.0.1:8080"
 
@@ -46,9 +53,43 @@ CORS(APP)
 APP.config['TRAP_HTTP_EXCEPTIONS'] = True
 APP.register_error_handler(Exception, default_handler)
 
-database.retrieve_data_from_files()
+# With SLACKR_WORKERS set, that many worker processes serve requests,
+# sharing the database through an SQLite file. Standups and hangman games
+# are only known to the worker that started them.
+WORKERS = int(os.environ.get("SLACKR_WORKERS", "0"))
 
-database.start_db_backup_scheduler()
+# SLACKR_STORAGE picks the storage engine, from database.STORAGE_ENGINES.
+# The database is held in memory unless there are workers to share it.
+STORAGE_ENGINE = os.environ.get("SLACKR_STORAGE", "sqlite" if WORKERS else "memory")
+SQLITE_PATH = os.environ.get("SLACKR_SQLITE_PATH",
+                             os.path.join(database.DATABASE_PATH, "slackr.sqlite3"))
+
+def start_server():
+    """
+    Check the settings, then load the database. Only done when run as a
+    script, as hash workers import this file as their main module.
+    """
+
+    if WORKERS and STORAGE_ENGINE == "memory":
+        sys.exit("SLACKR_WORKERS can't be used with SLACKR_STORAGE=memory,"
+                 " as workers can't share memory.")
+    if tokens.check_settings() is not None:
+        sys.exit(tokens.check_settings())
+
+    if passwords.PASSWORD_KDF not in passwords.KDF_PARAMS:
+        sys.exit(f"Unknown SLACKR_PASSWORD_KDF {passwords.PASSWORD_KDF}, choose from "
+                 f"{', '.join(passwords.KDF_PARAMS)}")
+
+    if STORAGE_ENGINE == "memory":
+        database.retrieve_data_from_files()
+
+        database.start_db_backup_scheduler()
+    elif STORAGE_ENGINE == "sqlite":
+        sqlite_storage.open_database(SQLITE_PATH)
+    database.select_storage_engine(STORAGE_ENGINE)
+
+    if not WORKERS:
+        message.restore_scheduled_messages()
 
 
 @APP.route("/echo", methods=['GET'])
@@ -121,7 +162,10 @@ def channel_details():
     user_channel_id = {"token": request.args.get('token'),
                        "channel_id": int(request.args.get('channel_id'))}
                         # have to convert channel_id into an int as request.args.get gives a string
-    details = channel.channel_details(user_channel_id["token"], user_channel_id["channel_id"])
+    limit = request.args.get('limit')
+    details = channel.channel_details(user_channel_id["token"], user_channel_id["channel_id"],
+                                      int(request.args.get('start', 0)),
+                                      int(limit) if limit is not None else None)
 
     return dumps(details)
 
@@ -272,7 +316,10 @@ def search():
     input_data = {'token': request.args.get(
         'token'), 'query_str': request.args.get('query_str')}
 
-    message_list = other.search(input_data['token'], input_data['query_str'])
+    limit = request.args.get('limit')
+    message_list = other.search(input_data['token'], input_data['query_str'],
+                                int(limit) if limit is not None else None,
+                                request.args.get('cursor'))
 
     return dumps(message_list)
 
@@ -331,6 +378,18 @@ def standup_active():
     return dumps(standup_info)
 
 
+@APP.route("/standup/queue", methods=['GET'])
+def standup_queue():
+    """
+    Function standup queue  route
+    """
+    details = {"token": request.args.get('token'),
+               "channel_id": int(request.args.get('channel_id'))}
+    queue_info = standup.standup_queue(
+        details['token'], details['channel_id'])
+    return dumps(queue_info)
+
+
 @APP.route("/standup/send", methods=['POST'])
 def standup_send():
     """
@@ -482,9 +541,61 @@ def workspace_reset():
     Reset the database
     """
     database.clear_database()
+    standup.clean_standup_database()
     return dumps({})
 
 
 
+def run_worker(listener, worker):
+    """ Serve requests accepted on listener, from a worker process. """
+
+    # Only one worker sends the messages left waiting by the last server.
+    if worker == 0:
+        message.restore_scheduled_messages()
+
+    host, port = listener.getsockname()
+    make_server(host, port, APP, threaded=True, fd=listener.fileno()).serve_forever()
+
+def run_workers(port, num_workers):
+    """
+    Listen on port, then fork num_workers processes which each accept
+    requests from it. Returns once every worker has stopped.
+    """
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", port))
+    listener.listen(128)
+
+    # Stop the workers when the server is stopped, rather than leaving them running.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    pids = []
+    for worker in range(num_workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(listener, worker)
+            finally:
+                os._exit(0) # pylint: disable=protected-access
+        pids.append(pid)
+
+    try:
+        for pid in pids:
+            os.waitpid(pid, 0)
+    finally:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
 if __name__ == "__main__":
-    APP.run(port=(int(sys.argv[1]) if len(sys.argv) == 2 else 8080))
+    PORT = int(sys.argv[1]) if len(sys.argv) == 2 else 8080
+    start_server()
+    # Exit cleanly when stopped, so the hash workers are shut down.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if WORKERS:
+        run_workers(PORT, WORKERS)
+    else:
+        APP.run(port=PORT)
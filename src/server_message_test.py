@@ -3,7 +3,7 @@ Testing file for message route
 """
 import json
 import urllib.request
-import threading
+import time
 from datetime import datetime, timedelta
 
 
@@ -53,23 +53,16 @@ def test_send_messsage():
 
 def test_message_sendlater():
     """ Http testing for message/sendlater. """
-    def helper_func(token):
-        """ Check that there are no messages in channel """
+    def get_messages(token):
+        """ Return the messages in the channel. """
         url = (f"{get_url()}/channel/messages?token={token}"
                f"&channel_id={channel['channel_id']}&start=0")
         response = urllib.request.urlopen(url)
-        payload = json.load(response)
-
-        assert payload['messages'] == []
+        return json.load(response)['messages']
 
     user = server_create_user("email@email.com", "password", "Prince", "Ali")
     channel = server_create_channel(user['token'], "test_channel", True)
 
-    # Run test check empty a second after message_sendlater has been
-    # called (but hasn't finished executing)
-    new_thread = threading.Timer(1.5, helper_func, args=(user['token']))
-    new_thread.start()
-
     # Send a message later
     time_sent = datetime.now() + timedelta(seconds=2)
     time_sent = int(time_sent.timestamp())
@@ -82,16 +75,18 @@ def test_message_sendlater():
                                  headers={'Content-Type': 'application/json'},
                                  method='POST')
     response = urllib.request.urlopen(req)
-    json.load(response)
+    message_id = json.load(response)['message_id']
+
+    # The route returns before the message is sent.
+    assert get_messages(user['token']) == []
 
-    url = (f"{get_url()}/channel/messages?token={user['token']}"
-           f"&channel_id={channel['channel_id']}&start=0")
-    response = urllib.request.urlopen(url)
-    payload = json.load(response)
+    time.sleep(time_sent - time.time() + 0.5)
+    payload = get_messages(user['token'])
 
-    assert len(payload['messages']) == 1
-    assert payload['messages'][0]['message'] == "omegalul"
-    assert payload['messages'][0]['time_created'] == time_sent
+    assert len(payload) == 1
+    assert payload[0]['message_id'] == message_id
+    assert payload[0]['message'] == "omegalul"
+    assert payload[0]['time_created'] == time_sent
 
 
 def test_message_pin():
@@ -1,6 +1,7 @@
 """ System testing for other routes """
 
 import json
+import urllib.parse
 import urllib.request
 from datetime import datetime
 
@@ -113,3 +114,26 @@ def test_search():
                                                 'is_this_user_reacted': False}],
                                     'is_pinned': False
                                    }]
+
+def test_search_paginated():
+    """ Http testing for search with a limit and cursor. """
+    user = server_create_user("email@email.com", "password", "Donald", "Trump")
+    c_id_dict = server_create_channel(user['token'], "test_channel", True)
+    for text in ("first", "second"):
+        data = json.dumps({'token': user['token'],
+                           'channel_id': c_id_dict['channel_id'],
+                           'message': text}).encode('utf-8')
+        urllib.request.urlopen(urllib.request.Request(f"{get_url()}/message/send",
+                                                      data=data,
+                                                      headers={"Content-Type": "application/json"},
+                                                      method="POST"))
+
+    payload = json.load(urllib.request.urlopen(
+        f"{get_url()}/search?token={user['token']}&query_str=s&limit=1"))
+    assert [msg['message'] for msg in payload['messages']] == ["second"]
+
+    payload = json.load(urllib.request.urlopen(
+        f"{get_url()}/search?token={user['token']}&query_str=s&limit=1"
+        f"&cursor={urllib.parse.quote(payload['cursor'])}"))
+    assert [msg['message'] for msg in payload['messages']] == ["first"]
+    assert payload['cursor'] is None
@@ -54,6 +54,14 @@ def test_standup():
     send_standup_message(user1['token'], channel['channel_id'], "hello")
     send_standup_message(user2['token'], channel['channel_id'], "there")
 
+    # call standup_queue
+    url = f"{get_url()}/standup/queue?token={user1['token']}&channel_id={channel['channel_id']}"
+    response = urllib.request.urlopen(url)
+    payload = json.load(response)
+
+    # "lichking: hello\ngoldtooth: there"
+    assert payload == {'queue_depth': 2, 'queue_bytes': 32}
+
     # wait out the rest of the standup and check messages
     time.sleep(3)
     url = (f"{get_url()}/channel/messages?token={user1['token']}" +
@@ -0,0 +1,715 @@
+"""
+Stores the database in an SQLite file, so that several server processes
+can share it.
+
+Provides the same get_* and set_* functions as database.py, which hands
+its calls on to this module once it is passed to use_storage_engine.
+Rows are returned as new dictionaries, so a change to one is only stored
+once it is passed back to a set_* function.
+
+The file is opened in WAL mode, so that readers in one process don't wait
+on a writer in another. Each thread uses its own connection, taken from a
+pool so that short lived request threads don't each open a new one.
+
+Only the statements making a change hold SQLite's write lock. The channel
+and table locks held across a route's read-modify-write are locks on a
+byte of a file next to the database, one byte per channel or table, so
+routes on different channels don't wait on each other, and reads don't
+wait at all.
+"""
+from contextlib import contextmanager
+from datetime import datetime
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import error
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    u_id INTEGER PRIMARY KEY,
+    email TEXT NOT NULL,
+    name_first TEXT NOT NULL,
+    name_last TEXT NOT NULL,
+    handle_str TEXT NOT NULL,
+    profile_img_url TEXT
+);
+CREATE TABLE IF NOT EXISTS permissions (
+    u_id INTEGER PRIMARY KEY,
+    permission_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    token TEXT PRIMARY KEY,
+    u_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS channels (
+    channel_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    is_public INTEGER NOT NULL
+);
+-- role is 'owner' or 'member'. Rows are read back in the order they were added.
+CREATE TABLE IF NOT EXISTS channel_members (
+    channel_id INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    u_id INTEGER NOT NULL
+);
+-- position is the order messages were stored in, which can differ from the
+-- order of message_ids as an id can be reserved for a message sent later.
+CREATE TABLE IF NOT EXISTS messages (
+    position INTEGER PRIMARY KEY,
+    message_id INTEGER NOT NULL UNIQUE,
+    channel_id INTEGER NOT NULL,
+    u_id INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    time_created REAL NOT NULL,
+    reacts TEXT NOT NULL,
+    is_pinned INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS passwords (
+    email TEXT PRIMARY KEY,
+    password TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scheduled_messages (
+    message_id INTEGER PRIMARY KEY,
+    channel_id INTEGER NOT NULL,
+    u_id INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    time_sent REAL NOT NULL
+);
+-- num_users and next_message_id.
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+# Changes made to SCHEMA since it was first used, applied in order to files
+# made before them. The file's user_version is the number applied so far.
+MIGRATIONS = [
+    """
+    -- Every index also ends with the rowid, so rows sharing the indexed
+    -- columns are read back in the order they were added.
+    CREATE INDEX messages_by_channel ON messages (channel_id, time_created);
+    CREATE INDEX channel_members_by_channel ON channel_members (channel_id);
+    CREATE INDEX sessions_by_user ON sessions (u_id);
+
+    -- Kept up to date by set_message and remove_message, so that counting
+    -- a channel's messages doesn't read them all.
+    ALTER TABLE channels ADD COLUMN num_messages INTEGER NOT NULL DEFAULT 0;
+    UPDATE channels SET num_messages = (SELECT COUNT(*) FROM messages
+                                        WHERE messages.channel_id = channels.channel_id);
+    """,
+    """
+    -- Lets is_channel_member and is_channel_owner find one row without
+    -- reading the rest of the channel's members.
+    CREATE INDEX channel_members_by_member ON channel_members (channel_id, role, u_id);
+    """,
+    """
+    -- Lets get_user_channels find a user's channels without reading every
+    -- channel's members.
+    CREATE INDEX channel_members_by_user ON channel_members (u_id, role, channel_id);
+    """,
+    """
+    -- Channel ids are counted, rather than taken from the number of channels.
+    INSERT INTO counters SELECT 'num_channels', COALESCE(MAX(channel_id), 0) FROM channels;
+    """,
+    """
+    -- Registering and changing an email or handle look users up by them.
+    CREATE INDEX users_by_email ON users (email);
+    CREATE INDEX users_by_handle ON users (handle_str);
+    """,
+    """
+    -- Signed tokens revoked by logging out, kept until they expire.
+    CREATE TABLE revoked_tokens (
+        token_id TEXT PRIMARY KEY,
+        expires_at REAL NOT NULL
+    );
+    CREATE INDEX revoked_tokens_by_expiry ON revoked_tokens (expires_at);
+    """,
+]
+
+TABLES = ("users", "permissions", "sessions", "revoked_tokens", "channels", "channel_members",
+          "messages", "passwords", "scheduled_messages", "counters")
+
+# Number of matches read by each query made by search_messages.
+SEARCH_PAGE_SIZE = 100
+
+# {path}
+DATABASE = {'path': None}
+
+# Holds each thread's ThreadConnection.
+LOCAL = threading.local()
+
+# {(pid, path): [connection, ...]} of connections no thread is using.
+IDLE_CONNECTIONS = {}
+MAX_IDLE_CONNECTIONS = 32
+
+# The tables database.table_lock can lock, in the order of the bytes that
+# lock them. Channel channel_id is locked by byte TABLE_LOCK_BYTES + channel_id.
+LOCKED_TABLES = ("users", "permissions", "sessions", "revoked_tokens", "channels",
+                 "user_channels", "message_locations", "passwords", "num_users",
+                 "scheduled_messages", "message_ids", "histories")
+TABLE_LOCK_BYTES = 64
+
+# {(pid, path): descriptor} of the lock file each process locks bytes of.
+LOCK_FILES = {}
+# {(pid, path, offset): FileLock}
+FILE_LOCKS = {}
+FILE_LOCKS_LOCK = threading.Lock()
+
+###############################################################
+#
+#                        Connections
+#
+###############################################################
+
+def open_database(path):
+    """ Store the database in the SQLite file at path, creating its tables if needed. """
+
+    DATABASE['path'] = path
+    connection = get_connection()
+    connection.executescript(SCHEMA)
+
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        connection.executescript(f"BEGIN IMMEDIATE; {migration}; "
+                                 f"PRAGMA user_version = {number}; COMMIT;")
+
+def get_pool_key():
+    """
+    Return the key of the connections this process can use.
+    A connection copied into a forked worker process can't be used there,
+    and one opened before open_database was called again is to the old file.
+    """
+    return (os.getpid(), DATABASE['path'])
+
+def take_connection():
+    """ Return an idle connection, opening a new one if there are none. """
+
+    try:
+        return IDLE_CONNECTIONS.get(get_pool_key(), []).pop()
+    except IndexError:
+        pass
+
+    # Connections move between threads, though only one uses each at a time.
+    # Transactions are only started by write_lock.
+    connection = sqlite3.connect(DATABASE['path'], timeout=30, isolation_level=None,
+                                 check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+def give_back_connection(pool_key, connection):
+    """ Keep a connection that a thread has finished with, to be reused. """
+
+    idle = IDLE_CONNECTIONS.setdefault(pool_key, [])
+    if pool_key == get_pool_key() and len(idle) < MAX_IDLE_CONNECTIONS:
+        idle.append(connection)
+    elif pool_key[0] == os.getpid():
+        connection.close()
+
+class ThreadConnection:
+    """
+    A thread's connection, and how many write_lock blocks the thread is
+    inside. Its thread-local storage is freed when the thread ends, which
+    gives the connection back to be reused.
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        self.pool_key = get_pool_key()
+        self.connection = take_connection()
+        self.depth = 0
+
+    def __del__(self):
+        give_back_connection(self.pool_key, self.connection)
+
+def get_thread_connection():
+    """ Return this thread's ThreadConnection, taking a connection the first time. """
+
+    thread_connection = getattr(LOCAL, 'thread_connection', None)
+    if thread_connection is None or thread_connection.pool_key != get_pool_key():
+        thread_connection = LOCAL.thread_connection = ThreadConnection()
+    return thread_connection
+
+def get_connection():
+    """ Return this thread's connection. """
+    return get_thread_connection().connection
+
+def execute(sql, parameters=()):
+    """ Run a statement on this thread's connection, returning the cursor. """
+    return get_connection().execute(sql, parameters)
+
+@contextmanager
+def write_lock():
+    """
+    Hold SQLite's write lock, so that no other thread or process can change
+    the database until the block ends. Blocks can be nested.
+    As with the in-memory database, changes made before an exception are kept.
+    """
+
+    thread_connection = get_thread_connection()
+    if thread_connection.depth == 0:
+        thread_connection.connection.execute("BEGIN IMMEDIATE")
+    thread_connection.depth += 1
+    try:
+        yield
+    finally:
+        thread_connection.depth -= 1
+        if thread_connection.depth == 0:
+            thread_connection.connection.execute("COMMIT")
+
+class FileLock:
+    """
+    A re-entrant lock held by one thread of one process at a time, made from
+    a thread lock for the threads of this process and a lock on a byte of
+    the lock file for other processes.
+    """
+
+    def __init__(self, lock_fd, offset):
+        self.lock_fd = lock_fd
+        self.offset = offset
+        self.thread_lock = threading.RLock()
+        # Only changed by the thread holding thread_lock.
+        self.depth = 0
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        if self.depth == 0:
+            try:
+                fcntl.lockf(self.lock_fd, fcntl.LOCK_EX, 1, self.offset)
+            except BaseException:
+                self.thread_lock.release()
+                raise
+        self.depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self.depth -= 1
+        if self.depth == 0:
+            fcntl.lockf(self.lock_fd, fcntl.LOCK_UN, 1, self.offset)
+        self.thread_lock.release()
+
+def get_file_lock(offset):
+    """ Return this process's FileLock on byte offset of the database's lock file. """
+
+    pool_key = get_pool_key()
+    lock = FILE_LOCKS.get((*pool_key, offset))
+    if lock is not None:
+        return lock
+    with FILE_LOCKS_LOCK:
+        lock = FILE_LOCKS.get((*pool_key, offset))
+        if lock is None:
+            # Locks on a file are dropped when any of the process's descriptors
+            # of it is closed, so each process keeps one open.
+            if pool_key not in LOCK_FILES:
+                LOCK_FILES[pool_key] = os.open(f"{DATABASE['path']}-locks",
+                                               os.O_RDWR | os.O_CREAT, 0o644)
+            lock = FILE_LOCKS[(*pool_key, offset)] = FileLock(LOCK_FILES[pool_key], offset)
+        return lock
+
+def table_lock(table):
+    """ Return a lock guarding a table, across every process using the database. """
+    return get_file_lock(LOCKED_TABLES.index(table))
+
+def channel_lock(channel_id):
+    """
+    Return a lock guarding a channel's channel_data and messages, across
+    every process using the database.
+    """
+    return get_file_lock(TABLE_LOCK_BYTES + channel_id)
+
+###############################################################
+#
+#                        User Data
+#
+###############################################################
+
+def user_from_row(row):
+    """ Return the user dictionary stored in a users row. """
+    u_id, email, name_first, name_last, handle_str, profile_img_url = row
+    return {'u_id': u_id, 'email': email, 'name_first': name_first,
+            'name_last': name_last, 'handle_str': handle_str,
+            'profile_img_url': profile_img_url}
+
+def get_users():
+    """ Returns a list of every registered user. """
+    return [user_from_row(row) for row in execute("SELECT * FROM users ORDER BY u_id")]
+
+def get_user_data(u_id):
+    """
+    Returns the dictionary matching the ID provided.
+    If no match, then will return None.
+    """
+    row = execute("SELECT * FROM users WHERE u_id = ?", (u_id,)).fetchone()
+    return None if row is None else user_from_row(row)
+
+def get_user_by_email(email):
+    """ Returns the user with the email, or None if no user has it. """
+    row = execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
+    return None if row is None else user_from_row(row)
+
+def get_user_by_handle(handle_str):
+    """ Returns the user with the handle_str, or None if no user has it. """
+    row = execute("SELECT * FROM users WHERE handle_str = ?", (handle_str,)).fetchone()
+    return None if row is None else user_from_row(row)
+
+def next_handle_suffix(handle_str):
+    """
+    Returns the next number to try adding to handle_str when it is taken.
+    Numbers start at 0, and are only handed out once per handle_str.
+    """
+    return increment_counter(f"handle_suffix:{handle_str}")
+
+def set_user_data(user):
+    """ Adds/Updates the information stored for a user. """
+    execute("INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?, ?)",
+            (user['u_id'], user['email'], user['name_first'], user['name_last'],
+             user['handle_str'], user.get('profile_img_url')))
+
+def get_users_by_ids(u_ids):
+    """
+    Returns a {u_id, name_first, name_last, profile_img_url} dictionary for
+    each ID in u_ids, in the same order.
+    """
+    u_ids = list(u_ids)
+    profiles = {}
+    # Older SQLite builds allow at most 999 parameters in a statement.
+    for start in range(0, len(u_ids), 500):
+        batch = u_ids[start:start + 500]
+        for u_id, name_first, name_last, profile_img_url in execute(
+                "SELECT u_id, name_first, name_last, profile_img_url FROM users"
+                f" WHERE u_id IN ({', '.join('?' * len(batch))})", batch):
+            profiles[u_id] = {'u_id': u_id, 'name_first': name_first, 'name_last': name_last,
+                              'profile_img_url': profile_img_url}
+    return [profiles[u_id] for u_id in u_ids]
+
+def set_current_user(u_id, token):
+    """ Adds a current user to the sessions. """
+    execute("INSERT OR REPLACE INTO sessions VALUES (?, ?)", (token, u_id))
+
+def get_current_user(token):
+    """ Given a token, returns the u_id of the user, or None if the token isn't valid. """
+    row = execute("SELECT u_id FROM sessions WHERE token = ?", (token,)).fetchone()
+    return None if row is None else row[0]
+
+def get_token_from_user(u_id):
+    """ Given a u_id, returns the token of the user, or None if they aren't logged in. """
+    row = execute("SELECT token FROM sessions WHERE u_id = ? ORDER BY rowid LIMIT 1",
+                  (u_id,)).fetchone()
+    return None if row is None else row[0]
+
+def remove_current_user(token):
+    """
+    Given a token, removes the session it belongs to.
+    Returns True is user could be logged out, False otherwise.
+    """
+    return execute("DELETE FROM sessions WHERE token = ?", (token,)).rowcount > 0
+
+def revoke_token(token_id, expires_at):
+    """
+    Revoke the signed token with the token_id, which expires at the
+    time.time() timestamp expires_at. Tokens that have expired are
+    forgotten, as they are no longer valid anyway.
+    """
+    with write_lock():
+        execute("DELETE FROM revoked_tokens WHERE expires_at < ?", (time.time(),))
+        execute("INSERT OR REPLACE INTO revoked_tokens VALUES (?, ?)", (token_id, expires_at))
+
+def is_any_token_revoked(token_ids):
+    """ Return whether any of the signed token ids in token_ids has been revoked. """
+    token_ids = list(token_ids)
+    return execute("SELECT 1 FROM revoked_tokens WHERE token_id IN"
+                   f" ({', '.join('?' * len(token_ids))}) LIMIT 1",
+                   token_ids).fetchone() is not None
+
+###############################################################
+#
+#                        Permission Data
+#
+###############################################################
+
+def get_permissions_list():
+    """ Return the list of all registered users and their respective permissions. """
+    return [{'u_id': u_id, 'permission_id': permission_id}
+            for u_id, permission_id in execute("SELECT * FROM permissions ORDER BY u_id")]
+
+def get_permission_dict(u_id):
+    """ Return the permission dictionary for a user, or None if the user doesn't exist. """
+    row = execute("SELECT permission_id FROM permissions WHERE u_id = ?", (u_id,)).fetchone()
+    return None if row is None else {'u_id': u_id, 'permission_id': row[0]}
+
+def set_permissions(u_id, permission_id):
+    """ Create or update the permission_id of a user. """
+    execute("INSERT OR REPLACE INTO permissions VALUES (?, ?)", (u_id, permission_id))
+
+###############################################################
+#
+#                        Channel Data
+#
+###############################################################
+
+def get_channels():
+    """ Returns every channel as a {channel_id, name} dictionary. """
+    return [{'channel_id': channel_id, 'name': name} for channel_id, name
+            in execute("SELECT channel_id, name FROM channels ORDER BY channel_id")]
+
+def get_channel(channel_id):
+    """ Returns the channel dictionary with the matching ID. """
+    row = execute("SELECT name FROM channels WHERE channel_id = ?", (channel_id,)).fetchone()
+    return None if row is None else {'channel_id': channel_id, 'name': row[0]}
+
+def get_channel_data(channel_id):
+    """
+    Returns the channel_data dictionary with the matching ID, without its
+    messages, which are read with get_channel_messages.
+    """
+    row = execute("SELECT is_public FROM channels WHERE channel_id = ?", (channel_id,)).fetchone()
+    if row is None:
+        return None
+
+    channel_data = {'channel_id': channel_id, 'owner_ids': [], 'member_ids': [],
+                    'is_public': bool(row[0])}
+    for role, u_id in execute("SELECT role, u_id FROM channel_members WHERE channel_id = ?"
+                              " ORDER BY rowid", (channel_id,)):
+        channel_data[f"{role}_ids"].append(u_id)
+    return channel_data
+
+def set_channel(channel):
+    """
+    Update the name of a channel if it already exists, otherwise create it
+    with no members.
+    """
+    with write_lock():
+        if execute("UPDATE channels SET name = ? WHERE channel_id = ?",
+                   (channel['name'], channel['channel_id'])).rowcount == 0:
+            execute("INSERT INTO channels (channel_id, name, is_public) VALUES (?, ?, 1)",
+                    (channel['channel_id'], channel['name']))
+
+def set_channel_data(channel_data):
+    """
+    If channel_id doesn't exist, raise InputError, otherwise update the
+    members, owners and is_public of the channel.
+    """
+    with write_lock():
+        if execute("UPDATE channels SET is_public = ? WHERE channel_id = ?",
+                   (channel_data['is_public'], channel_data['channel_id'])).rowcount == 0:
+            raise error.InputError(description="No entry in list 'CHANNELS' with ID supplied"
+                                               " - create an entry in CHANNELS before creating"
+                                               " one in CHANNEL_DATA_LIST.")
+
+        execute("DELETE FROM channel_members WHERE channel_id = ?", (channel_data['channel_id'],))
+        get_connection().executemany(
+            "INSERT INTO channel_members VALUES (?, ?, ?)",
+            [(channel_data['channel_id'], 'owner', u_id) for u_id in channel_data['owner_ids']] +
+            [(channel_data['channel_id'], 'member', u_id) for u_id in channel_data['member_ids']])
+
+def get_user_channels(u_id):
+    """
+    Returns the channel dictionaries of the channels u_id is a member of,
+    in the order they were created.
+    """
+    return [{'channel_id': channel_id, 'name': name} for channel_id, name in execute(
+        "SELECT channels.channel_id, name FROM channel_members"
+        " JOIN channels ON channels.channel_id = channel_members.channel_id"
+        " WHERE u_id = ? AND role = 'member' ORDER BY channel_members.channel_id", (u_id,))]
+
+def is_channel_role(channel_id, role, u_id):
+    """ Return whether u_id has role ('owner' or 'member') in the channel. """
+    return execute("SELECT 1 FROM channel_members WHERE channel_id = ? AND role = ? AND u_id = ?"
+                   " LIMIT 1", (channel_id, role, u_id)).fetchone() is not None
+
+def is_channel_member(channel_id, u_id):
+    """ Return whether u_id is a member of the channel. """
+    return is_channel_role(channel_id, 'member', u_id)
+
+def is_channel_owner(channel_id, u_id):
+    """ Return whether u_id is an owner of the channel. """
+    return is_channel_role(channel_id, 'owner', u_id)
+
+###############################################################
+#
+#                     MESSAGE Data
+#
+###############################################################
+
+MESSAGE_COLUMNS = "message_id, u_id, message, time_created, reacts, is_pinned"
+
+def message_from_row(row):
+    """ Return the message dictionary stored in a messages row. """
+    message_id, u_id, message, time_created, reacts, is_pinned = row
+    return {'message_id': message_id, 'u_id': u_id, 'message': message,
+            'time_created': time_created, 'reacts': json.loads(reacts),
+            'is_pinned': bool(is_pinned)}
+
+def get_message_locations():
+    """ Return a list of every {message_id, channel_id}. """
+    return [{'message_id': message_id, 'channel_id': channel_id} for message_id, channel_id
+            in execute("SELECT message_id, channel_id FROM messages ORDER BY position")]
+
+def get_message_location(message_id):
+    """ Given a message_id, return the {message_id, channel_id} it is stored under. """
+    row = execute("SELECT channel_id FROM messages WHERE message_id = ?",
+                  (message_id,)).fetchone()
+    return None if row is None else {'message_id': message_id, 'channel_id': row[0]}
+
+def get_message(message_id):
+    """ Return a message, or None if no message is found with a matching message_id. """
+    row = execute(f"SELECT {MESSAGE_COLUMNS} FROM messages WHERE message_id = ?",
+                  (message_id,)).fetchone()
+    return None if row is None else message_from_row(row)
+
+def get_num_messages(channel_id):
+    """ Return the number of messages stored in a channel. """
+    return execute("SELECT num_messages FROM channels WHERE channel_id = ?",
+                   (channel_id,)).fetchone()[0]
+
+def get_channel_messages(channel_id, start, count):
+    """
+    Return up to count messages from a channel, newest first, skipping
+    the start most recent messages.
+    """
+    return [message_from_row(row) for row in execute(
+        f"SELECT {MESSAGE_COLUMNS} FROM messages WHERE channel_id = ?"
+        " ORDER BY time_created DESC, position DESC LIMIT ? OFFSET ?",
+        (channel_id, count, start))]
+
+def set_message(channel_id, message):
+    """
+    Add/update a message stored in a channel.
+    New messages without a time_created are given the current time.
+    """
+    with write_lock():
+        if execute("UPDATE messages SET message = ?, reacts = ?, is_pinned = ?"
+                   " WHERE message_id = ?",
+                   (message['message'], json.dumps(message['reacts']), message['is_pinned'],
+                    message['message_id'])).rowcount == 0:
+            if not message.get('time_created'):
+                message['time_created'] = datetime.now().replace(microsecond=0).timestamp()
+            execute(f"INSERT INTO messages ({MESSAGE_COLUMNS}, channel_id)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (message['message_id'], message['u_id'], message['message'],
+                     message['time_created'], json.dumps(message['reacts']),
+                     message['is_pinned'], channel_id))
+            execute("UPDATE channels SET num_messages = num_messages + 1 WHERE channel_id = ?",
+                    (channel_id,))
+
+def remove_message(message_id):
+    """ Delete a message from the channel it is stored in. """
+    with write_lock():
+        channel_id = get_message_location(message_id)['channel_id']
+        execute("DELETE FROM messages WHERE message_id = ?", (message_id,))
+        execute("UPDATE channels SET num_messages = num_messages - 1 WHERE channel_id = ?",
+                (channel_id,))
+
+def search_messages(channel_ids, query_str, before=None):
+    """
+    Yield the (time_created, message_id) of messages in any of channel_ids
+    containing query_str, newest first. If before is given, only messages
+    older than that (time_created, message_id) are yielded.
+    Matches are read a page at a time, so taking the first few is cheap.
+    """
+    channel_list = ", ".join("?" * len(channel_ids))
+    while True:
+        condition = "" if before is None else "AND (time_created, message_id) < (?, ?)"
+        # instr is case sensitive, like the in-memory search.
+        matches = execute(
+            f"SELECT time_created, message_id FROM messages"
+            f" WHERE channel_id IN ({channel_list}) AND instr(message, ?) > 0 {condition}"
+            f" ORDER BY time_created DESC, message_id DESC LIMIT ?",
+            (*channel_ids, query_str, *(before or ()), SEARCH_PAGE_SIZE)).fetchall()
+        yield from matches
+        if len(matches) < SEARCH_PAGE_SIZE:
+            return
+        before = matches[-1]
+
+###############################################################
+#
+#                        Password Data
+#
+###############################################################
+
+def get_password_data(user_email):
+    """ Return the {email, password} of a user, or None if no user has that email. """
+    row = execute("SELECT password FROM passwords WHERE email = ?", (user_email,)).fetchone()
+    return None if row is None else {'email': user_email, 'password': row[0]}
+
+def set_password(user_email, password):
+    """ Create or update the password of a user. """
+    execute("INSERT OR REPLACE INTO passwords VALUES (?, ?)", (user_email, password))
+
+###############################################################
+#
+#                     Scheduled Messages
+#
+###############################################################
+
+SCHEDULED_COLUMNS = ("message_id", "channel_id", "u_id", "message", "time_sent")
+
+def get_scheduled_messages():
+    """ Return every message waiting to be sent by message_sendlater. """
+    return [dict(zip(SCHEDULED_COLUMNS, row))
+            for row in execute("SELECT * FROM scheduled_messages ORDER BY message_id")]
+
+def get_scheduled_message(message_id):
+    """ Return the scheduled message with message_id, or None if there isn't one. """
+    row = execute("SELECT * FROM scheduled_messages WHERE message_id = ?",
+                  (message_id,)).fetchone()
+    return None if row is None else dict(zip(SCHEDULED_COLUMNS, row))
+
+def set_scheduled_message(scheduled):
+    """ Add/update a message waiting to be sent. """
+    execute("INSERT OR REPLACE INTO scheduled_messages VALUES (?, ?, ?, ?, ?)",
+            tuple(scheduled[column] for column in SCHEDULED_COLUMNS))
+
+def remove_scheduled_message(message_id):
+    """ Remove a message that has been sent from the scheduled messages. """
+    execute("DELETE FROM scheduled_messages WHERE message_id = ?", (message_id,))
+
+###############################################################
+#
+#                        Counters
+#
+###############################################################
+
+def increment_counter(name, count=1):
+    """ Add count to a counter, returning its value before the change. """
+    with write_lock():
+        row = execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+        value = 0 if row is None else row[0]
+        execute("INSERT OR REPLACE INTO counters VALUES (?, ?)", (name, value + count))
+    return value
+
+def generate_u_id():
+    """ Count one more user and return the new number of users. """
+    return increment_counter("num_users") + 1
+
+def reserve_ids(name, count):
+    """
+    Reserve the next count ids of the counter name, returning the first of
+    them and the reset count they were reserved at. Each process reserves
+    its own blocks, so no two are handed the same id.
+    """
+    with write_lock():
+        return increment_counter(name, count), get_reset_count()
+
+def get_reset_count():
+    """ Return how many times the database has been cleared. """
+    row = execute("SELECT value FROM counters WHERE name = 'resets'").fetchone()
+    return 0 if row is None else row[0]
+
+def clear_tables():
+    """
+    Empties every table. Revoked tokens are kept until they expire, and
+    signed tokens from before now hold an older reset count, so aren't valid.
+    """
+    with write_lock():
+        for table in TABLES:
+            if table == "counters":
+                execute("DELETE FROM counters WHERE name != 'resets'")
+            elif table != "revoked_tokens":
+                execute(f"DELETE FROM {table}")
+        increment_counter("resets")
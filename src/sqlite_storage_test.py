@@ -0,0 +1,261 @@
+"""
+Tests for storing the database in SQLite, which lets several processes
+share it.
+"""
+import multiprocessing
+import sqlite3
+import threading
+import types
+import pytest
+import database
+import sqlite_storage
+import auth
+import channels
+import channel
+import message
+import other
+import error
+
+@pytest.fixture(autouse=True)
+def sqlite_database(tmp_path):
+    """ Store the database in a new SQLite file for the length of the test. """
+    sqlite_storage.open_database(str(tmp_path / "slackr.sqlite3"))
+    database.use_storage_engine(sqlite_storage)
+    yield str(tmp_path / "slackr.sqlite3")
+    database.use_storage_engine(None)
+
+def test_sqlite_users():
+    """ Users, sessions and permissions are stored in SQLite. """
+    user_1 = auth.auth_register("email1@email.com", "password1", "first", "user")
+    user_2 = auth.auth_register("email2@email.com", "password2", "second", "user")
+
+    assert [user['u_id'] for user in database.get_users()] == [user_1['u_id'], user_2['u_id']]
+    assert database.get_permission_dict(user_1['u_id'])['permission_id'] == 1
+    assert database.get_permission_dict(user_2['u_id'])['permission_id'] == 2
+    assert database.get_current_user(user_2['token']) == user_2['u_id']
+
+    assert auth.auth_logout(user_2['token']) == {'is_success': True}
+    assert database.get_current_user(user_2['token']) is None
+    assert auth.auth_login("email2@email.com", "password2")['u_id'] == user_2['u_id']
+    assert database.get_user_by_email("email2@email.com")['u_id'] == user_2['u_id']
+    assert database.get_user_by_handle("firstuser")['u_id'] == user_1['u_id']
+    user_3 = auth.auth_register("email3@email.com", "password3", "first", "user")
+    assert database.get_user_data(user_3['u_id'])['handle_str'] == "firstuser0"
+    with pytest.raises(error.InputError):
+        auth.auth_register("email1@email.com", "password1", "first", "user")
+
+def test_sqlite_channels():
+    """ Channels and their members are stored in SQLite. """
+    owner = auth.auth_register("email1@email.com", "password1", "first", "user")
+    member = auth.auth_register("email2@email.com", "password2", "second", "user")
+    c_id = channels.channels_create(owner['token'], "channel", False)['channel_id']
+    channel.channel_invite(owner['token'], c_id, member['u_id'])
+    channel.channel_addowner(owner['token'], c_id, member['u_id'])
+
+    assert database.get_channel_data(c_id) == {
+        'channel_id': c_id, 'owner_ids': [owner['u_id'], member['u_id']],
+        'member_ids': [owner['u_id'], member['u_id']], 'is_public': False}
+
+    assert database.is_channel_owner(c_id, member['u_id'])
+
+    channel.channel_leave(member['token'], c_id)
+    assert database.get_channel_data(c_id)['member_ids'] == [owner['u_id']]
+    assert not database.is_channel_member(c_id, member['u_id'])
+    assert database.is_channel_member(c_id, owner['u_id'])
+    assert database.get_user_channels(owner['u_id']) == [{'channel_id': c_id, 'name': "channel"}]
+    assert database.get_user_channels(member['u_id']) == []
+
+    profiles = database.get_users_by_ids([member['u_id'], owner['u_id']])
+    assert [profile['name_first'] for profile in profiles] == ["second", "first"]
+
+def test_sqlite_messages():
+    """ Messages are stored, changed and read back from SQLite. """
+    user = auth.auth_register("email1@email.com", "password1", "first", "user")
+    c_id = channels.channels_create(user['token'], "channel", True)['channel_id']
+    message_ids = [message.message_send(user['token'], c_id, f"message {i}")['message_id']
+                   for i in range(60)]
+
+    message.message_edit(user['token'], message_ids[0], "edited")
+    message.message_react(user['token'], message_ids[1], 1)
+    message.message_pin(user['token'], message_ids[2])
+    message.message_remove(user['token'], message_ids[3])
+
+    assert database.get_num_messages(c_id) == 59
+    page = channel.channel_messages(user['token'], c_id, 0)
+    assert page['end'] == 50
+    assert page['messages'][0]['message'] == "message 59"
+
+    oldest = channel.channel_messages(user['token'], c_id, 50)['messages']
+    assert [msg['message'] for msg in oldest[-3:]] == ["message 2", "message 1", "edited"]
+    assert oldest[-2]['reacts'][0]['u_ids'] == [user['u_id']]
+    assert oldest[-3]['is_pinned'] is True
+    assert database.get_message_location(message_ids[3]) is None
+
+def test_sqlite_search():
+    """ Searches read their matches from SQLite, newest first. """
+    user = auth.auth_register("email1@email.com", "password1", "first", "user")
+    c_id = channels.channels_create(user['token'], "channel", True)['channel_id']
+    for i in range(250):
+        message.message_send(user['token'], c_id, "needle" if i % 2 else "hay")
+
+    results = other.search(user['token'], "needle")['messages']
+    assert len(results) == 125
+    assert results[0]['message_id'] > results[-1]['message_id']
+
+    first_page = other.search(user['token'], "needle", limit=100)
+    second_page = other.search(user['token'], "needle", limit=100, cursor=first_page['cursor'])
+    assert first_page['messages'] + second_page['messages'] == results
+    assert second_page['cursor'] is None
+
+def send_messages(path, token, channel_id):
+    """ Send 25 messages from a new process sharing the database at path. """
+    sqlite_storage.open_database(path)
+    for i in range(25):
+        message.message_send(token, channel_id, f"message {i}")
+
+def test_sqlite_shared_between_processes(sqlite_database):
+    """ Processes sharing the database see each other's changes. """
+    user = auth.auth_register("email1@email.com", "password1", "first", "user")
+    c_id = channels.channels_create(user['token'], "channel", True)['channel_id']
+
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=send_messages, args=(sqlite_database, user['token'], c_id))
+                 for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    messages = channel.channel_messages(user['token'], c_id, 0)['messages']
+    messages += channel.channel_messages(user['token'], c_id, 50)['messages']
+    assert len({msg['message_id'] for msg in messages}) == 100
+    # Each process reserved its own block of ids.
+    assert database.get_num_messages(c_id) == 100
+
+def test_sqlite_channel_locks(sqlite_database):
+    """
+    A channel's lock keeps other processes out of that channel only, and
+    doesn't hold SQLite's write lock.
+    """
+    user = auth.auth_register("email1@email.com", "password1", "first", "user")
+    locked_id = channels.channels_create(user['token'], "locked", True)['channel_id']
+    other_id = channels.channels_create(user['token'], "other", True)['channel_id']
+
+    context = multiprocessing.get_context("fork")
+    with database.channel_lock(locked_id):
+        assert not sqlite_storage.get_connection().in_transaction
+        locked = context.Process(target=send_messages,
+                                 args=(sqlite_database, user['token'], locked_id))
+        other = context.Process(target=send_messages,
+                                args=(sqlite_database, user['token'], other_id))
+        locked.start()
+        other.start()
+        other.join(timeout=30)
+        assert other.exitcode == 0
+        assert database.get_num_messages(other_id) == 25
+        assert database.get_num_messages(locked_id) == 0
+        assert channel.channel_details(user['token'], locked_id)['name'] == "locked"
+    locked.join(timeout=30)
+    assert locked.exitcode == 0
+    assert database.get_num_messages(locked_id) == 25
+
+def test_sqlite_clear():
+    """ Clearing the database empties every table. """
+    user = auth.auth_register("email1@email.com", "password1", "first", "user")
+    c_id = channels.channels_create(user['token'], "channel", True)['channel_id']
+    message.message_send(user['token'], c_id, "hello")
+
+    database.clear_database()
+    assert database.get_users() == []
+    assert database.get_channels() == []
+    assert database.get_message_locations() == []
+    assert database.generate_u_id() == 1
+
+def test_sqlite_reset_by_other_process():
+    """ Blocks of ids reserved before another process resets the database aren't used. """
+    user = auth.auth_register("email1@email.com", "password1", "first", "user")
+    c_id = channels.channels_create(user['token'], "channel", True)['channel_id']
+    message.message_send(user['token'], c_id, "hello")
+
+    # Cleared without dropping this process's blocks, as another process would.
+    sqlite_storage.clear_tables()
+    user = auth.auth_register("email1@email.com", "password1", "first", "user")
+    assert channels.channels_create(user['token'], "channel", True)['channel_id'] == 1
+    assert message.message_send(user['token'], 1, "hello")['message_id'] == 0
+    assert database.generate_message_id() == 1
+
+def get_query_plans(function, *args):
+    """ Return the query plan details of every statement run by function(*args). """
+    statements = []
+    connection = sqlite_storage.get_connection()
+    connection.set_trace_callback(statements.append)
+    try:
+        function(*args)
+    finally:
+        connection.set_trace_callback(None)
+
+    return [detail for statement in statements
+            for *_, detail in connection.execute(f"EXPLAIN QUERY PLAN {statement}")]
+
+def test_sqlite_indexes():
+    """ Reading a channel or a user's session only reads the rows needed. """
+    user = auth.auth_register("email1@email.com", "password1", "first", "user")
+    c_id = channels.channels_create(user['token'], "channel", True)['channel_id']
+    for i in range(3):
+        message.message_send(user['token'], c_id, f"message {i}")
+
+    for function, args in ((database.get_channel_messages, (c_id, 0, 50)),
+                           (database.get_num_messages, (c_id,)),
+                           (database.get_channel_data, (c_id,)),
+                           (database.is_channel_member, (c_id, user['u_id'])),
+                           (database.get_user_channels, (user['u_id'],)),
+                           (database.get_user_by_email, ("email1@email.com",)),
+                           (database.get_user_by_handle, ("firstuser",)),
+                           (database.get_token_from_user, (user['u_id'],))):
+        plans = get_query_plans(function, *args)
+        assert plans
+        for plan in plans:
+            assert plan.startswith("SEARCH"), plan
+            assert "TEMP B-TREE" not in plan, plan
+
+def test_sqlite_connection_reused():
+    """ A connection is reused by the next thread once its thread has ended. """
+    connections = []
+    for _ in range(2):
+        thread = threading.Thread(
+            target=lambda: connections.append(sqlite_storage.get_connection()))
+        thread.start()
+        thread.join()
+
+    assert connections[0] is connections[1]
+
+def test_select_storage_engine():
+    """ Storage engines are chosen by name, and must provide every stored function. """
+    database.select_storage_engine("memory")
+    assert database.STORAGE['engine'] is None
+    database.select_storage_engine("sqlite")
+    assert database.STORAGE['engine'] is sqlite_storage
+
+    with pytest.raises(ValueError):
+        database.select_storage_engine("unknown")
+    with pytest.raises(ValueError):
+        database.use_storage_engine(types.ModuleType("incomplete"))
+    assert database.STORAGE['engine'] is sqlite_storage
+
+def test_sqlite_migration(tmp_path):
+    """ Files made before the latest schema are brought up to date when opened. """
+    path = str(tmp_path / "old.sqlite3")
+    connection = sqlite3.connect(path)
+    connection.executescript(sqlite_storage.SCHEMA)
+    connection.execute("INSERT INTO channels VALUES (1, 'channel', 1)")
+    connection.execute("INSERT INTO messages VALUES (1, 0, 1, 1, 'hello', 0, '[]', 0)")
+    connection.commit()
+    connection.close()
+
+    sqlite_storage.open_database(path)
+    assert database.get_num_messages(1) == 1
+    database.use_storage_engine(sqlite_storage)
+    assert database.generate_channel_id() == 2
+    assert database.get_channel_messages(1, 0, 50)[0]['message'] == "hello"
+    assert (sqlite_storage.execute("PRAGMA user_version").fetchone()[0]
+            == len(sqlite_storage.MIGRATIONS))
@@ -1,24 +1,31 @@
 """ File contains functions for standup """
 
 from datetime import datetime, timedelta
-from threading import Timer
 import error
 import database
 from message import message_send
 import input_checkers
+import scheduler
 
 # This dictionary will hold the queues where standup message are held
-# format like {channel_id1: [], channel_id2: []}
+# format like {channel_id1: {lines, num_bytes}, channel_id2: {lines, num_bytes}}
+# where num_bytes is the size of the summary the lines will be joined into
 # doing this so we can hold standups in multiple channels simultaneously
 QUEUES = {}
-# This list will hold the current channels where standups are active
-# will hold dictionaries of the format:
-# {channel_id, time_finish}
-STANDUPS = []
+
+# The summary of a standup is sent as one message, which can be no longer
+# than 1000 characters, so no more than this many bytes are queued.
+STANDUP_BYTE_BUDGET = 1000
+# This dictionary will hold the current channels where standups are active
+# format like {channel_id1: {channel_id, time_finish, job}, ...}
+# where job is the scheduler job that ends the standup
+STANDUPS = {}
 
 def clean_standup_database():
     """ Helper function used in testing to clear QUEUES and STANDUPS """
 
+    for standup in STANDUPS.values():
+        scheduler.cancel(standup['job'])
     STANDUPS.clear()
     QUEUES.clear()
 
@@ -27,23 +34,22 @@ def standup_start_helper(channel_id, token):
     Scheduled to run by standup_start.
     Creates standup message in correct format and then send it. """
 
-    message_queue = QUEUES[str(channel_id)]
-    string = ""
-    for message in message_queue:
-        string += message + '\n'
-    string = string.rstrip('\n')
+    # remove the standup from QUEUES and STANDUPS first, so that it ends
+    # even if the message can't be sent. The channel's lock is held so that
+    # standup_send and standup_queue see both or neither.
+    with database.channel_lock(channel_id):
+        STANDUPS.pop(channel_id, None)
+        message_queue = QUEUES.pop(str(channel_id), None)
+    if message_queue is None:
+        # The standup was cleared by a workspace reset.
+        return
+    string = '\n'.join(message_queue['lines'])
 
     # call messages_send
     # Only call message_send if string is not empty so message_send does not raise exception
     if string != "":
         message_send(token, channel_id, string)
 
-    # remove the standup from QUEUES and STANDUPS
-    del QUEUES[str(channel_id)]
-    for standup in STANDUPS:
-        if standup['channel_id'] == channel_id:
-            STANDUPS.remove(standup)
-
 @input_checkers.validate_token
 @input_checkers.validate_c_id
 def standup_active(token, channel_id):
@@ -52,18 +58,16 @@ def standup_active(token, channel_id):
     # NB: Supressed this warning because token is in fact used in
     # the decorator, however pylint doesn't check for this.
 
-    # Check if standup is active by looking though standups list
-    is_active = False
-    time_finish = None
-    for standup in STANDUPS:
-        if standup['channel_id'] == channel_id:
-            is_active = True
-            time_finish = standup['time_finish']
+    # Check if standup is active by looking it up in STANDUPS
+    standup = STANDUPS.get(channel_id)
+    if standup is None:
+        return {'is_active': False, 'time_finish': None}
 
-    return {'is_active': is_active, 'time_finish': time_finish}
+    return {'is_active': True, 'time_finish': standup['time_finish']}
 
 @input_checkers.validate_token
 @input_checkers.validate_c_id
+@database.locks_channel
 def standup_start(token, channel_id, length):
     """ Start a standup in channel given """
 
@@ -76,30 +80,29 @@ def standup_start(token, channel_id, length):
     dt_finish = now + timedelta(seconds=length)
     time_finish = dt_finish.timestamp()
 
-    # Add details of standup to STANDUPS
-    STANDUPS.append({'channel_id': channel_id,
-                     'time_finish': int(time_finish)})
-
     # Add new message queue to QUEUES
-    QUEUES[str(channel_id)] = []
+    QUEUES[str(channel_id)] = {'lines': [], 'num_bytes': 0}
+
+    # Add details of standup to STANDUPS
+    standup = {'channel_id': channel_id,
+               'time_finish': int(time_finish)}
+    STANDUPS[channel_id] = standup
 
     # Schedule when to send dump queue from QUEUES
-    Timer(length, standup_start_helper, args=[channel_id, token]).start()
+    standup['job'] = scheduler.schedule(time_finish, standup_start_helper, channel_id, token)
 
     return {'time_finish': int(time_finish)}
 
 @input_checkers.validate_token
 @input_checkers.validate_c_id
-def standup_send(token, channel_id, message):
+@database.locks_channel
+def standup_send(token, channel_id, message, *, auth_u_id):
     """ Add a message to standup queue """
-
-    # If token is valid, take u_id which is used to look through users
-    u_id = database.get_current_user(token)
+    # pylint: disable=unused-argument
 
     # Check if user is member of channel that message is within
     # if not then raise an AccessError
-    channel_data = database.get_channel_data(channel_id)
-    if u_id not in channel_data['member_ids']:
+    if not database.is_channel_member(channel_id, auth_u_id):
         raise error.AccessError(description="You are not a member of this channel")
 
     # Check if message if more than 1000 characters long and raise InputError if that is the case
@@ -107,14 +110,36 @@ def standup_send(token, channel_id, message):
         raise error.InputError(description="The message entered is more than 1000 characters long")
 
     # Check if standup is currently active in channel, raise InputError if not
-    if standup_active(token, channel_id)['is_active'] is False:
+    message_queue = QUEUES.get(str(channel_id))
+    if message_queue is None:
         raise error.InputError(description="There are no standups active in this channel")
 
     # Format message to "handle_str: message"
-    handle_str = database.get_user_data(u_id)['handle_str']
+    handle_str = database.get_user_data(auth_u_id)['handle_str']
     string = handle_str + ": " + message
 
-    # Now add string to the appropriate list in queues
-    QUEUES[str(channel_id)].append(string)
+    # Now add string to the appropriate list in queues, as long as the
+    # summary stays within budget
+    # Lines after the first are joined on with a newline.
+    num_bytes = len(string.encode('utf-8')) + (1 if message_queue['lines'] else 0)
+    if message_queue['num_bytes'] + num_bytes > STANDUP_BYTE_BUDGET:
+        raise error.InputError(description="The standup in this channel is full")
+    message_queue['lines'].append(string)
+    message_queue['num_bytes'] += num_bytes
 
     return {}
+
+@input_checkers.validate_token
+@input_checkers.validate_c_id
+@database.locks_channel
+def standup_queue(token, channel_id):
+    """ Return how many messages and bytes are queued in the standup in channel given. """
+    # pylint: disable=unused-argument
+
+    # Check if standup is currently active in channel, raise InputError if not
+    message_queue = QUEUES.get(str(channel_id))
+    if message_queue is None:
+        raise error.InputError(description="There are no standups active in this channel")
+
+    return {'queue_depth': len(message_queue['lines']),
+            'queue_bytes': message_queue['num_bytes']}
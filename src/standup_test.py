@@ -1,5 +1,6 @@
 """ File contains tests for standup functions. """
 
+import threading
 import time
 import pytest
 import standup
@@ -8,6 +9,8 @@ import auth
 import channel
 import channels
 import message
+import database
+import scheduler
 
 @pytest.fixture(autouse=True)
 def clean_standup_database():
@@ -144,6 +147,29 @@ def test_standup_active():
     assert current['time_finish'] == time_finish['time_finish']
     time.sleep(1)
 
+def test_standup_many_channels():
+    """
+    Tests if standups in many channels run without a thread each,
+    and each ends on time.
+    """
+
+    user = auth.auth_register("email@email.com", "password", "Tom", "Nook")
+    channel_ids = [channels.channels_create(user['token'], f"channel{i}", False)['channel_id']
+                   for i in range(50)]
+
+    num_threads = threading.active_count()
+    for channel_id in channel_ids:
+        standup.standup_start(user['token'], channel_id, 1)
+        standup.standup_send(user['token'], channel_id, "message")
+    # At most the scheduler's dispatcher thread is started.
+    assert threading.active_count() <= num_threads + 1
+
+    time.sleep(2)
+    for channel_id in channel_ids:
+        assert standup.standup_active(user['token'], channel_id)['is_active'] is False
+        message_dict = channel.channel_messages(user['token'], channel_id, 0)
+        assert message_dict['messages'][0]['message'] == "tomnook: message"
+
 ##################################################################
 #                                                                #
 #                      Testing standup_send                      #
@@ -224,3 +250,81 @@ def test_standup_send_not_member():
     time.sleep(1)
 
 # Testing for case where standup_send works is integrated into test_standup_start
+
+def test_standup_send_full():
+    """ Tests if standup_send raises an InputError once the standup's byte budget is used. """
+
+    user = auth.auth_register("email@email.com", "password", "Bob", "Ross")
+    channel_dict = channels.channels_create(user['token'], "test_channel", False)
+
+    standup.standup_start(user['token'], channel_dict['channel_id'], 1)
+    # Each line is "bobross: " and 490 characters, so only two lines fit.
+    standup.standup_send(user['token'], channel_dict['channel_id'], 'a' * 490)
+    standup.standup_send(user['token'], channel_dict['channel_id'], 'a' * 490)
+
+    with pytest.raises(error.InputError):
+        standup.standup_send(user['token'], channel_dict['channel_id'], 'a' * 490)
+    time.sleep(2)
+
+    message_dict = channel.channel_messages(user['token'], channel_dict['channel_id'], 0)
+    assert len(message_dict['messages'][0]['message']) == 999
+
+###################################################################
+#                                                                 #
+#                      Testing standup_queue                      #
+#                                                                 #
+###################################################################
+
+def test_standup_queue():
+    """ Tests if standup_queue reports the number of messages and bytes queued. """
+
+    user = auth.auth_register("email@email.com", "password", "Bob", "Ross")
+    channel_dict = channels.channels_create(user['token'], "test_channel", False)
+
+    standup.standup_start(user['token'], channel_dict['channel_id'], 1)
+    assert standup.standup_queue(user['token'], channel_dict['channel_id']) == {
+        'queue_depth': 0, 'queue_bytes': 0}
+
+    standup.standup_send(user['token'], channel_dict['channel_id'], "hi")
+    standup.standup_send(user['token'], channel_dict['channel_id'], "hello")
+    # "bobross: hi\nbobross: hello"
+    assert standup.standup_queue(user['token'], channel_dict['channel_id']) == {
+        'queue_depth': 2, 'queue_bytes': 26}
+    time.sleep(1)
+
+def test_standup_queue_inactive():
+    """ Tests if standup_queue raises an InputError if no standup is active. """
+
+    user = auth.auth_register("email@email.com", "password", "Bob", "Ross")
+    channel_dict = channels.channels_create(user['token'], "test_channel", False)
+
+    with pytest.raises(error.InputError):
+        standup.standup_queue(user['token'], channel_dict['channel_id'])
+
+def test_standup_send_while_ending():
+    """
+    Tests standup_send and standup_queue wait for a standup that is ending
+    to finish ending, then raise an InputError rather than failing.
+    """
+
+    user = auth.auth_register("email@email.com", "password", "Bob", "Ross")
+    c_id = channels.channels_create(user['token'], "test_channel", False)['channel_id']
+    standup.standup_start(user['token'], c_id, 60)
+    standup.standup_send(user['token'], c_id, "hi")
+
+    # End the standup now, while standup_send holds the channel's lock.
+    scheduler.cancel(standup.STANDUPS[c_id]['job'])
+    ending = threading.Thread(target=standup.standup_start_helper, args=(c_id, user['token']))
+    with database.channel_lock(c_id):
+        ending.start()
+        ending.join(0.1)
+        assert ending.is_alive()
+        standup.standup_send(user['token'], c_id, "hello")
+    ending.join()
+
+    with pytest.raises(error.InputError):
+        standup.standup_send(user['token'], c_id, "too late")
+    with pytest.raises(error.InputError):
+        standup.standup_queue(user['token'], c_id)
+    summary = channel.channel_messages(user['token'], c_id, 0)['messages'][0]['message']
+    assert summary == "bobross: hi\nbobross: hello"
@@ -0,0 +1,104 @@
+"""
+Creates the tokens handed out by auth_login, and finds the user a token
+belongs to.
+
+Tokens are HS256 JSON web tokens holding the u_id they were made for. How
+validate_token checks them depends on SLACKR_TOKEN_MODE:
+    sessions (default): the token must be in the sessions table.
+    signed: tokens also hold an expiry time, a random token id and the
+        database's reset count. The token's signature and expiry are
+        checked and its u_id is read from it, so no session is looked up.
+        Logging out revokes the token by its id, which is kept until the
+        token would have expired. Resetting the database counts one more
+        reset, so every token made before it stops being valid.
+Signed tokens let worker processes check tokens without sharing sessions,
+and stay valid across restarts until they expire or are revoked.
+"""
+import os
+import secrets
+import time
+
+import jwt
+
+import database
+
+TOKEN_MODE = os.environ.get("SLACKR_TOKEN_MODE", "sessions")
+TOKEN_MODES = ("sessions", "signed")
+
+# Anyone knowing the secret can make a token for any user, so signed mode
+# needs it set, see check_settings. Sessions mode only hands out tokens
+# stored in the sessions table, so a well known secret does no harm.
+DEFAULT_SECRET = "jwt_secret"
+SECRET = os.environ.get("SLACKR_TOKEN_SECRET", DEFAULT_SECRET)
+
+# How long a token is valid for, in seconds.
+TOKEN_LIFETIME = 24 * 60 * 60
+
+def check_settings():
+    """ Return why the token settings can't be used, or None if they can. """
+
+    if TOKEN_MODE not in TOKEN_MODES:
+        return f"Unknown SLACKR_TOKEN_MODE {TOKEN_MODE}, choose from {', '.join(TOKEN_MODES)}"
+    if TOKEN_MODE == "signed" and SECRET in ("", DEFAULT_SECRET):
+        return ("SLACKR_TOKEN_MODE=signed needs SLACKR_TOKEN_SECRET set to a secret,"
+                " as anyone could sign tokens with the default one.")
+    return None
+
+def create_token(u_id):
+    """ Return a new token for u_id. """
+
+    payload = {'u_id': u_id}
+    if TOKEN_MODE == "signed":
+        payload.update(exp=int(time.time()) + TOKEN_LIFETIME, jti=secrets.token_hex(8),
+                       resets=database.get_reset_count())
+    return str(jwt.encode(payload, SECRET, algorithm='HS256'))
+
+def decode_token(token, verify_exp=True):
+    """
+    Return the payload of a token, or None if it wasn't signed with SECRET,
+    or has expired (unless verify_exp is False).
+    """
+
+    try:
+        return jwt.decode(token, SECRET, algorithms=['HS256'],
+                          options={'verify_exp': verify_exp, 'require': ['exp', 'jti', 'resets']})
+    except jwt.InvalidTokenError:
+        return None
+
+def get_token_user(token):
+    """ Return the u_id a valid token belongs to, or None if the token isn't valid. """
+
+    if TOKEN_MODE != "signed":
+        return database.get_current_user(token)
+
+    payload = decode_token(token)
+    if payload is None or payload['resets'] != database.get_reset_count() \
+            or database.get_user_data(payload['u_id']) is None \
+            or database.is_any_token_revoked([payload['jti'], get_user_token_id(payload['u_id'])]):
+        return None
+    return payload['u_id']
+
+def get_user_token_id(u_id):
+    """ Return the id that revokes every token of u_id, see revoke_user_tokens. """
+
+    return f"user:{u_id}"
+
+def revoke_token(token):
+    """ Stop a signed token from being valid again. Does nothing to other tokens. """
+
+    payload = decode_token(token, verify_exp=False)
+    # Tokens made in sessions mode have no token id, so can't be revoked.
+    if payload is not None:
+        database.revoke_token(payload['jti'], payload['exp'])
+
+def revoke_user_tokens(u_id):
+    """
+    Stop every token made for u_id so far from being valid. For users
+    removed from the slackr, whose tokens may not be in the sessions table,
+    e.g. after a restart.
+    """
+
+    if TOKEN_MODE != "signed":
+        return
+    # Every token made before now has expired by the time this is forgotten.
+    database.revoke_token(get_user_token_id(u_id), time.time() + TOKEN_LIFETIME)
@@ -0,0 +1,166 @@
+"""
+Tests for signed tokens, which are checked without looking up their session.
+"""
+import time
+import jwt
+import pytest
+import database
+import tokens
+import auth
+import admin
+import channels
+import error
+import sqlite_storage
+from database_test import use_tmp_database
+from input_checkers_test import count_calls
+
+@pytest.fixture(autouse=True)
+def signed_tokens(monkeypatch):
+    """ Check tokens by their signature for the length of the test. """
+    monkeypatch.setattr(tokens, "TOKEN_MODE", "signed")
+
+def test_signed_token_valid(monkeypatch):
+    """ A signed token is valid without its session being looked up. """
+    user = auth.auth_register("email@email.com", "password", "first", "user")
+    sessions = count_calls(monkeypatch, "get_current_user")
+
+    channels.channels_create(user['token'], "channel", True)
+    assert tokens.get_token_user(user['token']) == user['u_id']
+    assert sessions == []
+
+def test_signed_token_logout():
+    """ Logging out revokes the token, but not the user's next one. """
+    user = auth.auth_register("email@email.com", "password", "first", "user")
+    auth.auth_logout(user['token'])
+    assert tokens.get_token_user(user['token']) is None
+    with pytest.raises(error.AccessError):
+        channels.channels_create(user['token'], "channel", True)
+
+    token = auth.auth_login("email@email.com", "password")['token']
+    assert tokens.get_token_user(token) == user['u_id']
+
+def test_signed_token_invalid():
+    """ Tokens that are expired, or not signed with the secret, are invalid. """
+    user = auth.auth_register("email@email.com", "password", "first", "user")
+    payload = tokens.decode_token(user['token'])
+
+    expired = jwt.encode(dict(payload, exp=int(time.time()) - 1), tokens.SECRET,
+                         algorithm='HS256')
+    forged = jwt.encode(dict(payload, u_id=payload['u_id'] + 1), "not the secret",
+                        algorithm='HS256')
+    unsigned = jwt.encode({'u_id': payload['u_id']}, tokens.SECRET, algorithm='HS256')
+    for token in (expired, forged, unsigned, "invalid token"):
+        assert tokens.get_token_user(str(token)) is None
+
+def test_removed_user_tokens_revoked():
+    """ Removing a user revokes their tokens, even without a session. """
+    owner = auth.auth_register("email1@email.com", "password", "first", "user")
+    user = auth.auth_register("email2@email.com", "password", "second", "user")
+    # As if the server had restarted, losing the sessions.
+    database.remove_current_user(user['token'])
+
+    admin.remove_user(owner['token'], user['u_id'])
+    assert tokens.get_token_user(user['token']) is None
+    assert tokens.get_token_user(owner['token']) == owner['u_id']
+
+def test_revocations_reloaded(monkeypatch, tmp_path):
+    """ Revoked tokens stay revoked after the database is loaded from disk. """
+    use_tmp_database(monkeypatch, tmp_path)
+    database.open_write_ahead_log()
+    try:
+        user = auth.auth_register("email@email.com", "password", "first", "user")
+        auth.auth_logout(user['token'])
+        token = auth.auth_login("email@email.com", "password")['token']
+    finally:
+        database.close_write_ahead_log()
+    database.clear_database()
+    database.retrieve_data_from_files()
+
+    assert tokens.get_token_user(user['token']) is None
+    assert tokens.get_token_user(token) == user['u_id']
+
+def test_expired_revocations_pruned(monkeypatch):
+    """ Revocations are forgotten once their token would have expired. """
+    database.revoke_token("expired", time.time() - 1)
+    monkeypatch.setitem(database.REVOKED_TOKENS_PRUNED, 'at', 0)
+    database.revoke_token("current", time.time() + 60)
+    assert "expired" not in database.REVOKED_TOKENS
+    assert "current" in database.REVOKED_TOKENS
+
+def test_reset_invalidates_tokens():
+    """ Tokens made before the database was reset aren't valid, even once revoked. """
+    user = auth.auth_register("email@email.com", "password", "first", "user")
+    auth.auth_logout(user['token'])
+    token = auth.auth_login("email@email.com", "password")['token']
+
+    database.clear_database()
+    assert tokens.get_token_user(user['token']) is None
+    assert tokens.get_token_user(token) is None
+    # Registering again gives the same u_id, which the old tokens mustn't reach.
+    new_user = auth.auth_register("email@email.com", "password", "first", "user")
+    assert new_user['u_id'] == user['u_id']
+    assert tokens.get_token_user(user['token']) is None
+    assert tokens.get_token_user(token) is None
+    assert tokens.get_token_user(new_user['token']) == new_user['u_id']
+
+def test_unknown_user_token():
+    """ A correctly signed token for a user that doesn't exist isn't valid. """
+    user = auth.auth_register("email@email.com", "password", "first", "user")
+    payload = tokens.decode_token(user['token'])
+    token = jwt.encode(dict(payload, u_id=user['u_id'] + 1), tokens.SECRET, algorithm='HS256')
+    assert tokens.get_token_user(str(token)) is None
+
+def test_resets_reloaded(monkeypatch, tmp_path):
+    """ Tokens from before a reset stay invalid after the database is loaded from disk. """
+    use_tmp_database(monkeypatch, tmp_path)
+    database.open_write_ahead_log()
+    try:
+        user = auth.auth_register("email@email.com", "password", "first", "user")
+        database.clear_database()
+        new_user = auth.auth_register("email@email.com", "password", "first", "user")
+    finally:
+        database.close_write_ahead_log()
+    database.clear_database()
+    database.retrieve_data_from_files()
+
+    assert tokens.get_token_user(user['token']) is None
+    assert tokens.get_token_user(new_user['token']) == new_user['u_id']
+
+def test_sqlite_revocations(tmp_path):
+    """ Revoked tokens are stored in SQLite, and pruned once expired. """
+    sqlite_storage.open_database(str(tmp_path / "slackr.sqlite3"))
+    database.use_storage_engine(sqlite_storage)
+    try:
+        user = auth.auth_register("email@email.com", "password", "first", "user")
+        auth.auth_logout(user['token'])
+        assert tokens.get_token_user(user['token']) is None
+
+        database.revoke_token("expired", time.time() - 1)
+        database.revoke_token("current", time.time() + 60)
+        assert not database.is_any_token_revoked(["expired"])
+        assert database.is_any_token_revoked(["expired", "current"])
+
+        token = auth.auth_login("email@email.com", "password")['token']
+        database.clear_database()
+        assert database.is_any_token_revoked(["current"])
+        assert tokens.get_token_user(token) is None
+        new_user = auth.auth_register("email@email.com", "password", "first", "user")
+        assert tokens.get_token_user(token) is None
+        assert tokens.get_token_user(new_user['token']) == new_user['u_id']
+    finally:
+        database.use_storage_engine(None)
+
+def test_signed_needs_secret(monkeypatch):
+    """ Signed mode can't be used with the well known default secret. """
+    monkeypatch.setattr(tokens, "SECRET", tokens.DEFAULT_SECRET)
+    assert "SLACKR_TOKEN_SECRET" in tokens.check_settings()
+    monkeypatch.setattr(tokens, "SECRET", "")
+    assert tokens.check_settings() is not None
+
+    monkeypatch.setattr(tokens, "SECRET", "a secret")
+    assert tokens.check_settings() is None
+    monkeypatch.setattr(tokens, "TOKEN_MODE", "sessions")
+    monkeypatch.setattr(tokens, "SECRET", tokens.DEFAULT_SECRET)
+    assert tokens.check_settings() is None
+    monkeypatch.setattr(tokens, "TOKEN_MODE", "unknown")
+    assert tokens.check_settings() is not None
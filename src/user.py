@@ -12,70 +12,71 @@ import input_checkers
 
 @input_checkers.validate_token
 @input_checkers.validate_u_id
-def user_profile(token, u_id):
+def user_profile(token, u_id, *, user):
     """
     Given a token and u_id return a dictionary containing the user's data
     """
     # pylint: disable=unused-argument
     # NB: Supressed this warning because token is in fact used in
     # the decorator, however pylint doesn't check for this.
-    user = database.get_user_data(u_id)
     return {"user": user}
 
 @input_checkers.validate_token
-def user_profile_setname(token, name_first, name_last):
+def user_profile_setname(token, name_first, name_last, *, auth_u_id):
     """
     Given input for first and last name sets user's firtname and lastname if within character limit
     """
+    # pylint: disable=unused-argument
     if (len(name_first) > 50 or name_first == ""):
         raise error.InputError(description="First name is not within 1-50 characters")
 
     if (len(name_last) > 50 or name_last == ""):
         raise error.InputError(description="Last name is not within 1-50 characters")
 
-    u_id = database.get_current_user(token)
-    user = database.get_user_data(u_id)
+    user = database.get_user_data(auth_u_id)
     user['name_first'] = name_first
     user['name_last'] = name_last
     database.set_user_data(user)
 
 @input_checkers.validate_token
 @input_checkers.validate_email_format
-def user_profile_setemail(token, email):
+def user_profile_setemail(token, email, *, auth_u_id):
     """
     Given input for email sets user's email if valid and not taken
     """
-    users = database.get_users()
-    for user in users:
-        if user['email'] is email:
+    # pylint: disable=unused-argument
+    with database.table_lock("users"):
+        # Only another user having it counts as taken.
+        taken_by = database.get_user_by_email(email)
+        if taken_by is not None and taken_by['u_id'] != auth_u_id:
             raise error.InputError(description="This email is already taken")
-    u_id = database.get_current_user(token)
-    user = database.get_user_data(u_id)
-    user['email'] = email
-    database.set_user_data(user)
+        user = database.get_user_data(auth_u_id)
+        user['email'] = email
+        database.set_user_data(user)
 
 @input_checkers.validate_token
-def user_profile_sethandle(token, handle_str):
+def user_profile_sethandle(token, handle_str, *, auth_u_id):
     """
     given input for a handle name set user's handle
     """
+    # pylint: disable=unused-argument
     if (len(handle_str) > 20 or len(handle_str) < 2):
         raise error.InputError(description="Handle is not within 2-20 characters")
-    users = database.get_users()
-    for user in users:
-        if user['handle_str'] is handle_str:
+    with database.table_lock("users"):
+        # Only another user having it counts as taken.
+        taken_by = database.get_user_by_handle(handle_str)
+        if taken_by is not None and taken_by['u_id'] != auth_u_id:
             raise error.InputError(description="Handle is already taken")
-    u_id = database.get_current_user(token)
-    user = database.get_user_data(u_id)
-    user['handle_str'] = handle_str
-    database.set_user_data(user)
+        user = database.get_user_data(auth_u_id)
+        user['handle_str'] = handle_str
+        database.set_user_data(user)
 
 @input_checkers.validate_token
-def user_profile_uploadphoto(token, img_url, x_start, y_start, x_end, y_end):
+def user_profile_uploadphoto(token, img_url, x_start, y_start, x_end, y_end, *, auth_u_id):
     """
     given url of image on the internet, crops it within bounds.
     """
-    # pylint: disable=too-many-arguments
+    # pylint: disable=too-many-arguments,unused-argument
     # This pylint warning is supressed because the function requires 6 arguments
 
     # Get the image from img_url and check if HTTP status of 200 returned
@@ -98,9 +99,7 @@ def user_profile_uploadphoto(token, img_url, x_start, y_start, x_end, y_end):
     # Crop the image to the correct dimensions
     img = img.crop((x_start, y_start, x_end, y_end))
 
-    # Get u_id from token
-    u_id = database.get_current_user(token)
-    img_path = os.path.join(os.path.dirname(__file__), f"static/{u_id}.jpg")
+    img_path = os.path.join(os.path.dirname(__file__), f"static/{auth_u_id}.jpg")
 
     # Save the image in the static directory
     # image saved as {u_id}.jpg
@@ -108,10 +107,10 @@ def user_profile_uploadphoto(token, img_url, x_start, y_start, x_end, y_end):
 
     # serve image from file
 
-    profile_img_url = url_for('static', filename=f"{u_id}.jpg", _external=True)
+    profile_img_url = url_for('static', filename=f"{auth_u_id}.jpg", _external=True)
 
     # Add profile_img_url to database
-    user = database.get_user_data(u_id)
+    user = database.get_user_data(auth_u_id)
     user['profile_img_url'] = profile_img_url
     database.set_user_data(user)
 